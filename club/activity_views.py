@@ -1,6 +1,19 @@
+import csv
+import io
 from .models import Club, Activity
 from .mixins import LoginAndValidateMixin, ClubPermissionCheckMixin
-from global_tools.user_find import update_request_user
+from .pagination import PageSerializer, keyset_page, akeyset_page, decode_cursor, encode_cursor
+from .feasibility import rank_activities
+from .search import member_club_ids, search_activities
+from .geo import bbox_filter, radius_bbox, rank_by_distance
+from .geocoding import geocode
+from .versioning import record_change, club_etag, not_modified, with_etag
+from .stats import activities_changed
+from global_tools.user_find import update_request_user, aupdate_request_user
+from global_tools.row_import import FORMATS, batches, format_for, read_rows
+from global_tools.async_views import AsyncAPIView
+from django.db import transaction
+from django.db.models import Q
 from rest_framework.views import APIView
 from rest_framework import status, serializers
 from rest_framework.response import Response
@@ -13,6 +26,13 @@ class AddActivitySerializer(serializers.Serializer):
   description = serializers.CharField(max_length=1000, required=False)
   link = serializers.CharField(max_length=255, required=False)
   location = serializers.CharField(max_length=255, required=False)
+  latitude = serializers.FloatField(required=False, min_value=-90, max_value=90)
+  longitude = serializers.FloatField(required=False, min_value=-180, max_value=180)
+
+  def validate(self, data):
+    if ('latitude' in data) != ('longitude' in data):
+      raise serializers.ValidationError("Give both latitude and longitude")
+    return super().validate(data)
 class AddActivity(ClubPermissionCheckMixin, APIView):
   def post(self, request, *args, **kwargs):
     update_request_user(request)
@@ -21,20 +41,151 @@ class AddActivity(ClubPermissionCheckMixin, APIView):
     if response:
       return response
     club = self.club
-    data = serializer.validated_data
-    activity = Activity.objects.create(club=club, cost=data.get('cost'), time=data.get('time'), name=data.get('name'))
-    if data.get('description'):
-      activity.description = data.get('description')
-    if data.get('link'):
-      activity.link = data.get('link')
-    if data.get('location'):
-      activity.location = data.get('location')
-    activity.save()
+    activity = build_activity(club, serializer.validated_data)
+    with transaction.atomic():
+      activity.save()
+      record_change(club.id, 'activity.added', activity.to_dict())
+      activities_changed(club.id, added=[activity])
     return Response({"detail": "activity added"}, status=status.HTTP_201_CREATED)
 
-class ActivityViewSerializer(serializers.Serializer):
+def build_activity(club, data):
+  """An unsaved activity from ``AddActivitySerializer`` data, geohash included
+  so it can go through ``bulk_create``."""
+  activity = Activity(club=club, cost=data.get('cost', 0), time=data.get('time'),
+                      name=data.get('name'), description=data.get('description', ''),
+                      link=data.get('link') or None, location=data.get('location') or None)
+  if data.get('latitude') is not None:
+    activity.latitude, activity.longitude = data.get('latitude'), data.get('longitude')
+  elif data.get('location'):
+    activity.latitude, activity.longitude = geocode(data.get('location')) or (None, None)
+  activity.geohash = activity.compute_geohash()
+  return activity
+
+# Rows validated and inserted together by ImportActivities.
+IMPORT_BATCH_SIZE = 500
+# Failing rows listed in an import report; any beyond are only counted.
+MAX_REPORTED_ERRORS = 1000
+
+class ActivityImportRowSerializer(AddActivitySerializer):
+  id = None
+
+class ActivityImportSerializer(serializers.Serializer):
+  id = serializers.IntegerField(required=True)
+  file = serializers.FileField(required=True)
+  format = serializers.ChoiceField(choices=FORMATS, required=False)
+
+  def validate(self, data):
+    if 'format' not in data:
+      data['format'] = format_for(data['file'].name or '')
+      if data['format'] is None:
+        raise serializers.ValidationError("Cannot tell the file format, give format")
+    return super().validate(data)
+class ImportActivities(ClubPermissionCheckMixin, APIView):
+  """Add the activities in an uploaded CSV or NDJSON ``file``, one per row, with the
+  ``add-activity`` fields as columns.
+
+  The file is read a batch of rows at a time, so memory use does not grow with
+  its size. Valid rows are inserted in one transaction; the report lists the
+  line number and errors of every row that was skipped.
+  """
+  def post(self, request, *args, **kwargs):
+    update_request_user(request)
+    serializer = ActivityImportSerializer(data=request.data)
+    response = self.perform_checks(request, serializer, allow_owner=True, allow_admin=True)
+    if response:
+      return response
+
+    club = self.club
+    data = serializer.validated_data
+    stream = io.TextIOWrapper(data['file'].file, encoding='utf-8-sig', newline='')
+    report = {'created': 0, 'failed': 0, 'errors': []}
+    try:
+      with transaction.atomic():
+        for batch in batches(read_rows(stream, data['format']), IMPORT_BATCH_SIZE):
+          activities = []
+          for line_number, row in batch:
+            if row is None:
+              errors = {'non_field_errors': ['Row is not a JSON object']}
+            else:
+              row_serializer = ActivityImportRowSerializer(data=row)
+              if row_serializer.is_valid():
+                activities.append(build_activity(club, row_serializer.validated_data))
+                continue
+              errors = row_serializer.errors
+            report['failed'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+              report['errors'].append({'line': line_number, 'errors': errors})
+          Activity.objects.bulk_create(activities)
+          activities_changed(club.id, added=activities)
+          report['created'] += len(activities)
+        if report['created']:
+          record_change(club.id, 'activities.imported', {'created': report['created']})
+    except (UnicodeDecodeError, csv.Error):
+      return Response({"detail": "The file is not UTF-8 CSV or NDJSON"},
+                      status=status.HTTP_400_BAD_REQUEST)
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+    return Response(report, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_200_OK)
+
+class ActivityViewSerializer(PageSerializer):
+  """Pages of a club's activities, by id or, given a point, by distance from it.
+
+  ``radius_km`` (around the point) and ``bbox`` ([south, west, north, east])
+  limit the results to activities with coordinates in that area.
+  """
   id = serializers.IntegerField(required=True)
+  latitude = serializers.FloatField(required=False, min_value=-90, max_value=90)
+  longitude = serializers.FloatField(required=False, min_value=-180, max_value=180)
+  radius_km = serializers.FloatField(required=False, min_value=0)
+  bbox = serializers.ListField(child=serializers.FloatField(), min_length=4, max_length=4,
+                               required=False)
+
+  def validate_cursor(self, value):
+    values = decode_cursor(value)
+    if values is None or len(values) not in (1, 2):
+      raise serializers.ValidationError("invalid cursor")
+    return values
+
+  def validate_bbox(self, value):
+    south, west, north, east = value
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+      raise serializers.ValidationError("bbox must be [south, west, north, east]")
+    return value
+
+  def validate(self, data):
+    if ('latitude' in data) != ('longitude' in data):
+      raise serializers.ValidationError("Give both latitude and longitude")
+    if 'radius_km' in data and 'latitude' not in data:
+      raise serializers.ValidationError("radius_km needs latitude and longitude")
+    if data.get('cursor') is not None and len(data['cursor']) != (2 if 'latitude' in data else 1):
+      raise serializers.ValidationError("invalid cursor")
+    return super().validate(data)
+
+def area_filter(data):
+  """Restrict activities to the requested area through the geohash index."""
+  area = Q()
+  if data.get('bbox'):
+    area &= bbox_filter(*data['bbox'])
+  if data.get('radius_km') is not None:
+    area &= bbox_filter(*radius_bbox(data['latitude'], data['longitude'], data['radius_km']))
+  return area
+
+def rank_activities_by_distance(rows, data):
+  return rank_by_distance(rows, data['latitude'], data['longitude'], data.get('radius_km'),
+                          data.get('cursor'), data.get('limit'))
+
+def distance_page(ranked, more, activities):
+  """Response body for activities ranked by distance; ``activities`` maps ids to rows."""
+  page = []
+  for distance, activity_id in ranked:
+    if activity_id in activities:
+      item = activities[activity_id].to_dict()
+      item['distance_km'] = round(distance, 3) if distance is not None else None
+      page.append(item)
+  next_cursor = encode_cursor(list(ranked[-1])) if more else None
+  return {"activities": page, "next_cursor": next_cursor}
 class ViewActivities(ClubPermissionCheckMixin, APIView):
+  read_only = True
+  queue_writes = False
   def post(self, request, *args, **kwargs):
     update_request_user(request)
     serializer = ActivityViewSerializer(data=request.data)
@@ -42,10 +193,61 @@ class ViewActivities(ClubPermissionCheckMixin, APIView):
     if response:
       return response
 
-    club = self.club
-    activities = club.activities_planned.all()
-    return Response([activity.to_dict() for activity in activities], 
-                    status=status.HTTP_200_OK)
+    data = serializer.validated_data
+    etag = club_etag(self.club, 'view-activities', data)
+    response = not_modified(request, etag)
+    if response:
+      return response
+    activities = Activity.objects.filter(club_id=self.club.id).filter(area_filter(data))
+    if data.get('latitude') is not None:
+      ranked, more = rank_activities_by_distance(
+        activities.values_list('id', 'latitude', 'longitude'), data)
+      body = distance_page(ranked, more, Activity.objects.in_bulk([row_id for _, row_id in ranked]))
+      return with_etag(Response(body, status=status.HTTP_200_OK), etag)
+    activities, next_cursor = keyset_page(activities, ('id',), data.get('cursor'),
+                                          data.get('limit'))
+    return with_etag(Response({"activities": [activity.to_dict() for activity in activities],
+                               "next_cursor": next_cursor}, status=status.HTTP_200_OK), etag)
+
+class AsyncViewActivities(ClubPermissionCheckMixin, AsyncAPIView):
+  read_only = True
+  queue_writes = False
+  async def post(self, request, *args, **kwargs):
+    await aupdate_request_user(request)
+    serializer = ActivityViewSerializer(data=request.data)
+    response = await self.aperform_checks(request, serializer, allow_owner=True, allow_admin=True,
+                                          allow_member=True)
+    if response:
+      return response
+
+    data = serializer.validated_data
+    etag = club_etag(self.club, 'view-activities', data)
+    response = not_modified(request, etag)
+    if response:
+      return response
+    activities = Activity.objects.filter(club_id=self.club.id).filter(area_filter(data))
+    if data.get('latitude') is not None:
+      ranked, more = rank_activities_by_distance(
+        [row async for row in activities.values_list('id', 'latitude', 'longitude')], data)
+      body = distance_page(ranked, more,
+                           await Activity.objects.ain_bulk([row_id for _, row_id in ranked]))
+      return with_etag(Response(body, status=status.HTTP_200_OK), etag)
+    activities, next_cursor = await akeyset_page(activities, ('id',), data.get('cursor'),
+                                                 data.get('limit'))
+    return with_etag(Response({"activities": [activity.to_dict() for activity in activities],
+                               "next_cursor": next_cursor}, status=status.HTTP_200_OK), etag)
+
+class ActivityFeasibilitySerializer(serializers.Serializer):
+  id = serializers.IntegerField(required=True)
+class ActivityFeasibility(ClubPermissionCheckMixin, APIView):
+  def post(self, request, *args, **kwargs):
+    update_request_user(request)
+    serializer = ActivityFeasibilitySerializer(data=request.data)
+    response = self.perform_checks(request, serializer, allow_owner=True, allow_admin=True, allow_member=True)
+    if response:
+      return response
+
+    return Response(rank_activities(self.club), status=status.HTTP_200_OK)
 
 class ActivityDeleteSerializer(serializers.Serializer):
   id = serializers.IntegerField(required=True)
@@ -64,4 +266,37 @@ class DeleteActivity(ClubPermissionCheckMixin, APIView):
     if not activity:
       return Response({"detail": "activity not found"},
                       status=status.HTTP_404_NOT_FOUND)
-    return Response({"detail": "activity deleted"}, status=status.HTTP_200_OK)
\ No newline at end of file
+    activity_id = activity.id
+    with transaction.atomic():
+      activity.delete()
+      record_change(club.id, 'activity.deleted', {'id': activity_id})
+      activities_changed(club.id, removed=[activity])
+    return Response({"detail": "activity deleted"}, status=status.HTTP_200_OK)
+
+class ActivitySearchSerializer(serializers.Serializer):
+  id = serializers.IntegerField(required=False)
+  query = serializers.CharField(max_length=255, required=True)
+  limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+class SearchActivities(ClubPermissionCheckMixin, APIView):
+  """Activities matching ``query`` in the club ``id``, or in all of the caller's clubs."""
+  read_only = True
+  queue_writes = False
+  def post(self, request, *args, **kwargs):
+    update_request_user(request)
+    serializer = ActivitySearchSerializer(data=request.data)
+    data = serializer.validated_data if serializer.is_valid() else {}
+    if data.get('id') is not None:
+      response = self.perform_checks(request, serializer, allow_owner=True, allow_admin=True,
+                                     allow_member=True)
+    else:
+      response = LoginAndValidateMixin.perform_checks(self, request, serializer)
+    if response:
+      return response
+
+    if self.club is not None:
+      club_ids = Club.objects.filter(id=self.club.id).values('id')
+    else:
+      club_ids = member_club_ids(request.user)
+    activities = search_activities(club_ids, data.get('query'), data.get('limit'))
+    return Response({"activities": [activity.to_dict() for activity in activities]},
+                    status=status.HTTP_200_OK)
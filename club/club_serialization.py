@@ -0,0 +1,79 @@
+from django.db.models import Prefetch, prefetch_related_objects
+from huddl.models import User, USER_DICT_FIELDS
+from .pagination import DEFAULT_PAGE_SIZE, keyset_page, akeyset_page
+
+MEMBER_ORDERING = ('id',)
+
+def club_lookups(include_owner=False, include_admin=False, include_members=False):
+  """The select_related and prefetch_related lookups needed by ``Club.to_dict``."""
+  related = ['owner'] if include_owner else []
+  prefetches = []
+  if include_admin:
+    prefetches.append(Prefetch('admin', queryset=User.objects.only(*USER_DICT_FIELDS)))
+  if include_members:
+    prefetches.append(Prefetch('members', queryset=User.objects.only(*USER_DICT_FIELDS)))
+  return related, prefetches
+
+def serialize_clubs(clubs, include_owner=False, include_admin=False, include_members=False,
+                    include_join_info=False):
+  """Serialize a queryset of clubs with a fixed number of queries.
+
+  Returns the same dicts as calling ``to_dict`` on every club, and builds each
+  user's dict only once even when the user appears in many clubs.
+  """
+  related, prefetches = club_lookups(include_owner, include_admin, include_members)
+  if related:
+    clubs = clubs.select_related(*related)
+  clubs = clubs.prefetch_related(*prefetches)
+  user_dicts = {}
+  return [club.to_dict(include_owner=include_owner, include_admin=include_admin,
+                       include_members=include_members, include_join_info=include_join_info,
+                       user_dicts=user_dicts) for club in clubs]
+
+async def aserialize_clubs(clubs, include_owner=False, include_admin=False, include_members=False,
+                           include_join_info=False):
+  related, prefetches = club_lookups(include_owner, include_admin, include_members)
+  if related:
+    clubs = clubs.select_related(*related)
+  clubs = clubs.prefetch_related(*prefetches)
+  user_dicts = {}
+  return [club.to_dict(include_owner=include_owner, include_admin=include_admin,
+                       include_members=include_members, include_join_info=include_join_info,
+                       user_dicts=user_dicts) async for club in clubs]
+
+def serialize_club(club, include_owner=False, include_admin=False, include_members=False,
+                   include_join_info=False, members_cursor=None, members_limit=DEFAULT_PAGE_SIZE):
+  """Serialize a single, already loaded club with the same query plan.
+
+  The member list is paginated by user id; the cursor for the next page is
+  returned as ``members_next_cursor``.
+  """
+  related, prefetches = club_lookups(include_owner, include_admin)
+  prefetch_related_objects([club], *related, *prefetches)
+  user_dicts = {}
+  ret = club.to_dict(include_owner=include_owner, include_admin=include_admin,
+                     include_join_info=include_join_info, user_dicts=user_dicts)
+  if include_members:
+    members, next_cursor = keyset_page(club.members.only(*USER_DICT_FIELDS), MEMBER_ORDERING,
+                                       members_cursor, members_limit)
+    ret['members'] = [user.to_dict_cached(user_dicts) for user in members]
+    ret['members_next_cursor'] = next_cursor
+  return ret
+
+async def aserialize_club(club, include_owner=False, include_admin=False, include_members=False,
+                          include_join_info=False, members_cursor=None,
+                          members_limit=DEFAULT_PAGE_SIZE):
+  user_dicts = {}
+  ret = club.to_dict(include_join_info=include_join_info)
+  if include_owner:
+    owner = await User.objects.only(*USER_DICT_FIELDS).aget(id=club.owner_id)
+    ret['owner'] = owner.to_dict_cached(user_dicts)
+  if include_admin:
+    ret['admin'] = [user.to_dict_cached(user_dicts)
+                    async for user in club.admin.only(*USER_DICT_FIELDS)]
+  if include_members:
+    members, next_cursor = await akeyset_page(club.members.only(*USER_DICT_FIELDS),
+                                              MEMBER_ORDERING, members_cursor, members_limit)
+    ret['members'] = [user.to_dict_cached(user_dicts) for user in members]
+    ret['members_next_cursor'] = next_cursor
+  return ret
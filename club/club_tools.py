@@ -1,9 +1,126 @@
-import string
-from random import choice
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from .models import Club
 
-def generate_join_id(length=24):
-  cur_id = ''.join(choice(string.ascii_letters) for _ in range(length))
-  while Club.objects.filter(join_id=cur_id).exists():
-    cur_id = ''.join(choice(string.ascii_letters) for _ in range(length))
-  return cur_id
\ No newline at end of file
+# Crockford base32: no I, L, O or U, so codes survive being read aloud or
+# retyped, and 32 symbols let every random byte map to a symbol without bias.
+JOIN_CODE_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+JOIN_CODE_LENGTH = 8
+JOIN_CODE_POOL_SIZE = 256
+JOIN_CODE_ATTEMPTS = 5
+JOIN_CODE_CACHE_SIZE = 1024
+JOIN_CODE_CACHE_TTL = 10
+
+_pool = deque()
+_pool_lock = threading.Lock()
+
+def _fill_pool(length):
+  raw = secrets.token_bytes(JOIN_CODE_POOL_SIZE * length)
+  symbols = ''.join(JOIN_CODE_ALPHABET[byte & 31] for byte in raw)
+  _pool.extend(symbols[i:i + length] for i in range(0, len(symbols), length))
+
+def generate_join_id(length=JOIN_CODE_LENGTH):
+  """Take a random join code from a pool pre-generated with the ``secrets`` CSPRNG.
+
+  Codes are not checked against the database; callers save them through
+  ``save_with_join_id`` and let the unique constraint reject the rare clash.
+  """
+  if length != JOIN_CODE_LENGTH:
+    return ''.join(secrets.choice(JOIN_CODE_ALPHABET) for _ in range(length))
+  with _pool_lock:
+    if not _pool:
+      _fill_pool(length)
+    return _pool.popleft()
+
+def save_with_join_id(save):
+  """Call ``save(join_id)`` with fresh codes until one passes the unique constraint."""
+  for attempt in range(JOIN_CODE_ATTEMPTS):
+    try:
+      with transaction.atomic():
+        return save(generate_join_id())
+    except IntegrityError:
+      if attempt == JOIN_CODE_ATTEMPTS - 1:
+        raise
+
+def normalize_join_id(join_id):
+  """Map what a person typed onto a generated code.
+
+  Older 24-letter join ids are case sensitive and are returned unchanged.
+  """
+  join_id = join_id.strip()
+  code = join_id.upper().replace('-', '').replace(' ', '')
+  if len(code) != JOIN_CODE_LENGTH:
+    return join_id
+  return code.translate(str.maketrans('ILO', '110'))
+
+class JoinCodeCache:
+  """Small LRU of join code lookups, including codes that matched nothing."""
+  def __init__(self, max_entries, ttl):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, code):
+    with self.lock:
+      entry = self.entries.get(code)
+      if entry is None or entry[1] <= time.monotonic():
+        return None
+      self.entries.move_to_end(code)
+      return entry
+
+  def set(self, code, club):
+    with self.lock:
+      self.entries[code] = (club, time.monotonic() + self.ttl)
+      self.entries.move_to_end(code)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+  def delete(self, code):
+    with self.lock:
+      self.entries.pop(code, None)
+
+join_code_cache = JoinCodeCache(JOIN_CODE_CACHE_SIZE, JOIN_CODE_CACHE_TTL)
+
+def resolve_join_id(join_id):
+  """Find the club a join code currently admits people to.
+
+  Returns the club's id or ``None``. The lookup goes through the
+  unique index on ``join_id`` and is cached briefly in-process, so a burst of
+  joins on a freshly posted code costs one query per worker. The cache can lag
+  behind changes made in other workers; ``use_join_id`` has the final say.
+  """
+  code = normalize_join_id(join_id)
+  entry = join_code_cache.get(code)
+  if entry is None:
+    club = Club.objects.filter(join_id=code) \
+      .values_list('id', 'join_enabled', 'join_expires_at').first()
+    join_code_cache.set(code, club)
+  else:
+    club = entry[0]
+  if club is None:
+    return None
+  club_id, join_enabled, expires_at = club
+  if not join_enabled or (expires_at is not None and expires_at <= timezone.now()):
+    return None
+  return club_id
+
+def use_join_id(club_id, join_id):
+  """Count one use of a club's join code against the club row itself.
+
+  False if the code was changed, disabled or has expired since it was cached,
+  or once its usage limit is reached.
+  """
+  return Club.objects.filter(id=club_id, join_enabled=True, join_id=normalize_join_id(join_id)) \
+    .filter(Q(join_expires_at__isnull=True) | Q(join_expires_at__gt=timezone.now())) \
+    .filter(Q(join_max_uses__isnull=True) | Q(join_uses__lt=F('join_max_uses'))) \
+    .update(join_uses=F('join_uses') + 1) == 1
+
+def forget_join_id(join_id):
+  if join_id:
+    join_code_cache.delete(join_id)
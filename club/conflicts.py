@@ -0,0 +1,26 @@
+from .models import Club, FinalPlan
+
+def find_conflicts(club, start_time, end_time, exclude_plan_id=None):
+  """Members of ``club`` who already have a plan overlapping ``[start_time, end_time)``.
+
+  Looks through the plans of every club those members belong to, including
+  ``club`` itself, in one query: overlapping plans are found through the
+  ``(club, start_time)`` index and joined to the memberships of ``club``'s
+  members, so the cost does not grow by a query per member or per club.
+  """
+  club_members = Club.members.through.objects.filter(club_id=club.id).values('user_id')
+  plans = FinalPlan.objects.filter(start_time__lt=end_time, end_time__gt=start_time,
+                                   club__members__in=club_members)
+  if exclude_plan_id is not None:
+    plans = plans.exclude(id=exclude_plan_id)
+  rows = plans.values_list('club__members__email', 'id', 'club_id', 'start_time', 'end_time') \
+    .order_by('club__members__id', 'start_time', 'id')
+  conflicts = {}
+  for email, plan_id, club_id, plan_start, plan_end in rows:
+    conflicts.setdefault(email, []).append({
+      'id': plan_id,
+      'club_id': club_id,
+      'start_time': plan_start,
+      'end_time': plan_end
+    })
+  return [{'email': email, 'plans': plans} for email, plans in conflicts.items()]
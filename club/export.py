@@ -0,0 +1,133 @@
+import csv
+import io
+import json
+import zlib
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.duration import duration_string
+from rest_framework.utils.encoders import JSONEncoder
+from huddl.models import User
+from .models import Activity, Club, ClubProfile, FinalPlan
+
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+# Rows fetched from the database at a time.
+CHUNK_SIZE = 2000
+# Output gathered before it is (compressed and) handed to the server.
+FLUSH_BYTES = 64 * 1024
+
+USER_COLUMNS = ('id', 'username', 'email', 'full_name')
+COLUMNS = {
+  'club': ('id', 'name', 'description', 'owner_email', 'join_enabled', 'version', 'exported_at'),
+  'members': ('role', *USER_COLUMNS),
+  'profiles': ('user_id', 'email', 'budget_limit', 'maximum_time'),
+  'activities': ('id', 'name', 'cost', 'time', 'description', 'link', 'location', 'latitude',
+                 'longitude'),
+  'plans': ('id', 'activity_id', 'activity_name', 'start_time', 'end_time'),
+}
+
+@contextmanager
+def read_snapshot(using):
+  """A transaction whose queries all see the database as it was at the first one.
+
+  On SQLite it begins DEFERRED rather than taking the write lock (see
+  global_tools/sqlite), so writers carry on while it is open.
+  """
+  connection = connections[using]
+  override = getattr(connection, 'override_transaction_mode', None)
+  with override('DEFERRED') if override else nullcontext(), transaction.atomic(using=using):
+    if connection.vendor == 'postgresql':
+      with connection.cursor() as cursor:
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+    yield
+
+def club_sections(club_id, using):
+  """``(section, rows)`` pairs for everything in the club; rows are tuples in
+  ``COLUMNS[section]`` order, read ``CHUNK_SIZE`` at a time."""
+  club = (Club.objects.using(using).filter(id=club_id)
+          .values_list('id', 'name', 'description', 'owner__email', 'join_enabled', 'version'))
+  yield 'club', (row + (timezone.now(),) for row in club)
+
+  def role_rows(role, users):
+    return ((role, *row) for row in users.order_by('id').values_list(*USER_COLUMNS)
+            .iterator(chunk_size=CHUNK_SIZE))
+  users = User.objects.using(using)
+  yield 'members', role_rows('owner', users.filter(clubs_owned__id=club_id))
+  yield 'members', role_rows('admin', users.filter(clubs_managing__id=club_id))
+  yield 'members', role_rows('member', users.filter(clubs_in__id=club_id))
+
+  yield 'profiles', (ClubProfile.objects.using(using).filter(club_id=club_id).order_by('id')
+                     .values_list('user_id', 'user__email', 'budget_limit', 'maximum_time')
+                     .iterator(chunk_size=CHUNK_SIZE))
+  yield 'activities', (Activity.objects.using(using).filter(club_id=club_id).order_by('id')
+                       .values_list(*COLUMNS['activities']).iterator(chunk_size=CHUNK_SIZE))
+  yield 'plans', (FinalPlan.objects.using(using).filter(club_id=club_id).order_by('id')
+                  .values_list('id', 'activity_id', 'activity__name', 'start_time', 'end_time')
+                  .iterator(chunk_size=CHUNK_SIZE))
+
+def ndjson_lines(sections):
+  """One ``{"section": ..., <column>: <value>, ...}`` object per row, encoded like
+  API responses."""
+  encoder = JSONEncoder()
+  for section, rows in sections:
+    columns = COLUMNS[section]
+    for row in rows:
+      yield json.dumps({'section': section, **dict(zip(columns, row, strict=True))},
+                       default=encoder.default) + '\n'
+
+def csv_value(value):
+  if value is None:
+    return ''
+  if isinstance(value, timedelta):
+    return duration_string(value)
+  if isinstance(value, datetime):
+    return value.isoformat()
+  return value
+
+def csv_lines(sections):
+  """Each section as its name on a line of its own, a header row and the rows,
+  with a blank line between sections."""
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  current = None
+  for section, rows in sections:
+    if section != current:
+      if current is not None:
+        writer.writerow([])
+      writer.writerow([section])
+      writer.writerow(COLUMNS[section])
+      current = section
+    for row in rows:
+      writer.writerow([csv_value(value) for value in row])
+      yield buffer.getvalue()
+      buffer.seek(0)
+      buffer.truncate()
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+def export_chunks(club_id, fmt, using, compress=False):
+  """The club export as byte chunks of about ``FLUSH_BYTES``, gzipped if ``compress``.
+
+  All sections are read in one snapshot, so the export is consistent even
+  while the club changes.
+  """
+  compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+  render = ndjson_lines if fmt == 'ndjson' else csv_lines
+  pending = []
+  size = 0
+  with read_snapshot(using):
+    for text in render(club_sections(club_id, using)):
+      pending.append(text)
+      size += len(text)
+      if size >= FLUSH_BYTES:
+        data = ''.join(pending).encode()
+        pending, size = [], 0
+        yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else data
+  data = ''.join(pending).encode()
+  if compressor:
+    data = compressor.compress(data) + compressor.flush()
+  if data:
+    yield data
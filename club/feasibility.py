@@ -0,0 +1,93 @@
+from datetime import timedelta
+import numpy as np
+from .models import Activity, ClubProfile
+
+BLOCK_SIZE = 64
+
+def to_cents(amount):
+  return int(amount * 100)
+
+def to_microseconds(duration):
+  return duration // timedelta(microseconds=1)
+
+def fit_counts(budgets, max_times, costs, times, block_size=BLOCK_SIZE):
+  """Count, for every activity, the members whose budget and time limit both fit it.
+
+  This is the column sum of the member x activity matrix
+  ``(budgets[:, None] >= costs) & (max_times[:, None] >= times)`` without
+  materializing it. Sorted by budget (descending), the members who can afford
+  an activity form a prefix. Whole blocks of that prefix are answered from a
+  cumulative table of time limit ranks per block; the one partial block left
+  over is compared directly.
+  """
+  budgets = np.asarray(budgets, dtype=np.int64)
+  max_times = np.asarray(max_times, dtype=np.int64)
+  costs = np.asarray(costs, dtype=np.int64)
+  times = np.asarray(times, dtype=np.int64)
+  if len(budgets) == 0 or len(costs) == 0:
+    return np.zeros(len(costs), dtype=np.int64)
+  order = np.argsort(-budgets, kind='stable')
+  budgets = budgets[order]
+  max_times = max_times[order]
+  affordable = np.searchsorted(-budgets, -costs, side='right')
+
+  limits = np.unique(max_times)
+  member_rank = np.searchsorted(limits, max_times).astype(np.int32)
+  activity_rank = np.searchsorted(limits, times, side='left').astype(np.int32)
+  n_blocks = len(budgets) // block_size
+  covered = n_blocks * block_size
+  width = len(limits) + 1
+  # below[w, r]: members in the first w blocks whose limit rank is below r.
+  below = np.zeros((n_blocks + 1, width), dtype=np.int32)
+  block_of = np.arange(covered) // block_size
+  below[1:] = np.bincount(block_of * width + member_rank[:covered] + 1,
+                          minlength=n_blocks * width).reshape(n_blocks, width)
+  np.cumsum(below, axis=0, out=below)
+  np.cumsum(below, axis=1, out=below)
+
+  whole = affordable // block_size
+  counts = whole * block_size - below[whole, activity_rank]
+  offsets = np.arange(block_size)
+  partial = np.where(offsets < (affordable - whole * block_size)[:, None],
+                     whole[:, None] * block_size + offsets, len(budgets))
+  member_rank = np.append(member_rank, np.int32(-1))
+  counts += np.count_nonzero(member_rank[partial] >= activity_rank[:, None], axis=1)
+  return counts
+
+def member_limits(club):
+  """Budget (cents) and time limit (microseconds) arrays for every club member.
+
+  Members without a club profile fall back to their account defaults.
+  """
+  profiles = {user_id: (budget, max_time) for user_id, budget, max_time in
+              ClubProfile.objects.filter(club=club)
+              .values_list('user_id', 'budget_limit', 'maximum_time')}
+  members = club.members.values_list('id', 'default_budget_limit', 'default_max_time')
+  budgets = []
+  max_times = []
+  for user_id, default_budget, default_time in members:
+    budget, max_time = profiles.get(user_id, (default_budget, default_time))
+    budgets.append(to_cents(budget))
+    max_times.append(to_microseconds(max_time))
+  return np.array(budgets, dtype=np.int64), np.array(max_times, dtype=np.int64)
+
+def rank_activities(club):
+  """Rank a club's activities by the fraction of members who can afford and fit them."""
+  budgets, max_times = member_limits(club)
+  activities = list(Activity.objects.filter(club=club).values_list('id', 'name', 'cost', 'time'))
+  costs = [to_cents(cost) for _, _, cost, _ in activities]
+  times = [to_microseconds(time) for _, _, _, time in activities]
+  counts = fit_counts(budgets, max_times, costs, times)
+  member_count = len(budgets)
+  ranked = []
+  for (activity_id, name, cost, time), count in zip(activities, counts.tolist(), strict=True):
+    ranked.append({
+      'id': activity_id,
+      'name': name,
+      'cost': cost,
+      'time': time,
+      'fit_count': count,
+      'fit_fraction': count / member_count if member_count else 0.0
+    })
+  ranked.sort(key=lambda activity: (-activity['fit_count'], activity['id']))
+  return {'member_count': member_count, 'activities': ranked}
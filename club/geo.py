@@ -0,0 +1,127 @@
+import math
+from django.db.models import Q
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+# Most geohash cells scanned for one query; coarser cells are used beyond it.
+MAX_CELLS = 16
+EARTH_RADIUS_KM = 6371.0088
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+  """Standard base32 geohash; shared prefixes mean nearby points."""
+  lat_range = [-90.0, 90.0]
+  lng_range = [-180.0, 180.0]
+  code = []
+  bits = 0
+  value = 0
+  even = True
+  while len(code) < precision:
+    span, coordinate = (lng_range, longitude) if even else (lat_range, latitude)
+    middle = (span[0] + span[1]) / 2
+    value <<= 1
+    if coordinate >= middle:
+      value |= 1
+      span[0] = middle
+    else:
+      span[1] = middle
+    even = not even
+    bits += 1
+    if bits == 5:
+      code.append(GEOHASH_ALPHABET[value])
+      bits = 0
+      value = 0
+  return ''.join(code)
+
+def cell_size(precision):
+  """``(height, width)`` in degrees of a geohash cell of ``precision`` characters."""
+  lat_bits = 5 * precision // 2
+  lng_bits = 5 * precision - lat_bits
+  return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+def covering_cells(south, west, north, east):
+  """Geohash prefixes of the cells covering a box that does not cross the antimeridian.
+
+  Picks the finest precision needing at most ``MAX_CELLS`` cells.
+  """
+  for precision in range(GEOHASH_PRECISION, 0, -1):
+    height, width = cell_size(precision)
+    rows = math.floor((north + 90) / height) - math.floor((south + 90) / height) + 1
+    columns = math.floor((east + 180) / width) - math.floor((west + 180) / width) + 1
+    if rows * columns <= MAX_CELLS or precision == 1:
+      break
+  cells = set()
+  latitude = south
+  while True:
+    longitude = west
+    while True:
+      cells.add(geohash(min(latitude, 90.0), min(longitude, 180.0), precision))
+      if longitude >= east:
+        break
+      longitude = min(longitude + width, east)
+    if latitude >= north:
+      break
+    latitude = min(latitude + height, north)
+  return cells
+
+def bbox_filter(south, west, north, east):
+  """A ``Q`` for activities inside a bounding box.
+
+  Each covering cell becomes a range on the indexed ``geohash`` column, so
+  only rows in those cells are read; the coordinate bounds then trim the
+  cell edges. ``west > east`` means the box crosses the antimeridian.
+  """
+  if west > east:
+    return bbox_filter(south, west, north, 180.0) | bbox_filter(south, -180.0, north, east)
+  cells = Q()
+  for prefix in covering_cells(south, west, north, east):
+    # '~' sorts after every geohash character.
+    cells |= Q(geohash__gte=prefix, geohash__lt=prefix + '~')
+  return cells & Q(latitude__gte=south, latitude__lte=north,
+                   longitude__gte=west, longitude__lte=east)
+
+def radius_bbox(latitude, longitude, radius_km):
+  """``(south, west, north, east)`` of a box containing the circle around a point."""
+  delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+  south = max(latitude - delta_lat, -90.0)
+  north = min(latitude + delta_lat, 90.0)
+  if south == -90.0 or north == 90.0:
+    return south, -180.0, north, 180.0
+  # The circle is widest poleward of its centre, hence asin rather than a
+  # plain division by cos(latitude).
+  ratio = math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude))
+  if ratio >= 1.0:
+    return south, -180.0, north, 180.0
+  delta_lng = math.degrees(math.asin(ratio))
+  west = (longitude - delta_lng + 540.0) % 360.0 - 180.0
+  east = (longitude + delta_lng + 540.0) % 360.0 - 180.0
+  return south, west, north, east
+
+def distance_km(latitude, longitude, other_latitude, other_longitude):
+  """Great-circle (haversine) distance."""
+  lat1, lng1, lat2, lng2 = map(math.radians, (latitude, longitude, other_latitude, other_longitude))
+  a = (math.sin((lat2 - lat1) / 2) ** 2 +
+       math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+  return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def rank_by_distance(rows, latitude, longitude, radius_km=None, cursor=None, limit=None):
+  """Order ``(id, latitude, longitude)`` rows by distance from a point.
+
+  Rows without coordinates come last, and beyond ``radius_km`` are dropped.
+  ``cursor`` is the ``[distance, id]`` of the last row already returned.
+  Returns ``(ranked, more)`` where ``ranked`` holds ``(distance, id)`` pairs.
+  """
+  ranked = []
+  for row_id, row_latitude, row_longitude in rows:
+    distance = None
+    if row_latitude is not None and row_longitude is not None:
+      distance = distance_km(latitude, longitude, row_latitude, row_longitude)
+    if radius_km is not None and (distance is None or distance > radius_km):
+      continue
+    ranked.append((distance is None, distance or 0.0, row_id))
+  ranked.sort()
+  if cursor is not None:
+    after = (cursor[0] is None, cursor[0] or 0.0, cursor[1])
+    ranked = [key for key in ranked if key > after]
+  more = limit is not None and len(ranked) > limit
+  ranked = ranked[:limit]
+  return [(None if missing else distance, row_id) for missing, distance, row_id in ranked], more
@@ -0,0 +1,61 @@
+import logging
+import re
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+  'BACKEND': 'club.geocoding.OfflineGeocoder',
+  'PLACES': {},
+}
+COORDINATES = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+logger = logging.getLogger(__name__)
+
+def get_setting(name):
+  return getattr(settings, 'GEOCODING', {}).get(name, DEFAULTS[name])
+
+class OfflineGeocoder:
+  """Geocoder that never touches the network.
+
+  Understands ``"latitude, longitude"`` strings and the place names listed
+  in ``GEOCODING['PLACES']`` (matched case-insensitively). Other backends
+  implement the same ``geocode(location)`` method.
+  """
+  def __init__(self):
+    self.places = {name.strip().lower(): tuple(point)
+                   for name, point in get_setting('PLACES').items()}
+
+  def geocode(self, location):
+    """``(latitude, longitude)`` for ``location``, or None if it is unknown."""
+    match = COORDINATES.match(location)
+    if match:
+      latitude, longitude = float(match.group(1)), float(match.group(2))
+      if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+        return latitude, longitude
+      return None
+    return self.places.get(location.strip().lower())
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+def get_geocoder():
+  global _geocoder
+  with _geocoder_lock:
+    if _geocoder is None:
+      _geocoder = import_string(get_setting('BACKEND'))()
+    return _geocoder
+
+def geocode(location):
+  """Coordinates for a free-text location; None when it cannot be resolved.
+
+  A failing backend must not fail the request that saves the activity, so
+  its errors are logged and treated as "unknown".
+  """
+  if not location:
+    return None
+  try:
+    return get_geocoder().geocode(location)
+  except Exception:
+    logger.exception('geocoding %r failed', location)
+    return None
@@ -1,13 +1,29 @@
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, serializers
+from rest_framework.utils.encoders import JSONEncoder
 from .models import Club, ClubProfile
 from .mixins import LoginAndValidateMixin, ClubPermissionCheckMixin
-from global_tools.user_find import update_request_user
+from .club_serialization import serialize_club, serialize_clubs, aserialize_club, aserialize_clubs
+from .plans import PLAN_ORDERING, club_plans
+from .club_tools import resolve_join_id, use_join_id
+from .stats import budgets_changed, members_changed
+from .versioning import record_change, changes_since, club_channel, club_etag, not_modified, with_etag
+from .pagination import MemberPageSerializer, PageSerializer, keyset_page, akeyset_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from global_tools.user_find import update_request_user, aupdate_request_user
+from global_tools.async_views import AsyncAPIView
+from global_tools.push import get_broker, get_setting as push_setting, push_enabled, sse_message
 
 class ClubsInSerializer(serializers.Serializer):
   detailed = serializers.BooleanField(required=False, default=False)
 class GetClubsIn(LoginAndValidateMixin, APIView):
+  read_only = True
+  queue_writes = False
   def post(self, request, *args, **kwargs):
     update_request_user(request)
     serializer = ClubsInSerializer(data=request.data)
@@ -17,14 +33,30 @@ class GetClubsIn(LoginAndValidateMixin, APIView):
     validated_data = serializer.validated_data
     is_detailed = validated_data.get('detailed')
     clubs = request.user.clubs_in.all()
-    info = [club.to_dict(include_owner=is_detailed, include_admin=is_detailed, 
-                         include_members=is_detailed) for club in clubs]
+    info = serialize_clubs(clubs, include_owner=is_detailed, include_admin=is_detailed,
+                           include_members=is_detailed)
     return Response({"clubs": info}, status=status.HTTP_200_OK)
 
-class GetClubSerializer(serializers.Serializer):
+class AsyncGetClubsIn(LoginAndValidateMixin, AsyncAPIView):
+  read_only = True
+  queue_writes = False
+  async def post(self, request, *args, **kwargs):
+    await aupdate_request_user(request)
+    serializer = ClubsInSerializer(data=request.data)
+    response = self.perform_checks(request, serializer)
+    if response:
+      return response
+    is_detailed = serializer.validated_data.get('detailed')
+    info = await aserialize_clubs(request.user.clubs_in.all(), include_owner=is_detailed,
+                                  include_admin=is_detailed, include_members=is_detailed)
+    return Response({"clubs": info}, status=status.HTTP_200_OK)
+
+class GetClubSerializer(MemberPageSerializer):
   id = serializers.IntegerField(required=True)
   detailed = serializers.BooleanField(default=False)
 class GetClub(ClubPermissionCheckMixin, APIView):
+  read_only = True
+  queue_writes = False
   def post(self, request, *args, **kwargs):
     update_request_user(request)
     serializer = GetClubSerializer(data=request.data)
@@ -34,9 +66,39 @@ class GetClub(ClubPermissionCheckMixin, APIView):
       return response
     data = serializer.validated_data
     club = self.club
+    etag = club_etag(club, 'group-info', data)
+    response = not_modified(request, etag)
+    if response:
+      return response
+    detailed = data.get('detailed')
+    return with_etag(Response(serialize_club(club, include_owner=detailed, include_admin=detailed, 
+                                             include_members=detailed,
+                                             members_cursor=data.get('members_cursor'),
+                                             members_limit=data.get('members_limit')),
+                              status=status.HTTP_200_OK), etag)
+
+class AsyncGetClub(ClubPermissionCheckMixin, AsyncAPIView):
+  read_only = True
+  queue_writes = False
+  async def post(self, request, *args, **kwargs):
+    await aupdate_request_user(request)
+    serializer = GetClubSerializer(data=request.data)
+    response = await self.aperform_checks(request, serializer, allow_owner=True,
+                                          allow_admin=True, allow_member=True)
+    if response:
+      return response
+    data = serializer.validated_data
+    etag = club_etag(self.club, 'group-info', data)
+    response = not_modified(request, etag)
+    if response:
+      return response
     detailed = data.get('detailed')
-    return Response(club.to_dict(include_owner=detailed, include_admin=detailed, 
-                                 include_members=detailed), status=status.HTTP_200_OK)
+    return with_etag(Response(await aserialize_club(self.club, include_owner=detailed,
+                                                    include_admin=detailed,
+                                                    include_members=detailed,
+                                                    members_cursor=data.get('members_cursor'),
+                                                    members_limit=data.get('members_limit')),
+                              status=status.HTTP_200_OK), etag)
 
 class JoinClubSerializer(serializers.Serializer):
   join_id = serializers.CharField(required=True, max_length=255, allow_blank=False)
@@ -50,13 +112,21 @@ class JoinClub(LoginAndValidateMixin, APIView):
       
     validated_data = serializer.validated_data
     join_id = validated_data.get('join_id')
-    valid_clubs = Club.objects.filter(join_enabled=True, join_id=join_id)
-    if not valid_clubs.exists():
+    club_id = resolve_join_id(join_id)
+    if club_id is None:
       return Response({"detail": "invalid join id"}, status=status.HTTP_404_NOT_FOUND)
-    club = valid_clubs.first()
-    club.members.add(request.user)
-    club.save()
-    
+    with transaction.atomic():
+      _, created = Club.members.through.objects.get_or_create(club_id=club_id,
+                                                              user_id=request.user.id)
+      if not created:
+        return Response({"detail": "user added to group"}, status=status.HTTP_200_OK)
+      # Only a join that added the member counts as a use of the code.
+      if not use_join_id(club_id, join_id):
+        transaction.set_rollback(True)
+        return Response({"detail": "invalid join id"}, status=status.HTTP_404_NOT_FOUND)
+      record_change(club_id, 'member.joined', {'user': request.user.to_dict()})
+      members_changed(club_id)
+
     return Response({"detail": "user added to group"}, status=status.HTTP_200_OK)
 
 class ClubLeaveSerializer(serializers.Serializer):
@@ -64,24 +134,28 @@ class ClubLeaveSerializer(serializers.Serializer):
 class LeaveClub(ClubPermissionCheckMixin, APIView):
   def post(self, request, *args, **kwargs):
     update_request_user(request)
-    serializer = JoinClubSerializer(data=request.data)
+    serializer = ClubLeaveSerializer(data=request.data)
     response = self.perform_checks(request, serializer, allow_owner=True, 
                                    allow_admin=True, allow_member=True)
     if response:
       return response
 
     club = self.club
-    if club.owner == request.user:
+    if club.is_owner(request.user):
       return Response({"detail": "the owner cannot leave the club - delete the club instead"},
                       status=status.HTTP_400_BAD_REQUEST)
-    club.members.remove(request.user)
-    club.admin.remove(request.user)
-    club.save()
+    with transaction.atomic():
+      club.members.remove(request.user)
+      club.admin.remove(request.user)
+      record_change(club.id, 'member.left', {'email': request.user.email})
+      members_changed(club.id)
     return Response({"detail": "left the club"}, status=status.HTTP_200_OK)
 
 class MyStatusSerializer(serializers.Serializer):
   id = serializers.IntegerField(required=True)
 class MyClubStatus(ClubPermissionCheckMixin, APIView):
+  read_only = True
+  queue_writes = False
   def post(self, request, *args, **kwargs):
     update_request_user(request)
     serializer = MyStatusSerializer(data=request.data)
@@ -90,21 +164,22 @@ class MyClubStatus(ClubPermissionCheckMixin, APIView):
     if response:
       return response
 
-    club = self.club
+    role = self.club_role
     user_status = {
-      'member': club.members.filter(email=request.user.email).exists(),
-      'admin': club.admin.filter(email=request.user.email).exists(),
-      'owner': club.owner == request.user
+      'member': role.member,
+      'admin': role.admin,
+      'owner': role.owner
     }
     return Response(user_status, status=status.HTTP_200_OK)
 
 def get_profile(club, user):
   profile = club.club_profiles.filter(user=user).first()
   if profile is None:
-    profile = ClubProfile.objects.add(user=user, club=club, 
-                                      budget_limit=user.default_budget_limit, 
-                                      maximum_time=user.default_max_time)
-    profile.save()
+    with transaction.atomic():
+      profile = ClubProfile.objects.create(user=user, club=club,
+                                           budget_limit=user.default_budget_limit,
+                                           maximum_time=user.default_max_time)
+      budgets_changed(club.id, added=[profile.budget_limit])
   return profile
 
 class ViewClubProfileSerializer(serializers.Serializer):
@@ -128,23 +203,38 @@ class EditClubProfileSerializer(serializers.Serializer):
 class EditClubProfile(ClubPermissionCheckMixin, APIView):
   def post(self, request, *args, **kwargs):
     update_request_user(request)
-    serializer = ViewClubProfileSerializer(data=request.data)
+    serializer = EditClubProfileSerializer(data=request.data)
     response = self.perform_checks(request, serializer, allow_owner=True, allow_admin=True, allow_member=True)
     if response:
       return response
 
-    profile = get_profile(self.club, request.user)
     data = serializer.validated_data
-    if data.get('budget_limit'):
-      profile.budget_limit = data.get('budget_limit')
-    if data.get('maximum_time'):
-      profile.maximum_time = data.get('maximum_time')
-    profile.save()
+    with transaction.atomic():
+      profile = get_profile(self.club, request.user)
+      old_budget = profile.budget_limit
+      if data.get('budget_limit'):
+        profile.budget_limit = data.get('budget_limit')
+      if data.get('maximum_time'):
+        profile.maximum_time = data.get('maximum_time')
+      profile.save()
+      record_change(self.club.id, 'profile.updated', {'email': request.user.email})
+      if profile.budget_limit != old_budget:
+        budgets_changed(self.club.id, added=[profile.budget_limit], removed=[old_budget])
     return Response({"details": "saved profile"}, status=status.HTTP_200_OK)
 
-class GetPlanSerializer(serializers.Serializer):
+class GetPlanSerializer(PageSerializer):
   id = serializers.IntegerField(required=True)
+  from_time = serializers.DateTimeField(required=False)
+  to_time = serializers.DateTimeField(required=False)
+  cursor_length = 2
+
+  def validate(self, data):
+    if data.get('from_time') and data.get('to_time') and data['to_time'] < data['from_time']:
+      raise serializers.ValidationError("to_time cannot be before from_time")
+    return super().validate(data)
 class GetPlans(ClubPermissionCheckMixin, APIView):
+  read_only = True
+  queue_writes = False
   def post(self, request, *args, **kwargs):
     update_request_user(request)
     serializer = GetPlanSerializer(data=request.data)
@@ -152,6 +242,145 @@ class GetPlans(ClubPermissionCheckMixin, APIView):
     if response:
       return response
 
-    club = self.club
-    plans = club.final_plans.all()
-    return Response([plan.to_dict() for plan in plans], status=status.HTTP_200_OK)
\ No newline at end of file
+    data = serializer.validated_data
+    etag = club_etag(self.club, 'view-plans', data)
+    response = not_modified(request, etag)
+    if response:
+      return response
+    plans = club_plans(self.club.id, from_time=data.get('from_time'), to_time=data.get('to_time'))
+    plans, next_cursor = keyset_page(plans, PLAN_ORDERING, data.get('cursor'), data.get('limit'))
+    return with_etag(Response({"plans": [plan.to_dict() for plan in plans],
+                               "next_cursor": next_cursor}, status=status.HTTP_200_OK), etag)
+
+class AsyncGetPlans(ClubPermissionCheckMixin, AsyncAPIView):
+  read_only = True
+  queue_writes = False
+  async def post(self, request, *args, **kwargs):
+    await aupdate_request_user(request)
+    serializer = GetPlanSerializer(data=request.data)
+    response = await self.aperform_checks(request, serializer, allow_owner=True, allow_admin=True,
+                                          allow_member=True)
+    if response:
+      return response
+
+    data = serializer.validated_data
+    etag = club_etag(self.club, 'view-plans', data)
+    response = not_modified(request, etag)
+    if response:
+      return response
+    plans = club_plans(self.club.id, from_time=data.get('from_time'), to_time=data.get('to_time'))
+    plans, next_cursor = await akeyset_page(plans, PLAN_ORDERING, data.get('cursor'),
+                                            data.get('limit'))
+    return with_etag(Response({"plans": [plan.to_dict() for plan in plans],
+                               "next_cursor": next_cursor}, status=status.HTTP_200_OK), etag)
+
+class ChangesSinceSerializer(serializers.Serializer):
+  id = serializers.IntegerField(required=True)
+  since = serializers.IntegerField(required=True, min_value=0)
+  limit = serializers.IntegerField(required=False, default=DEFAULT_PAGE_SIZE, min_value=1,
+                                   max_value=MAX_PAGE_SIZE)
+class ChangesSince(ClubPermissionCheckMixin, APIView):
+  """Events after version ``since``. Clients pass back the returned ``version``;
+  on ``reset`` they reload the club and continue from its version instead.
+
+  A club's history starts at version 1, which has no event of its own, so
+  ``since=0`` always resets; start from the version in the reset or the
+  club's ETag.
+  """
+  read_only = True
+  queue_writes = False
+  def post(self, request, *args, **kwargs):
+    update_request_user(request)
+    serializer = ChangesSinceSerializer(data=request.data)
+    response = self.perform_checks(request, serializer, allow_owner=True, allow_admin=True, allow_member=True)
+    if response:
+      return response
+
+    data = serializer.validated_data
+    events, reset = changes_since(self.club, data.get('since'), data.get('limit'))
+    if reset:
+      return Response({"reset": True, "events": [], "version": self.club.version,
+                       "has_more": False}, status=status.HTTP_200_OK)
+    return Response({"reset": False, "events": [event.to_dict() for event in events],
+                     "version": events[-1].seq if events else data.get('since'),
+                     "has_more": len(events) == data.get('limit')}, status=status.HTTP_200_OK)
+
+class ClubStreamSerializer(serializers.Serializer):
+  id = serializers.IntegerField(required=True)
+  since = serializers.IntegerField(required=False, min_value=0)
+class ClubStream(ClubPermissionCheckMixin, AsyncAPIView):
+  """Server-sent events with the club's changes as they are committed.
+
+  Each event carries the ``changes-since`` event as data and its ``seq`` as
+  id. A client reconnecting with ``Last-Event-ID`` (or ``since``) first gets
+  what it missed; a ``reset`` event means that history is gone and the club
+  has to be reloaded. A client that falls ``PUSH['QUEUE_SIZE']`` events behind
+  gets an ``overflow`` event and is disconnected. Only served under asgi.py.
+  """
+  http_method_names = ['get', 'post', 'options']
+
+  async def get(self, request, *args, **kwargs):
+    # EventSource can only send GET, so the parameters come in the query string.
+    request.data = request.GET
+    return await self.post(request, *args, **kwargs)
+
+  async def post(self, request, *args, **kwargs):
+    await aupdate_request_user(request)
+    serializer = ClubStreamSerializer(data=request.data)
+    response = await self.aperform_checks(request, serializer, allow_owner=True, allow_admin=True,
+                                          allow_member=True)
+    if response:
+      return response
+    if not push_enabled():
+      return Response({"detail": "push updates are disabled"},
+                      status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    since = serializer.validated_data.get('since')
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+      since = int(last_event_id)
+    response = StreamingHttpResponse(self.stream(since, request.user.email),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+  async def stream(self, since, email):
+    # Subscribing here rather than in post() ties the subscription to the
+    # generator, whose finally closes it. It comes before reading the version
+    # and history so that nothing committed in between is lost.
+    subscription = get_broker().subscribe(club_channel(self.club.id))
+    try:
+      last = await Club.objects.filter(id=self.club.id).values_list('version', flat=True).afirst()
+      if last is None:
+        yield sse_message('{}', event='deleted')
+        return
+      if since is not None and since != last:
+        events, reset = await sync_to_async(changes_since)(self.club, since, MAX_PAGE_SIZE)
+        if reset or len(events) == MAX_PAGE_SIZE:
+          yield sse_message(json.dumps({'version': last}), event='reset')
+        else:
+          for event in events:
+            yield sse_message(json.dumps(event.to_dict(), cls=JSONEncoder), id=event.seq)
+          last = max(last, events[-1].seq)
+      while True:
+        try:
+          message = await subscription.get(push_setting('HEARTBEAT'))
+        except asyncio.TimeoutError:
+          yield ': keepalive\n\n'
+          continue
+        if message is None:
+          if subscription.overflowed:
+            yield sse_message('{}', event='overflow')
+          return
+        if message['kind'] == 'club.deleted':
+          yield sse_message('{}', event='deleted')
+          return
+        if message['seq'] <= last:
+          continue
+        last = message['seq']
+        yield sse_message(message['data'], id=last)
+        if email in message['removed']:
+          return
+    finally:
+      subscription.close()
@@ -0,0 +1,70 @@
+from django.db import transaction
+from huddl.models import User
+from .models import Club
+
+BULK_ACTIONS = ('add', 'promote', 'remove')
+
+def bulk_update_membership(club, actions):
+  """Apply add/promote/remove actions for many emails at once.
+
+  ``actions`` maps each action to a list of emails. Users are resolved with one
+  query, current memberships with two, and the changes are written with bulk
+  inserts and deletes in a single transaction. Returns one result per email.
+  """
+  Members = Club.members.through
+  Admins = Club.admin.through
+  seen = {}
+  for action in BULK_ACTIONS:
+    for email in actions.get(action, []):
+      requested = seen.setdefault(email, [])
+      if action not in requested:
+        requested.append(action)
+  users = dict(User.objects.filter(email__in=seen).values_list('email', 'id'))
+  members = set(Members.objects.filter(club_id=club.id, user_id__in=users.values())
+                .values_list('user_id', flat=True))
+  admins = set(Admins.objects.filter(club_id=club.id, user_id__in=users.values())
+               .values_list('user_id', flat=True))
+
+  results = []
+  new_members = []
+  new_admins = []
+  removed = []
+  for email, requested in seen.items():
+    action = requested[0]
+    user_id = users.get(email)
+    if len(requested) > 1:
+      detail = "conflicting actions for this user"
+    elif user_id is None:
+      detail = "the user does not exist"
+    elif action == 'add':
+      detail = "already in the group" if user_id in members else None
+      if detail is None:
+        new_members.append(user_id)
+    elif action == 'promote':
+      if user_id in admins:
+        detail = "cannot promote an admin"
+      elif user_id not in members:
+        detail = "the user does not exist in this group"
+      else:
+        detail = None
+        new_admins.append(user_id)
+    else:
+      if user_id == club.owner_id:
+        detail = "owner cannot be removed"
+      elif user_id not in members and user_id not in admins:
+        detail = "the user does not exist in this group"
+      else:
+        detail = None
+        removed.append(user_id)
+    results.append({'email': email, 'action': action, 'ok': detail is None,
+                    'detail': detail or "done"})
+
+  with transaction.atomic():
+    Members.objects.bulk_create([Members(club_id=club.id, user_id=user_id) for user_id in new_members],
+                                ignore_conflicts=True)
+    Admins.objects.bulk_create([Admins(club_id=club.id, user_id=user_id) for user_id in new_admins],
+                               ignore_conflicts=True)
+    if removed:
+      Members.objects.filter(club_id=club.id, user_id__in=removed).delete()
+      Admins.objects.filter(club_id=club.id, user_id__in=removed).delete()
+  return results
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0012_activity_location'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='finalplan',
+            index=models.Index(fields=['club', 'start_time'], name='finalplan_club_start'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:09
+
+from django.db import migrations, models
+
+
+def clear_blank_join_ids(apps, _schema_editor):
+    Club = apps.get_model('club', 'Club')
+    Club.objects.filter(join_id='').update(join_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0013_finalplan_club_start'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='club',
+            name='join_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='club',
+            name='join_max_uses',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='club',
+            name='join_uses',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='club',
+            name='join_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.RunPython(clear_blank_join_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0014_join_code_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='club',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1),
+        ),
+    ]
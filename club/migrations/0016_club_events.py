@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:27
+
+import django.db.models.deletion
+import rest_framework.utils.encoders
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0015_club_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClubEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveBigIntegerField()),
+                ('kind', models.CharField(max_length=32)),
+                ('payload', models.JSONField(default=dict, encoder=rest_framework.utils.encoders.JSONEncoder)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('club', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='club.club')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='clubevent',
+            constraint=models.UniqueConstraint(fields=('club', 'seq'), name='clubevent_club_seq'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:45
+
+from django.db import migrations
+
+# FTS5 index over club_activity, kept in sync by triggers so bulk_create,
+# queryset updates and cascading deletes are covered too. See club/search.py.
+# SQLite drops the triggers whenever a migration rebuilds club_activity, so such
+# a migration has to run these statements again.
+CREATE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE club_activity_fts USING fts5(
+        name, description, location,
+        content='club_activity', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER club_activity_fts_insert AFTER INSERT ON club_activity BEGIN
+        INSERT INTO club_activity_fts(rowid, name, description, location)
+        VALUES (new.id, new.name, new.description, new.location);
+    END
+    """,
+    """
+    CREATE TRIGGER club_activity_fts_delete AFTER DELETE ON club_activity BEGIN
+        INSERT INTO club_activity_fts(club_activity_fts, rowid, name, description, location)
+        VALUES ('delete', old.id, old.name, old.description, old.location);
+    END
+    """,
+    """
+    CREATE TRIGGER club_activity_fts_update AFTER UPDATE OF name, description, location
+    ON club_activity BEGIN
+        INSERT INTO club_activity_fts(club_activity_fts, rowid, name, description, location)
+        VALUES ('delete', old.id, old.name, old.description, old.location);
+        INSERT INTO club_activity_fts(rowid, name, description, location)
+        VALUES (new.id, new.name, new.description, new.location);
+    END
+    """,
+    "INSERT INTO club_activity_fts(club_activity_fts) VALUES ('rebuild')",
+]
+
+DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS club_activity_fts_update",
+    "DROP TRIGGER IF EXISTS club_activity_fts_delete",
+    "DROP TRIGGER IF EXISTS club_activity_fts_insert",
+    "DROP TABLE IF EXISTS club_activity_fts",
+]
+
+
+def create_index(_apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+            # SQLite built without FTS5; search falls back to plain lookups.
+            return
+    for statement in CREATE_INDEX:
+        schema_editor.execute(statement)
+
+
+def drop_index(_apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_INDEX:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0016_club_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
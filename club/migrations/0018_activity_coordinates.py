@@ -0,0 +1,32 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0017_activity_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='geohash',
+            field=models.CharField(blank=True, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['club', 'geohash'], name='activity_club_geohash'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0018_activity_coordinates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClubStats',
+            fields=[
+                ('club', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='club.club')),
+                ('member_count', models.PositiveIntegerField(default=0)),
+                ('admin_count', models.PositiveIntegerField(default=0)),
+                ('activity_costs', models.JSONField(default=dict)),
+                ('activity_times', models.JSONField(default=dict)),
+                ('profile_budgets', models.JSONField(default=dict)),
+                ('plan_count', models.PositiveIntegerField(default=0)),
+                ('plan_starts', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:30
+
+import math
+from collections import Counter
+from datetime import timezone as dt_timezone
+
+from django.db import migrations
+from django.utils import timezone
+
+# The club.sketch.QuantileSketch format as of this migration, computed here so
+# later changes to club.sketch or club.stats leave it as it is.
+RELATIVE_ACCURACY = 0.01
+LOG_GAMMA = math.log((1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY))
+
+
+def sketch(values):
+    bins, zeros, total, low, high = Counter(), 0, 0.0, None, None
+    for value in values:
+        value = float(value)
+        total += value
+        low = value if low is None else min(low, value)
+        high = value if high is None else max(high, value)
+        if value <= 0:
+            zeros += 1
+        else:
+            bins[math.ceil(math.log(value) / LOG_GAMMA)] += 1
+    return {'bins': {str(index): count for index, count in sorted(bins.items())},
+            'zeros': zeros, 'sum': total, 'min': low, 'max': high}
+
+
+def start_hour(start_time):
+    return start_time.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H')
+
+
+def backfill_club_stats(apps, _schema_editor):
+    """Give every club a stats row, as ClubStatsView no longer creates them."""
+    Club = apps.get_model('club', 'Club')
+    ClubStats = apps.get_model('club', 'ClubStats')
+    Activity = apps.get_model('club', 'Activity')
+    ClubProfile = apps.get_model('club', 'ClubProfile')
+    FinalPlan = apps.get_model('club', 'FinalPlan')
+    now = start_hour(timezone.now())
+    club_ids = Club.objects.filter(stats__isnull=True).values_list('id', flat=True)
+    for club_id in list(club_ids):
+        activities = list(Activity.objects.filter(club_id=club_id).values_list('cost', 'time'))
+        starts = list(FinalPlan.objects.filter(club_id=club_id).values_list('start_time', flat=True))
+        ClubStats.objects.create(
+            club_id=club_id,
+            member_count=Club.members.through.objects.filter(club_id=club_id).count(),
+            admin_count=Club.admin.through.objects.filter(club_id=club_id).count(),
+            activity_costs=sketch(cost for cost, _ in activities),
+            activity_times=sketch(time.total_seconds() for _, time in activities),
+            profile_budgets=sketch(ClubProfile.objects.filter(club_id=club_id)
+                                   .values_list('budget_limit', flat=True)),
+            plan_count=len(starts),
+            plan_starts=dict(Counter(hour for hour in map(start_hour, filter(None, starts))
+                                     if hour >= now)),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('club', '0019_club_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_club_stats, migrations.RunPython.noop),
+    ]
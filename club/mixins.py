@@ -1,5 +1,6 @@
 from rest_framework.response import Response
 from .models import Club
+from .permissions import ClubRole, get_club_context, aget_club_context
 from rest_framework import status
 
 class LoginAndValidateMixin:
@@ -24,13 +25,23 @@ class LoginAndValidateMixin:
 
 class ClubPermissionCheckMixin(LoginAndValidateMixin):
   club: None | Club = None
+  club_role: None | ClubRole = None
 
-  def check_club_existence(self, club_id):
-    club = Club.objects.filter(id=club_id).first()
+  def check_club_existence(self, request, club_id):
+    club, role = get_club_context(request, club_id)
     if not club:
       return Response({"detail": "There are no clubs with that id"}, 
         status=status.HTTP_404_NOT_FOUND)
     self.club = club
+    self.club_role = role
+    return None
+  async def acheck_club_existence(self, request, club_id):
+    club, role = await aget_club_context(request, club_id)
+    if not club:
+      return Response({"detail": "There are no clubs with that id"}, 
+        status=status.HTTP_404_NOT_FOUND)
+    self.club = club
+    self.club_role = role
     return None
   def check_club_permission(self, user, allow_owner=False, 
                             allow_admin=False, allow_member=False):
@@ -50,7 +61,7 @@ class ClubPermissionCheckMixin(LoginAndValidateMixin):
     if response:
       return response
 
-    response = self.check_club_existence(serializer.validated_data.get('id'))
+    response = self.check_club_existence(request, serializer.validated_data.get('id'))
     if response:
       return response
 
@@ -58,4 +69,15 @@ class ClubPermissionCheckMixin(LoginAndValidateMixin):
     if response:
       return response
 
-    return None
\ No newline at end of file
+    return None
+
+  async def aperform_checks(self, request, serializer, **kwargs):
+    response = super().perform_checks(request, serializer)
+    if response:
+      return response
+
+    response = await self.acheck_club_existence(request, serializer.validated_data.get('id'))
+    if response:
+      return response
+
+    return self.check_club_permission(request.user, **kwargs)
@@ -1,7 +1,9 @@
 from django.db import models
+from rest_framework.utils.encoders import JSONEncoder
 from django.db.models.constraints import UniqueConstraint
 from huddl.models import User
 from django.core.exceptions import ValidationError
+from .geo import geohash
 
 class Club(models.Model):
   owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='clubs_owned', 
@@ -12,31 +14,64 @@ class Club(models.Model):
   members = models.ManyToManyField(User, related_name='clubs_in')
 
   join_enabled = models.BooleanField(default=False)
-  join_id = models.CharField(max_length=255, blank=True, unique=True)
+  join_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
+  join_expires_at = models.DateTimeField(null=True, blank=True)
+  join_max_uses = models.PositiveIntegerField(null=True, blank=True)
+  join_uses = models.PositiveIntegerField(default=0)
+  # Only ever raised by club.versioning.record_change, which also numbers the
+  # club's events with it; read endpoints derive their ETags from it.
+  version = models.PositiveBigIntegerField(default=1)
+
+  def save(self, *args, **kwargs):
+    # Never write back an in-memory version or join code use count, which may
+    # be older than the row's; both are only ever raised with UPDATE ... + 1.
+    # Pass update_fields to reset join_uses.
+    if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+      deferred = self.get_deferred_fields()
+      kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                 if not field.primary_key
+                                 and field.name not in ('version', 'join_uses')
+                                 and field.attname not in deferred]
+    super().save(*args, **kwargs)
 
   def to_dict(self, include_owner=False, include_admin=False, include_members=False, 
-              include_join_info=False):
+              include_join_info=False, user_dicts=None):
+    if user_dicts is None:
+      user_dicts = {}
     ret = {
       'id': self.id,
       'name': self.name,
       'description': self.description
     }
     if include_owner:
-      ret['owner'] = self.owner.to_dict()
+      ret['owner'] = self.owner.to_dict_cached(user_dicts)
     if include_admin:
-      ret['admin'] = [user.to_dict() for user in self.admin.all()]
+      ret['admin'] = [user.to_dict_cached(user_dicts) for user in self.admin.all()]
     if include_members:
-      ret['members'] = [user.to_dict() for user in self.members.all()]
+      ret['members'] = [user.to_dict_cached(user_dicts) for user in self.members.all()]
     if include_join_info:
       ret['join_enabled'] = self.join_enabled,
       ret['join_id'] = self.join_id if self.join_enabled else None
     return ret
 
+  def remember_role(self, role):
+    if not hasattr(self, '_roles'):
+      self._roles = {}
+    self._roles[role.user_id] = role
+  def known_role(self, user):
+    return getattr(self, '_roles', {}).get(user.id)
+
   def is_owner(self, user):
-    return self.owner == user
+    return self.owner_id == user.id
   def is_admin(self, user):
+    role = self.known_role(user)
+    if role is not None:
+      return role.is_admin
     return self.is_owner(user) or self.admin.filter(id=user.id).exists()
   def is_member(self, user):
+    role = self.known_role(user)
+    if role is not None:
+      return role.is_member
     return self.is_admin(user) or self.members.filter(id=user.id).exists()
   def __str__(self):
     return str(self.name)
@@ -50,10 +85,29 @@ class Activity(models.Model):
   description = models.TextField(blank=True, max_length=1000, default='')
   location = models.CharField(max_length=255, blank=True, null=True)
   link = models.CharField(max_length=255, blank=True, null=True)
+  latitude = models.FloatField(null=True, blank=True)
+  longitude = models.FloatField(null=True, blank=True)
+  # Derived from the coordinates on save; see club/geo.py for the queries it serves.
+  geohash = models.CharField(max_length=12, null=True, blank=True)
+
+  class Meta:
+    indexes = [models.Index(fields=('club', 'geohash'), name='activity_club_geohash')]
+
+  def save(self, *args, **kwargs):
+    self.geohash = self.compute_geohash()
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+      kwargs['update_fields'] = {*update_fields, 'geohash'}
+    super().save(*args, **kwargs)
+
+  def compute_geohash(self):
+    if self.latitude is None or self.longitude is None:
+      return None
+    return geohash(self.latitude, self.longitude)
 
   def to_dict(self):
     ret = {
-      'club_id': self.club.id,
+      'club_id': self.club_id,
       'id': self.id,
       'cost': self.cost,
       'time': self.time,
@@ -62,6 +116,8 @@ class Activity(models.Model):
     }
     ret['link'] = self.link if self.link else None
     ret['location'] = self.location if self.location else None
+    ret['latitude'] = self.latitude
+    ret['longitude'] = self.longitude
     return ret
 
 class ClubProfile(models.Model):
@@ -77,6 +133,14 @@ class ClubProfile(models.Model):
   class Meta:
     constraints = [models.UniqueConstraint(fields=('club', 'user'), name='unique_per_user')]
 
+  def to_dict(self):
+    return {
+      'club_id': self.club_id,
+      'user_id': self.user_id,
+      'budget_limit': self.budget_limit,
+      'maximum_time': self.maximum_time
+    }
+
 class FinalPlan(models.Model):
   club = models.ForeignKey(Club, on_delete=models.CASCADE, 
                            related_name='final_plans')
@@ -84,16 +148,20 @@ class FinalPlan(models.Model):
   start_time = models.DateTimeField(null=True, blank=True)
   end_time = models.DateTimeField(null=True, blank=True)
 
+  class Meta:
+    indexes = [models.Index(fields=('club', 'start_time'), name='finalplan_club_start')]
+
   def clean(self):
     super().clean()
     if self.end_time is not None and self.start_time is not None:
       raise ValidationError('End time cannot be before start time')
 
   def to_dict(self, include_full_club_data=False):
+    activity = self.activity
     ret = {
       'id': self.id,
-      'activity': self.activity.to_dict(),
-      'cost': self.activity.cost,
+      'activity': activity.to_dict() if activity is not None else None,
+      'cost': activity.cost if activity is not None else None,
       'start_time': self.start_time,
       'end_time': self.end_time,
     }
@@ -101,6 +169,42 @@ class FinalPlan(models.Model):
       ret['club'] = self.club
     else:
       ret['club'] = {
-        'id': self.club.id
+        'id': self.club_id
       }
-    return ret
\ No newline at end of file
+    return ret
+
+class ClubEvent(models.Model):
+  """One change to a club, numbered by the club version it produced."""
+  club = models.ForeignKey(Club, on_delete=models.CASCADE, related_name='events')
+  seq = models.PositiveBigIntegerField()
+  kind = models.CharField(max_length=32)
+  # Encoded like API responses, so payloads match what the read endpoints return.
+  payload = models.JSONField(default=dict, encoder=JSONEncoder)
+  created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+  class Meta:
+    constraints = [models.UniqueConstraint(fields=('club', 'seq'), name='clubevent_club_seq')]
+
+  def to_dict(self):
+    return {
+      'seq': self.seq,
+      'kind': self.kind,
+      'payload': self.payload,
+      'created_at': self.created_at
+    }
+
+class ClubStats(models.Model):
+  """Summary figures for a club's dashboard, kept up to date by club/stats.py as
+  the club changes so reading them is a single-row lookup."""
+  club = models.OneToOneField(Club, on_delete=models.CASCADE, primary_key=True,
+                              related_name='stats')
+  member_count = models.PositiveIntegerField(default=0)
+  admin_count = models.PositiveIntegerField(default=0)
+  # club.sketch.QuantileSketch dicts over the activities and the profiles' budgets.
+  activity_costs = models.JSONField(default=dict)
+  activity_times = models.JSONField(default=dict)
+  profile_budgets = models.JSONField(default=dict)
+  plan_count = models.PositiveIntegerField(default=0)
+  # Plans by the hour they start ("YYYY-MM-DDTHH" in UTC); past hours are pruned.
+  plan_starts = models.JSONField(default=dict)
+  updated_at = models.DateTimeField(auto_now=True)
@@ -1,11 +1,24 @@
 from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, serializers
 from .models import Club, FinalPlan, Activity
-from .club_tools import generate_join_id
+from .club_tools import save_with_join_id, forget_join_id
+from .club_serialization import serialize_club, serialize_clubs
+from .pagination import MemberPageSerializer
+from .conflicts import find_conflicts
+from .membership import bulk_update_membership
+from .stats import get_stats, members_changed, plans_changed, rebuild_stats, stats_to_dict
+from .versioning import record_change, publish_club_deleted
+from .export import FORMATS as EXPORT_FORMATS, CONTENT_TYPES as EXPORT_CONTENT_TYPES, export_chunks
 from .mixins import LoginAndValidateMixin, ClubPermissionCheckMixin
 from global_tools.user_find import update_request_user
+from global_tools.async_views import aiter_sync, is_asgi_request
+
+BULK_MEMBERSHIP_LIMIT = 1000
 
 class ClubIDSerializer(serializers.Serializer):
   id = serializers.IntegerField(required=True)
@@ -23,23 +36,26 @@ class CreateClub(LoginAndValidateMixin, APIView):
       return response
     validated_data = serializer.validated_data
     name = validated_data.get('name')
-    join_enabled = validated_data.get('join_enabled')
-    join_id = ""
-    if join_enabled:
-      join_id = generate_join_id()
-    club = Club.objects.create(name=name, join_enabled=join_enabled,
-                               join_id=join_id,owner=request.user)
-    if validated_data.get('description'):
-      club.description = validated_data.get('description')
-    club.admin.add(request.user)
-    club.members.add(request.user)
-    club.save()
+    join_enabled = bool(validated_data.get('join_enabled'))
+    def create(join_id):
+      return Club.objects.create(name=name, join_enabled=join_enabled,
+                                 join_id=join_id, owner=request.user)
+    with transaction.atomic():
+      club = save_with_join_id(create) if join_enabled else create(None)
+      if validated_data.get('description'):
+        club.description = validated_data.get('description')
+      club.admin.add(request.user)
+      club.members.add(request.user)
+      club.save()
+      rebuild_stats(club.id)
     return Response({"detail": "created club", "club_id": club.id}, 
                     status=status.HTTP_201_CREATED)
 
 class OwnedClubSerializer(serializers.Serializer):
   detailed = serializers.BooleanField(required=False, default=False)
 class GetOwnedClubs(LoginAndValidateMixin, APIView):
+  read_only = True
+  queue_writes = False
   def post(self, request, *args, **kwargs):
     update_request_user(request)
     serializer = OwnedClubSerializer(data=request.data)
@@ -50,14 +66,16 @@ class GetOwnedClubs(LoginAndValidateMixin, APIView):
     validated_data = serializer.validated_data
     is_detailed = validated_data.get('detailed')
     clubs = request.user.clubs_owned.all()
-    info = [club.to_dict(include_owner=is_detailed, include_admin=is_detailed, 
-                         include_members=is_detailed) for club in clubs]
+    info = serialize_clubs(clubs, include_owner=is_detailed, include_admin=is_detailed,
+                           include_members=is_detailed)
     return Response({"clubs": info}, status=status.HTTP_200_OK)
 
-class AdminInfoSerializer(serializers.Serializer):
+class AdminInfoSerializer(MemberPageSerializer):
   id = serializers.IntegerField(required=True)
   detailed = serializers.BooleanField(default=False)
 class AdminInfo(ClubPermissionCheckMixin, APIView):
+  read_only = True
+  queue_writes = False
   def post(self, request, *args, **kwargs):
     update_request_user(request)
     serializer = AdminInfoSerializer(data=request.data)
@@ -68,8 +86,10 @@ class AdminInfo(ClubPermissionCheckMixin, APIView):
     data = serializer.validated_data
     club = self.club
     detailed = data.get('detailed')
-    return Response(club.to_dict(include_owner=detailed, include_admin=detailed, 
-       include_members=detailed, include_join_info=True), status=status.HTTP_200_OK)
+    return Response(serialize_club(club, include_owner=detailed, include_admin=detailed, 
+       include_members=detailed, include_join_info=True,
+       members_cursor=data.get('members_cursor'), members_limit=data.get('members_limit')),
+       status=status.HTTP_200_OK)
 
 class MemberPromotionSerializer(serializers.Serializer):
   id = serializers.IntegerField(required=True)
@@ -91,8 +111,10 @@ class PromoteMember(ClubPermissionCheckMixin, APIView):
     if not promote_user.exists():
       return Response({"detail": "the user does not exist in this group"}, 
                       status=status.HTTP_400_BAD_REQUEST)
-    club.admin.add(promote_user[0])
-    club.save()
+    with transaction.atomic():
+      club.admin.add(promote_user[0])
+      record_change(club.id, 'member.promoted', {'email': to_promote_email})
+      members_changed(club.id)
     return Response({"detail": "made user an admin"}, status=status.HTTP_200_OK)
 
 class MemberRemovalSerializer(serializers.Serializer):
@@ -114,11 +136,35 @@ class RemoveMember(ClubPermissionCheckMixin, APIView):
     if to_remove_email == request.user.email:
       return Response({"detail": "you cannot remove yourself"},
                       status=status.HTTP_400_BAD_REQUEST)
-    club.admin.remove(club.admin.filter(email=to_remove_email).first())
-    club.members.remove(club.members.filter(email=to_remove_email).first())
-    club.save()
+    with transaction.atomic():
+      club.admin.remove(club.admin.filter(email=to_remove_email).first())
+      club.members.remove(club.members.filter(email=to_remove_email).first())
+      record_change(club.id, 'member.removed', {'email': to_remove_email})
+      members_changed(club.id)
     return Response({"detail": "user removed"}, status=status.HTTP_200_OK)
 
+class BulkMembershipSerializer(serializers.Serializer):
+  id = serializers.IntegerField(required=True)
+  add = serializers.ListField(child=serializers.EmailField(max_length=255), required=False,
+                              max_length=BULK_MEMBERSHIP_LIMIT)
+  promote = serializers.ListField(child=serializers.EmailField(max_length=255), required=False,
+                                  max_length=BULK_MEMBERSHIP_LIMIT)
+  remove = serializers.ListField(child=serializers.EmailField(max_length=255), required=False,
+                                 max_length=BULK_MEMBERSHIP_LIMIT)
+class BulkMembership(ClubPermissionCheckMixin, APIView):
+  def post(self, request, *args, **kwargs):
+    update_request_user(request)
+    serializer = BulkMembershipSerializer(data=request.data)
+    response = self.perform_checks(request, serializer, allow_owner=True)
+    if response:
+      return response
+
+    with transaction.atomic():
+      results = bulk_update_membership(self.club, serializer.validated_data)
+      record_change(self.club.id, 'members.bulk', {'results': results})
+      members_changed(self.club.id)
+    return Response({"results": results}, status=status.HTTP_200_OK)
+
 class DeleteClub(ClubPermissionCheckMixin, APIView):
   def post(self, request, *args, **kwargs):
     update_request_user(request)
@@ -128,7 +174,59 @@ class DeleteClub(ClubPermissionCheckMixin, APIView):
       return response
 
     club = self.club
+    forget_join_id(club.join_id)
+    club_id = club.id
     club.delete()
+    publish_club_deleted(club_id)
+    return Response({"detail": "club deleted"}, status=status.HTTP_200_OK)
+
+class ExportClubSerializer(serializers.Serializer):
+  id = serializers.IntegerField(required=True)
+  format = serializers.ChoiceField(choices=EXPORT_FORMATS, default='ndjson')
+class ExportClub(ClubPermissionCheckMixin, APIView):
+  """Everything in a club (members, profiles, activities and plans) as one NDJSON
+  or CSV download, streamed from a single snapshot and gzipped when the client
+  accepts it."""
+  read_only = True
+  queue_writes = False
+
+  def post(self, request, *args, **kwargs):
+    update_request_user(request)
+    serializer = ExportClubSerializer(data=request.data)
+    response = self.perform_checks(request, serializer, allow_owner=True)
+    if response:
+      return response
+
+    fmt = serializer.validated_data.get('format')
+    compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+    # Checks may have read from a replica; the export reads the same database.
+    using = router.db_for_read(Club)
+    chunks = export_chunks(self.club.id, fmt, using, compress=compress)
+    if is_asgi_request(request):
+      chunks = aiter_sync(chunks)
+    response = StreamingHttpResponse(chunks, content_type=EXPORT_CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="club-{self.club.id}.{fmt}"'
+    response['Vary'] = 'Accept-Encoding'
+    if compress:
+      response['Content-Encoding'] = 'gzip'
+    return response
+
+class ClubStatsView(ClubPermissionCheckMixin, APIView):
+  """Dashboard figures for a club: member and admin counts, activity cost and
+  duration percentiles, the spread of member budgets and upcoming plans.
+  Percentiles are approximate, see club/sketch.py."""
+  read_only = True
+  queue_writes = False
+
+  def post(self, request, *args, **kwargs):
+    update_request_user(request)
+    serializer = ClubIDSerializer(data=request.data)
+    response = self.perform_checks(request, serializer, allow_owner=True, allow_admin=True)
+    if response:
+      return response
+
+    stats = get_stats(self.club.id)
+    return Response(stats_to_dict(stats), status=status.HTTP_200_OK)
 
 class TransferOwnerSerializer(serializers.Serializer):
   id = serializers.IntegerField(required=True)
@@ -151,15 +249,20 @@ class TransferClub(ClubPermissionCheckMixin, APIView):
     if new_owner is None:
       new_owner = club.admin.filter(email=new_owner_email).first()
       
-    club.members.add(new_owner)
-    club.admin.add(new_owner)
-    club.owner = new_owner
-    club.save()
+    with transaction.atomic():
+      club.members.add(new_owner)
+      club.admin.add(new_owner)
+      club.owner = new_owner
+      club.save(update_fields=['owner'])
+      record_change(club.id, 'club.transferred', {'email': new_owner.email})
+      members_changed(club.id)
     return Response({"detail": "club ownership transferred"}, status=status.HTTP_200_OK)
 
 class ChangeJoinSerializer(serializers.Serializer):
   id = serializers.IntegerField(required=True)
   join_enabled = serializers.BooleanField(required=True)
+  expires_in = serializers.DurationField(required=False)
+  max_uses = serializers.IntegerField(required=False, min_value=1)
 class ChangeJoinStatus(ClubPermissionCheckMixin, APIView):
   def post(self, request, *args, **kwargs):
     update_request_user(request)
@@ -170,16 +273,28 @@ class ChangeJoinStatus(ClubPermissionCheckMixin, APIView):
 
     club = self.club
     data = serializer.validated_data
+    forget_join_id(club.join_id)
     if data.get('join_enabled'):
-      club.join_enabled = True
-      club.join_id = generate_join_id()
-      club.save()
-      return Response({"detail": "club joining enabled", "join_id": club.join_id},
+      def enable(join_id):
+        club.join_enabled = True
+        club.join_id = join_id
+        club.join_expires_at = timezone.now() + data['expires_in'] if data.get('expires_in') else None
+        club.join_max_uses = data.get('max_uses')
+        club.join_uses = 0
+        club.save(update_fields=['join_enabled', 'join_id', 'join_expires_at',
+                                 'join_max_uses', 'join_uses'])
+      with transaction.atomic():
+        save_with_join_id(enable)
+        record_change(club.id, 'join.changed', {'join_enabled': True})
+      return Response({"detail": "club joining enabled", "join_id": club.join_id,
+                       "expires_at": club.join_expires_at, "max_uses": club.join_max_uses},
                      status=status.HTTP_200_OK)
     else:
       club.join_enabled = False
-      club.join_id = ""
-      club.save()
+      club.join_id = None
+      with transaction.atomic():
+        club.save(update_fields=['join_enabled', 'join_id'])
+        record_change(club.id, 'join.changed', {'join_enabled': False})
       return Response({"detail": "club joining disabled"},
                       status=status.HTTP_200_OK)
 
@@ -210,8 +325,14 @@ class CreateFinalPlan(ClubPermissionCheckMixin, APIView):
                       status=status.HTTP_404_NOT_FOUND)
     
     activity = Activity.objects.get(id=data.get('activity_id'))
-    final_plan = FinalPlan.objects.create(club=club, activity=activity, start_time=data.get('start_time'), end_time=data.get('end_time'))
-    return Response({"detail": "final plan created", "id": final_plan.id}, status=status.HTTP_201_CREATED)
+    with transaction.atomic():
+      final_plan = FinalPlan.objects.create(club=club, activity=activity, start_time=data.get('start_time'), end_time=data.get('end_time'))
+      record_change(club.id, 'plan.created', final_plan.to_dict())
+      plans_changed(club.id, added=[final_plan.start_time])
+    conflicts = find_conflicts(club, final_plan.start_time, final_plan.end_time,
+                               exclude_plan_id=final_plan.id)
+    return Response({"detail": "final plan created", "id": final_plan.id, "conflicts": conflicts},
+                    status=status.HTTP_201_CREATED)
 
 class DeleteFinalPlanSerializer(serializers.Serializer):
   id = serializers.IntegerField(required=True)
@@ -232,7 +353,11 @@ class DeleteFinalPlan(ClubPermissionCheckMixin, APIView):
                       status=status.HTTP_404_NOT_FOUND)
     
     plan = club.final_plans.filter(id=data.get('plan_id')).first()
-    plan.delete()
+    plan_id = plan.id
+    with transaction.atomic():
+      plan.delete()
+      record_change(club.id, 'plan.deleted', {'id': plan_id})
+      plans_changed(club.id, removed=[plan.start_time])
     return Response({"detail": "final plan deleted",}, 
                     status=status.HTTP_200_OK)
 
@@ -257,11 +382,12 @@ class EditFinalPlan(ClubPermissionCheckMixin, APIView):
         status=status.HTTP_404_NOT_FOUND)
     
     plan = club.final_plans.get(id=data.get('plan_id'))
+    old_start = plan.start_time
     if data.get('activity_id'):
       if not club.activities_planned.filter(id=data.get('activity_id')).exists():
         return Response({"detail": "activity does not exist"},
           status=status.HTTP_404_NOT_FOUND)
-      plan.activity = Club.activities_planned.get(id=data.get('activity_id'))
+      plan.activity = club.activities_planned.get(id=data.get('activity_id'))
     if data.get('start_time'):
       if data.get('end_time') and data.get('end_time') < data.get('start_time') or data.get('end_time') is None and plan.end_time is not None and plan.end_time < data.get('start_time'):
         return Response({"detail": "end time cannot be before start time"}, 
@@ -272,5 +398,13 @@ class EditFinalPlan(ClubPermissionCheckMixin, APIView):
         return Response({"detail": "start time cannot be after end time"},  
                         status=status.HTTP_400_BAD_REQUEST)
       plan.end_time = data.get('end_time')
-    plan.save()
-    return Response({"detail": "plan updated"}, status=status.HTTP_201_CREATED)
\ No newline at end of file
+    with transaction.atomic():
+      plan.save()
+      record_change(club.id, 'plan.updated', plan.to_dict())
+      if plan.start_time != old_start:
+        plans_changed(club.id, added=[plan.start_time], removed=[old_start])
+    conflicts = []
+    if plan.start_time is not None and plan.end_time is not None:
+      conflicts = find_conflicts(club, plan.start_time, plan.end_time, exclude_plan_id=plan.id)
+    return Response({"detail": "plan updated", "conflicts": conflicts},
+                    status=status.HTTP_201_CREATED)
\ No newline at end of file
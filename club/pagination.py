@@ -0,0 +1,86 @@
+from datetime import datetime
+from django.core import signing
+from django.db.models import F, Q
+from rest_framework import serializers
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+CURSOR_SALT = 'club.pagination.cursor'
+
+def encode_cursor(values):
+  values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+  return signing.dumps(values, salt=CURSOR_SALT, compress=True)
+
+def decode_cursor(token):
+  try:
+    values = signing.loads(token, salt=CURSOR_SALT)
+  except signing.BadSignature:
+    return None
+  return values if isinstance(values, list) else None
+
+def ordering_expressions(ordering):
+  return [F(field).asc(nulls_first=True) for field in ordering]
+
+def after_filter(ordering, values):
+  """Rows strictly after ``values`` in ``ordering`` (ascending, NULLs first)."""
+  field, value = ordering[0], values[0]
+  if value is None:
+    after = Q(**{f'{field}__isnull': False})
+    equal = Q(**{f'{field}__isnull': True})
+  else:
+    after = Q(**{f'{field}__gt': value})
+    equal = Q(**{field: value})
+  if len(ordering) == 1:
+    return after
+  return after | (equal & after_filter(ordering[1:], values[1:]))
+
+def keyset_queryset(queryset, ordering, cursor=None):
+  """Order ``queryset`` by ``ordering`` and skip to just after ``cursor``.
+
+  The last field of ``ordering`` must be unique so that every row has a
+  distinct position.
+  """
+  queryset = queryset.order_by(*ordering_expressions(ordering))
+  if cursor is not None:
+    queryset = queryset.filter(after_filter(ordering, cursor))
+  return queryset
+
+def split_page(items, ordering, limit):
+  """Trim a list fetched with ``limit + 1`` rows and build the next cursor."""
+  items = list(items)
+  if len(items) <= limit:
+    return items, None
+  items = items[:limit]
+  return items, encode_cursor([getattr(items[-1], field) for field in ordering])
+
+def keyset_page(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+  """Fetch one page of ``queryset``; returns ``(items, next_cursor)``."""
+  queryset = keyset_queryset(queryset, ordering, cursor)
+  return split_page(queryset[:limit + 1], ordering, limit)
+
+async def akeyset_page(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+  queryset = keyset_queryset(queryset, ordering, cursor)
+  return split_page([item async for item in queryset[:limit + 1]], ordering, limit)
+
+class PageSerializer(serializers.Serializer):
+  cursor = serializers.CharField(required=False, allow_blank=False)
+  limit = serializers.IntegerField(required=False, min_value=1, max_value=MAX_PAGE_SIZE,
+                                   default=DEFAULT_PAGE_SIZE)
+  cursor_length = 1
+
+  def validate_cursor(self, value):
+    values = decode_cursor(value)
+    if values is None or len(values) != self.cursor_length:
+      raise serializers.ValidationError("invalid cursor")
+    return values
+
+class MemberPageSerializer(serializers.Serializer):
+  members_cursor = serializers.CharField(required=False, allow_blank=False)
+  members_limit = serializers.IntegerField(required=False, min_value=1, max_value=MAX_PAGE_SIZE,
+                                           default=DEFAULT_PAGE_SIZE)
+
+  def validate_members_cursor(self, value):
+    values = decode_cursor(value)
+    if values is None or len(values) != 1:
+      raise serializers.ValidationError("invalid cursor")
+    return values
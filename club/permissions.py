@@ -0,0 +1,67 @@
+from django.db.models import Exists, OuterRef
+from .models import Club
+
+class ClubRole:
+  """The caller's standing in a club, as stored in the owner/admin/members fields."""
+  def __init__(self, user_id, owner=False, admin=False, member=False):
+    self.user_id = user_id
+    self.owner = owner
+    self.admin = admin
+    self.member = member
+
+  @property
+  def is_owner(self):
+    return self.owner
+  @property
+  def is_admin(self):
+    return self.owner or self.admin
+  @property
+  def is_member(self):
+    return self.is_admin or self.member
+
+def club_role_queryset(club_id, user):
+  return Club.objects.filter(id=club_id).annotate(
+    caller_is_admin=Exists(Club.admin.through.objects.filter(club_id=OuterRef('pk'), user_id=user.id)),
+    caller_is_member=Exists(Club.members.through.objects.filter(club_id=OuterRef('pk'), user_id=user.id)),
+  )
+
+def remember_caller_role(club, user):
+  role = ClubRole(user.id, owner=club.owner_id == user.id, admin=club.caller_is_admin,
+                  member=club.caller_is_member)
+  club.remember_role(role)
+  return club, role
+
+def club_with_role(club_id, user):
+  """Fetch a club and the user's role in it with a single query."""
+  club = club_role_queryset(club_id, user).first()
+  if club is None:
+    return None, None
+  return remember_caller_role(club, user)
+
+async def aclub_with_role(club_id, user):
+  club = await club_role_queryset(club_id, user).afirst()
+  if club is None:
+    return None, None
+  return remember_caller_role(club, user)
+
+def club_contexts(request):
+  contexts = getattr(request, 'club_contexts', None)
+  if contexts is None:
+    contexts = {}
+    request.club_contexts = contexts
+  return contexts
+
+def get_club_context(request, club_id):
+  """Return ``(club, role)`` for the request's user, memoized on the request."""
+  contexts = club_contexts(request)
+  key = (club_id, request.user.id)
+  if key not in contexts:
+    contexts[key] = club_with_role(club_id, request.user)
+  return contexts[key]
+
+async def aget_club_context(request, club_id):
+  contexts = club_contexts(request)
+  key = (club_id, request.user.id)
+  if key not in contexts:
+    contexts[key] = await aclub_with_role(club_id, request.user)
+  return contexts[key]
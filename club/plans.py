@@ -0,0 +1,16 @@
+from .models import FinalPlan
+
+PLAN_ORDERING = ('start_time', 'id')
+
+def club_plans(club_id, from_time=None, to_time=None):
+  """A club's final plans joined with their activities, ordered by start time.
+
+  ``from_time`` and ``to_time`` bound ``start_time`` (both inclusive) and are
+  served by the ``(club, start_time)`` index.
+  """
+  plans = FinalPlan.objects.filter(club_id=club_id)
+  if from_time is not None:
+    plans = plans.filter(start_time__gte=from_time)
+  if to_time is not None:
+    plans = plans.filter(start_time__lte=to_time)
+  return plans.select_related('activity').order_by(*PLAN_ORDERING)
@@ -0,0 +1,64 @@
+import re
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from .models import Activity, Club
+
+FTS_TABLE = 'club_activity_fts'
+# bm25() weights for the indexed columns: name, description, location.
+BM25_WEIGHTS = (10.0, 1.0, 3.0)
+# Fallback scores for a term found in the same columns.
+FALLBACK_WEIGHTS = {'name': 10, 'description': 1, 'location': 3}
+
+def query_terms(query):
+  return re.findall(r'\w+', query)
+
+def match_expression(terms):
+  """An FTS5 query for rows containing every term, each as a word prefix.
+
+  Quoting every term keeps user input from being read as FTS5 syntax.
+  """
+  return ' AND '.join(f'"{term}"*' for term in terms)
+
+def fts_available():
+  """Whether the FTS5 index from migration 0017 exists on this database."""
+  if connection.vendor != 'sqlite':
+    return False
+  if not hasattr(connection, 'club_activity_fts'):
+    connection.club_activity_fts = FTS_TABLE in connection.introspection.table_names()
+  return connection.club_activity_fts
+
+def member_club_ids(user):
+  """Ids of the clubs ``user`` owns, administers or is a member of, as a subquery."""
+  return Club.objects.filter(Q(owner=user) | Q(admin=user) | Q(members=user)).values('id')
+
+def search_activities(club_ids, query, limit):
+  """Activities of the clubs in ``club_ids`` (a ``values('id')`` queryset) matching
+  every word of ``query``, best match first.
+
+  Served by the FTS5 index ranked with BM25 where it exists, otherwise by
+  substring lookups scored by the columns that matched.
+  """
+  terms = query_terms(query)
+  if not terms:
+    return []
+  if fts_available():
+    clubs_sql, clubs_params = club_ids.query.sql_with_params()
+    table = Activity._meta.db_table
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    return list(Activity.objects.raw(
+      f'SELECT {table}.* FROM {FTS_TABLE} JOIN {table} ON {table}.id = {FTS_TABLE}.rowid '
+      f'WHERE {FTS_TABLE} MATCH %s AND {table}.club_id IN ({clubs_sql}) '
+      f'ORDER BY bm25({FTS_TABLE}, {weights}), {table}.id LIMIT %s',
+      [match_expression(terms), *clubs_params, limit]))
+
+  condition = Q()
+  score = Value(0)
+  for term in terms:
+    term_condition = Q()
+    for field, weight in FALLBACK_WEIGHTS.items():
+      term_condition |= Q(**{f'{field}__icontains': term})
+      score = score + Case(When(**{f'{field}__icontains': term}, then=Value(weight)),
+                           default=Value(0), output_field=IntegerField())
+    condition &= term_condition
+  activities = Activity.objects.filter(club_id__in=club_ids).filter(condition)
+  return list(activities.annotate(score=score).order_by('-score', 'id')[:limit])
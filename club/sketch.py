@@ -0,0 +1,112 @@
+import math
+
+# Quantiles come out within this relative error of the true value.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+class QuantileSketch:
+  """Approximate quantiles of non-negative values (DDSketch with log-spaced bins).
+
+  Each positive value is counted in bin ``ceil(log_gamma(value))``, zeros and
+  negatives in a bin of their own, so values can be removed again exactly and
+  two sketches merge by adding counts. The bins stay few: one per 2% step
+  across the range of values seen. Stored as JSON via ``to_dict``.
+
+  ``low`` and ``high`` bound the values in the sketch, and quantiles are
+  clamped to them, as a bin's midpoint can lie beyond every value in it. They
+  are exact while values are only added. A removal narrows them to the edges
+  of the remaining bins, so afterwards they, like the quantiles, are only
+  within ``RELATIVE_ACCURACY`` of the true extremes until the sketch is
+  rebuilt from the values (``club.stats.rebuild_stats``).
+  """
+  def __init__(self, bins=None, zeros=0, total=0.0, low=None, high=None):
+    self.bins = bins or {}
+    self.zeros = zeros
+    self.total = total
+    self.low = low
+    self.high = high
+
+  @classmethod
+  def from_dict(cls, data):
+    data = data or {}
+    return cls({int(index): count for index, count in data.get('bins', {}).items()},
+               data.get('zeros', 0), data.get('sum', 0.0), data.get('min'), data.get('max'))
+
+  def to_dict(self):
+    return {'bins': {str(index): count for index, count in sorted(self.bins.items())},
+            'zeros': self.zeros, 'sum': self.total, 'min': self.low, 'max': self.high}
+
+  @property
+  def count(self):
+    return self.zeros + sum(self.bins.values())
+
+  def add(self, value, count=1):
+    value = float(value)
+    self.total += value * count
+    if count > 0:
+      self.low = value if self.low is None else min(self.low, value)
+      self.high = value if self.high is None else max(self.high, value)
+    if value <= 0:
+      self.zeros = max(0, self.zeros + count)
+    else:
+      index = math.ceil(math.log(value) / LOG_GAMMA)
+      remaining = self.bins.get(index, 0) + count
+      if remaining > 0:
+        self.bins[index] = remaining
+      else:
+        self.bins.pop(index, None)
+    if not self.count:
+      self.low = self.high = None
+    elif count < 0:
+      self.narrow()
+
+  def narrow(self):
+    """Pull ``low`` and ``high`` in to the edges of the lowest and highest bins."""
+    if self.bins and not self.zeros:
+      edge = GAMMA ** (min(self.bins) - 1)
+      self.low = edge if self.low is None else max(self.low, edge)
+    top = GAMMA ** max(self.bins) if self.bins else 0.0
+    self.high = top if self.high is None else min(self.high, top)
+
+  def remove(self, value, count=1):
+    self.add(value, -count)
+
+  def merge(self, other):
+    for index, count in other.bins.items():
+      self.bins[index] = self.bins.get(index, 0) + count
+    self.zeros += other.zeros
+    self.total += other.total
+    for bound in (other.low, other.high):
+      if bound is not None:
+        self.low = bound if self.low is None else min(self.low, bound)
+        self.high = bound if self.high is None else max(self.high, bound)
+
+  def mean(self):
+    count = self.count
+    return self.total / count if count else None
+
+  def quantile(self, q):
+    """The value at quantile ``q`` (0 to 1), or None when the sketch is empty."""
+    count = self.count
+    if not count:
+      return None
+    return self.clamp(self.estimate(q * (count - 1)))
+
+  def estimate(self, rank):
+    seen = self.zeros
+    if seen > rank:
+      return 0.0
+    for index in sorted(self.bins):
+      seen += self.bins[index]
+      if seen > rank:
+        # The bin's midpoint in relative terms, hence within RELATIVE_ACCURACY.
+        return 2 * GAMMA ** index / (GAMMA + 1)
+    return 2 * GAMMA ** max(self.bins) / (GAMMA + 1)
+
+  def clamp(self, value):
+    if self.low is not None:
+      value = max(value, self.low)
+    if self.high is not None:
+      value = min(value, self.high)
+    return value
@@ -0,0 +1,156 @@
+from datetime import timedelta, timezone as dt_timezone
+from django.db import router, transaction
+from django.utils import timezone
+from .models import Activity, Club, ClubProfile, ClubStats, FinalPlan
+from .sketch import QuantileSketch
+
+ACTIVITY_QUANTILES = (0.5, 0.9, 0.99)
+BUDGET_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+# Plans starting within this window count as "soon".
+SOON = timedelta(days=7)
+CHUNK_SIZE = 2000
+
+def start_hour(start_time):
+  return start_time.astimezone(dt_timezone.utc).strftime('%Y-%m-%dT%H')
+
+def count_starts(stats, start_times, delta):
+  stats.plan_count = max(0, stats.plan_count + delta * len(start_times))
+  for start_time in start_times:
+    if start_time is None:
+      continue
+    hour = start_hour(start_time)
+    remaining = stats.plan_starts.get(hour, 0) + delta
+    if remaining > 0:
+      stats.plan_starts[hour] = remaining
+    else:
+      stats.plan_starts.pop(hour, None)
+  now = start_hour(timezone.now())
+  stats.plan_starts = {hour: count for hour, count in stats.plan_starts.items() if hour >= now}
+
+def build_stats(club_id, using=None):
+  """The club's stats computed from scratch from database ``using``, unsaved."""
+  stats = ClubStats(club_id=club_id)
+  stats.member_count = Club.members.through.objects.using(using).filter(club_id=club_id).count()
+  stats.admin_count = Club.admin.through.objects.using(using).filter(club_id=club_id).count()
+  costs, times = QuantileSketch(), QuantileSketch()
+  activities = Activity.objects.using(using).filter(club_id=club_id).values_list('cost', 'time')
+  for cost, time in activities.iterator(chunk_size=CHUNK_SIZE):
+    costs.add(cost)
+    times.add(time.total_seconds())
+  stats.activity_costs, stats.activity_times = costs.to_dict(), times.to_dict()
+  budgets = QuantileSketch()
+  profiles = ClubProfile.objects.using(using).filter(club_id=club_id) \
+    .values_list('budget_limit', flat=True)
+  for budget in profiles.iterator(chunk_size=CHUNK_SIZE):
+    budgets.add(budget)
+  stats.profile_budgets = budgets.to_dict()
+  stats.plan_starts = {}
+  plans = FinalPlan.objects.using(using).filter(club_id=club_id) \
+    .values_list('start_time', flat=True)
+  count_starts(stats, list(plans.iterator(chunk_size=CHUNK_SIZE)), 1)
+  stats.updated_at = timezone.now()
+  return stats
+
+def rebuild_stats(club_id):
+  """Recompute and save the club's stats; None if the club is gone.
+
+  Reads the database the row is written to, never a replica that may lag it.
+  """
+  using = router.db_for_write(ClubStats)
+  with transaction.atomic(using=using):
+    if not Club.objects.using(using).filter(id=club_id).exists():
+      return None
+    stats = build_stats(club_id, using)
+    stats.save(using=using)
+    return stats
+
+def get_stats(club_id):
+  """The club's stats row, or for a club without one, stats computed but not saved.
+
+  Read-only views call this, so it never writes. Clubs get their row when
+  created, or from ``update_stats`` on their next change.
+  """
+  stats = ClubStats.objects.filter(club_id=club_id).first()
+  return stats if stats is not None else build_stats(club_id)
+
+def update_stats(club_id, change):
+  """Apply ``change(stats)`` to the club's stats row while holding it.
+
+  Callers make their own change first: a club without a stats row yet gets
+  one rebuilt from its current rows instead, which already includes it.
+  """
+  with transaction.atomic():
+    stats = ClubStats.objects.select_for_update().filter(club_id=club_id).first()
+    if stats is None:
+      rebuild_stats(club_id)
+      return
+    change(stats)
+    stats.save()
+
+def activities_changed(club_id, added=(), removed=()):
+  def change(stats):
+    costs = QuantileSketch.from_dict(stats.activity_costs)
+    times = QuantileSketch.from_dict(stats.activity_times)
+    for activities, delta in ((added, 1), (removed, -1)):
+      for activity in activities:
+        costs.add(activity.cost, delta)
+        times.add(activity.time.total_seconds(), delta)
+    stats.activity_costs, stats.activity_times = costs.to_dict(), times.to_dict()
+  update_stats(club_id, change)
+
+def budgets_changed(club_id, added=(), removed=()):
+  def change(stats):
+    budgets = QuantileSketch.from_dict(stats.profile_budgets)
+    for values, delta in ((added, 1), (removed, -1)):
+      for budget in values:
+        budgets.add(budget, delta)
+    stats.profile_budgets = budgets.to_dict()
+  update_stats(club_id, change)
+
+def members_changed(club_id):
+  def change(stats):
+    stats.member_count = Club.members.through.objects.filter(club_id=club_id).count()
+    stats.admin_count = Club.admin.through.objects.filter(club_id=club_id).count()
+  update_stats(club_id, change)
+
+def plans_changed(club_id, added=(), removed=()):
+  """Record plans created (``added``) or deleted (``removed``) by their start times."""
+  def change(stats):
+    count_starts(stats, list(added), 1)
+    count_starts(stats, list(removed), -1)
+  update_stats(club_id, change)
+
+def summary(sketch, quantiles, scale=float):
+  return {
+    'count': sketch.count,
+    'mean': scale(sketch.mean()) if sketch.count else None,
+    **{f'p{round(q * 100)}': scale(sketch.quantile(q)) if sketch.count else None
+       for q in quantiles},
+  }
+
+def money(value):
+  return round(value, 2)
+
+def duration(value):
+  return timedelta(seconds=round(value))
+
+def stats_to_dict(stats):
+  now = timezone.now()
+  current, soon = start_hour(now), start_hour(now + SOON)
+  return {
+    'club_id': stats.club_id,
+    'members': stats.member_count,
+    'admins': stats.admin_count,
+    'activities': {
+      'cost': summary(QuantileSketch.from_dict(stats.activity_costs), ACTIVITY_QUANTILES, money),
+      'time': summary(QuantileSketch.from_dict(stats.activity_times), ACTIVITY_QUANTILES, duration),
+    },
+    'budgets': summary(QuantileSketch.from_dict(stats.profile_budgets), BUDGET_QUANTILES, money),
+    'plans': {
+      'count': stats.plan_count,
+      'upcoming': sum(count for hour, count in stats.plan_starts.items() if hour >= current),
+      'next_week': sum(count for hour, count in stats.plan_starts.items()
+                       if current <= hour < soon),
+    },
+    'updated_at': stats.updated_at,
+  }
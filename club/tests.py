@@ -1,3 +1,1083 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from global_tools import db_router, push
+from global_tools.session_cache import get_session_cache
+from huddl.models import User
+from huddl.views import AsyncMyInfo, AsyncSignedIn, MyInfo, SignedIn
+from .club_tools import (JOIN_CODE_ATTEMPTS, forget_join_id, join_code_cache, normalize_join_id,
+                         resolve_join_id, save_with_join_id, use_join_id)
+from .geo import bbox_filter, distance_km, radius_bbox, rank_by_distance
+from .geocoding import OfflineGeocoder
+from .activity_views import AsyncViewActivities, ViewActivities
+from .member_views import (AsyncGetClub, AsyncGetClubsIn, AsyncGetPlans, ClubStream, GetClub,
+                           GetClubsIn, GetPlans)
+from . import export
+from .models import Activity, Club, ClubEvent, ClubProfile, ClubStats, FinalPlan
+from .permissions import get_club_context
+from .search import fts_available, search_activities
+from .sketch import RELATIVE_ACCURACY, QuantileSketch
+from .stats import rebuild_stats
+from .versioning import club_channel, record_change
 
-# Create your tests here.
+try:
+  import fakeredis
+except ImportError:
+  fakeredis = None
+
+PUSH_SETTINGS = {'ENABLED': True, 'BACKEND': 'local', 'QUEUE_SIZE': 10, 'HEARTBEAT': 0.01}
+
+def make_user(name):
+  return User.objects.create(username=name, email=f'{name}@example.com', full_name=name.title(),
+                             is_staff=False)
+
+def login_session(user):
+  session = SessionStore()
+  session['_auth_user_id'] = str(user.id)
+  session.create()
+  return session.session_key
+
+def add_activity(club, name, latitude=None, longitude=None):
+  activity = Activity(club=club, name=name, cost=0, time=timedelta(hours=1),
+                      latitude=latitude, longitude=longitude)
+  activity.save()
+  return activity
+
+def post(client, path, session_id, **body):
+  return client.post(path, json.dumps({'sessionid': session_id, **body}),
+                     content_type='application/json')
+
+def in_box(activity, south, west, north, east):
+  if activity.latitude is None or not south <= activity.latitude <= north:
+    return False
+  if west > east:
+    return activity.longitude >= west or activity.longitude <= east
+  return west <= activity.longitude <= east
+
+async def take(stream, count):
+  chunks = []
+  async for chunk in stream:
+    chunks.append(chunk)
+    if len(chunks) == count:
+      break
+  await stream.aclose()
+  return chunks
+
+@override_settings(PUSH=PUSH_SETTINGS)
+class ClubStreamTests(TestCase):
+  def setUp(self):
+    push._broker = None
+    self.owner = make_user('ada')
+    self.club = Club.objects.create(owner=self.owner, name='Chess')
+    self.view = ClubStream()
+    self.view.club = self.club
+
+  def tearDown(self):
+    push._broker = None
+
+  def test_subscribes_only_once_the_stream_is_read(self):
+    stream = self.view.stream(None, self.owner.email)
+    self.assertNotIn(club_channel(self.club.id), push.get_broker().channels)
+    self.assertEqual(async_to_sync(take)(stream, 1), [': keepalive\n\n'])
+    # Closing the stream ends the subscription.
+    self.assertNotIn(club_channel(self.club.id), push.get_broker().channels)
+
+  def test_streams_changes_committed_after_it_started(self):
+    # The club loaded for the permission check is now a version behind.
+    record_change(self.club.id, 'join.changed', {'join_enabled': True})
+
+    def change():
+      with self.captureOnCommitCallbacks(execute=True):
+        record_change(self.club.id, 'join.changed', {'join_enabled': False})
+
+    async def run():
+      stream = self.view.stream(None, self.owner.email)
+      chunks = [await anext(stream)]
+      await sync_to_async(change)()
+      async for chunk in stream:
+        if not chunk.startswith(':'):
+          chunks.append(chunk)
+          break
+      await stream.aclose()
+      return chunks
+
+    chunks = async_to_sync(run)()
+    self.assertEqual(chunks[0], ': keepalive\n\n')
+    self.assertIn('id: 3\n', chunks[1])
+    self.assertIn('"join_enabled":false', chunks[1].replace(' ', ''))
+
+@skipUnless(fakeredis, 'needs the fakeredis package')
+class RedisBrokerTests(TestCase):
+  def make_broker(self, server):
+    class FakeRedisBroker(push.RedisBroker):
+      def connect(self):
+        return fakeredis.FakeRedis(server=server)
+
+      def aconnect(self):
+        return fakeredis.FakeAsyncRedis(server=server)
+    return FakeRedisBroker('redis://unused')
+
+  def test_fans_out_between_processes(self):
+    server = fakeredis.FakeServer()
+    # Two brokers on one server stand for two worker processes.
+    sender, receiver = self.make_broker(server), self.make_broker(server)
+
+    async def run():
+      subscription = receiver.subscribe('club:1')
+      try:
+        for _ in range(50):
+          sender.publish('club:1', {'seq': 2})
+          try:
+            return await subscription.get(0.05)
+          except asyncio.TimeoutError:
+            continue
+      finally:
+        subscription.close()
+        receiver.listener.cancel()
+
+    self.assertEqual(async_to_sync(run)(), {'seq': 2})
+
+class JoinCodeTests(TestCase):
+  def setUp(self):
+    join_code_cache.entries.clear()
+    self.owner = make_user('ada')
+    self.club = Club.objects.create(owner=self.owner, name='Chess')
+    self.club.members.add(self.owner)
+    self.club.admin.add(self.owner)
+    self.owner_session = login_session(self.owner)
+
+  def tearDown(self):
+    join_code_cache.entries.clear()
+
+  def enable_joining(self, **options):
+    response = post(self.client, '/groups/change-join-status', self.owner_session,
+                    id=self.club.id, join_enabled=True, **options)
+    self.assertEqual(response.status_code, 200)
+    return response.json()['join_id']
+
+  def join(self, name, join_id):
+    user = make_user(name)
+    response = post(self.client, '/groups/join-group', login_session(user), join_id=join_id)
+    return user, response.status_code
+
+  def join_while_loaded(self, join_id, name):
+    """Have ``name`` join just after the next view loads the club."""
+    def load_then_join(request, club_id):
+      context = get_club_context(request, club_id)
+      user = make_user(name)
+      Club.members.through.objects.create(club_id=club_id, user_id=user.id)
+      self.assertTrue(use_join_id(club_id, join_id))
+      return context
+    return mock.patch('club.mixins.get_club_context', load_then_join)
+
+  def test_stale_club_saves_do_not_reset_the_use_count(self):
+    join_id = self.enable_joining(max_uses=3)
+    bob, _ = self.join('bob', join_id)
+    with self.join_while_loaded(join_id, 'cat'):
+      response = post(self.client, '/groups/promote-member', self.owner_session,
+                      id=self.club.id, promote_email=bob.email)
+    self.assertEqual(response.status_code, 200)
+    with self.join_while_loaded(join_id, 'dan'):
+      response = post(self.client, '/groups/leave-group', login_session(bob), id=self.club.id)
+    self.assertEqual(response.status_code, 200)
+    self.club.refresh_from_db()
+    self.assertEqual(self.club.join_uses, 3)
+    self.assertEqual(self.join('eve', join_id)[1], 404)
+
+  def test_codes_are_read_back_however_they_are_typed(self):
+    self.assertEqual(normalize_join_id(' abcd-efgh '), 'ABCDEFGH')
+    self.assertEqual(normalize_join_id('1lo0 2i3z'), '1100213Z')
+    # Older join ids keep their case.
+    legacy = 'AbCdEfGhIjKlMnOpQrStUvWx'
+    self.assertEqual(normalize_join_id(legacy), legacy)
+    join_id = self.enable_joining()
+    typed = (join_id[:4] + '-' + join_id[4:]).lower()
+    self.assertEqual(self.join('bob', typed)[1], 200)
+
+  def test_save_retries_a_code_that_is_already_taken(self):
+    Club.objects.create(owner=self.owner, name='Go', join_enabled=True, join_id='TAKEN000')
+    codes = ['TAKEN000'] * (JOIN_CODE_ATTEMPTS - 1) + ['FRESH000']
+
+    def save(join_id):
+      self.club.join_id = join_id
+      self.club.save(update_fields=['join_id'])
+      return join_id
+
+    with mock.patch('club.club_tools.generate_join_id', side_effect=codes):
+      self.assertEqual(save_with_join_id(save), 'FRESH000')
+    with mock.patch('club.club_tools.generate_join_id', return_value='TAKEN000'):
+      self.assertRaises(IntegrityError, save_with_join_id, save)
+    self.club.refresh_from_db()
+    self.assertEqual(self.club.join_id, 'FRESH000')
+
+  def test_expired_codes_are_refused(self):
+    join_id = self.enable_joining(expires_in='00:10:00')
+    self.assertEqual(self.join('bob', join_id)[1], 200)
+    Club.objects.filter(id=self.club.id).update(join_expires_at=timezone.now())
+    # Still cached as live, but use_join_id checks the row.
+    self.assertIsNotNone(join_code_cache.get(join_id))
+    self.assertEqual(self.join('cat', join_id)[1], 404)
+    join_code_cache.entries.clear()
+    self.assertIsNone(resolve_join_id(join_id))
+
+  def test_codes_stop_at_their_usage_limit(self):
+    join_id = self.enable_joining(max_uses=2)
+    bob, _ = self.join('bob', join_id)
+    self.assertEqual(self.join('cat', join_id)[1], 200)
+    _, refused = self.join('dan', join_id)
+    self.assertEqual(refused, 404)
+    self.assertFalse(self.club.members.filter(username='dan').exists())
+    # Joining again is not another use.
+    self.assertEqual(post(self.client, '/groups/join-group', login_session(bob),
+                          join_id=join_id).status_code, 200)
+    self.club.refresh_from_db()
+    self.assertEqual(self.club.join_uses, 2)
+    # A new code starts counting again.
+    self.assertEqual(self.join('eve', self.enable_joining(max_uses=1))[1], 200)
+
+  def test_misses_are_cached_until_the_code_is_forgotten(self):
+    self.assertIsNone(resolve_join_id('NEWCARD0'))
+    self.club.join_enabled, self.club.join_id = True, 'NEWCARD0'
+    self.club.save()
+    with self.assertNumQueries(0):
+      self.assertIsNone(resolve_join_id('newcard0'))
+    forget_join_id('NEWCARD0')
+    self.assertEqual(resolve_join_id('newcard0'), self.club.id)
+
+  def test_changing_the_code_forgets_the_old_one(self):
+    old = self.enable_joining()
+    self.assertEqual(resolve_join_id(old), self.club.id)
+    new = self.enable_joining()
+    self.assertIsNone(resolve_join_id(old))
+    self.assertEqual(resolve_join_id(new), self.club.id)
+    post(self.client, '/groups/change-join-status', self.owner_session, id=self.club.id,
+         join_enabled=False)
+    self.assertIsNone(resolve_join_id(new))
+
+class QueryCountTests(TestCase):
+  """Read endpoints take the same number of queries however much they return."""
+  def setUp(self):
+    get_session_cache().clear()
+    self.owner = make_user('ada')
+    self.session_id = login_session(self.owner)
+    self.club = self.make_club('Chess')
+
+  def tearDown(self):
+    get_session_cache().clear()
+
+  def make_club(self, name):
+    club = Club.objects.create(owner=self.owner, name=name)
+    club.members.add(self.owner)
+    club.admin.add(self.owner)
+    return club
+
+  def add_members(self, club, count):
+    start = club.members.count()
+    users = [make_user(f'{club.name.lower()}-{index}') for index in range(start, start + count)]
+    club.members.add(*users)
+    club.admin.add(*users[:count // 2])
+
+  def assertConstantQueries(self, path, grow, **body):
+    """Request ``path`` before and after ``grow()``, expecting the same query count."""
+    # The first request fills the session cache.
+    self.assertEqual(post(self.client, path, self.session_id, **body).status_code, 200)
+    with CaptureQueriesContext(connection) as before:
+      self.assertEqual(post(self.client, path, self.session_id, **body).status_code, 200)
+    grow()
+    with self.assertNumQueries(len(before)):
+      response = post(self.client, path, self.session_id, **body)
+    self.assertEqual(response.status_code, 200)
+    return response.json(), before.captured_queries
+
+  def test_my_club_status(self):
+    status, queries = self.assertConstantQueries('/groups/my-status',
+                                                 lambda: self.add_members(self.club, 20),
+                                                 id=self.club.id)
+    self.assertEqual(status, {'member': True, 'admin': True, 'owner': True})
+    # The club and the caller's role come from one query.
+    self.assertEqual(len([query for query in queries if '"club_club"' in query['sql']]), 1)
+
+  def add_clubs(self, count):
+    for index in range(count):
+      self.add_members(self.make_club(f'Club{index}'), 5)
+
+  def test_owned_clubs(self):
+    self.add_members(self.club, 1)
+    clubs, _ = self.assertConstantQueries('/groups/get-owned-groups', lambda: self.add_clubs(10),
+                                          detailed=True)
+    self.assertEqual(len(clubs['clubs']), 11)
+    self.assertEqual(len(clubs['clubs'][-1]['members']), 6)
+
+  def test_clubs_in(self):
+    self.add_members(self.club, 1)
+    clubs, _ = self.assertConstantQueries('/groups/get-groups-in', lambda: self.add_clubs(10),
+                                          detailed=True)
+    self.assertEqual(len(clubs['clubs']), 11)
+    self.assertEqual(len(clubs['clubs'][-1]['admin']), 3)
+
+  def test_admin_info(self):
+    self.add_members(self.club, 1)
+    info, _ = self.assertConstantQueries('/groups/admin-group-info',
+                                         lambda: self.add_members(self.club, 30),
+                                         id=self.club.id, detailed=True)
+    self.assertEqual(len(info['admin']), 16)
+
+  def test_my_info(self):
+    info, _ = self.assertConstantQueries('/my-info', lambda: self.add_clubs(10))
+    self.assertEqual(len(info['groups_owned']), 11)
+    self.assertEqual(len(info['groups_in']), 11)
+
+  def add_plans(self, count):
+    start = timezone.now()
+    for index in range(count):
+      activity = add_activity(self.club, f'game {index}')
+      FinalPlan.objects.create(club=self.club, activity=activity,
+                               start_time=start + timedelta(days=index),
+                               end_time=start + timedelta(days=index, hours=1))
+
+  def test_plans(self):
+    self.add_plans(1)
+    plans, _ = self.assertConstantQueries('/groups/view-plans', lambda: self.add_plans(20),
+                                          id=self.club.id, limit=50)
+    self.assertEqual(len(plans['plans']), 21)
+
+  def test_plans_whose_activity_was_deleted(self):
+    self.add_plans(2)
+    activity = Activity.objects.get(name='game 0')
+    response = post(self.client, '/groups/delete-activity', self.session_id, id=self.club.id,
+                    activity_id=activity.id)
+    self.assertEqual(response.status_code, 200)
+    response = post(self.client, '/groups/view-plans', self.session_id, id=self.club.id)
+    self.assertEqual(response.status_code, 200)
+    plans = response.json()['plans']
+    self.assertEqual((plans[0]['activity'], plans[0]['cost']), (None, None))
+    self.assertEqual(plans[1]['activity']['name'], 'game 1')
+
+class ETagTests(TestCase):
+  def setUp(self):
+    self.owner = make_user('ada')
+    self.session_id = login_session(self.owner)
+    self.club = Club.objects.create(owner=self.owner, name='Chess')
+    self.club.members.add(self.owner)
+    self.club.admin.add(self.owner)
+
+  def get(self, path, if_none_match=None, **body):
+    headers = {'If-None-Match': if_none_match} if if_none_match else {}
+    return self.client.post(path, json.dumps({'sessionid': self.session_id, 'id': self.club.id,
+                                              **body}),
+                            content_type='application/json', headers=headers)
+
+  def test_unchanged_reads_get_a_304(self):
+    for path in ('/groups/group-info', '/groups/view-activities', '/groups/view-plans'):
+      with self.subTest(path=path):
+        etag = self.get(path)['ETag']
+        response = self.get(path, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+  def test_if_none_match_compares_weakly_and_accepts_lists(self):
+    etag = self.get('/groups/group-info')['ETag']
+    for header in (f'W/{etag}', f'"other", {etag}', f'"other",W/{etag} ', '*'):
+      with self.subTest(header=header):
+        self.assertEqual(self.get('/groups/group-info', header).status_code, 304)
+    self.assertEqual(self.get('/groups/group-info', '"other"').status_code, 200)
+
+  def test_changes_and_parameters_give_new_tags(self):
+    etag = self.get('/groups/group-info')['ETag']
+    self.assertNotEqual(self.get('/groups/group-info', detailed=True)['ETag'], etag)
+    self.assertEqual(self.get('/groups/group-info', etag, detailed=True).status_code, 200)
+    response = post(self.client, '/groups/add-activity', self.session_id, id=self.club.id,
+                    name='Blitz', time='00:10:00')
+    self.assertEqual(response.status_code, 201)
+    response = self.get('/groups/group-info', etag)
+    self.assertEqual(response.status_code, 200)
+    self.assertNotEqual(response['ETag'], etag)
+
+@override_settings(CLUB_EVENTS={'KEEP': 4, 'TRIM_EVERY': 3, 'MAX_AGE': 3600})
+class ChangesSinceTests(TestCase):
+  def setUp(self):
+    self.owner = make_user('ada')
+    self.session_id = login_session(self.owner)
+    self.club = Club.objects.create(owner=self.owner, name='Chess')
+    self.club.members.add(self.owner)
+
+  def changes(self, since, **body):
+    response = post(self.client, '/groups/changes-since', self.session_id, id=self.club.id,
+                    since=since, **body)
+    self.assertEqual(response.status_code, 200)
+    return response.json()
+
+  def record(self, count):
+    for index in range(count):
+      record_change(self.club.id, 'activity.added', {'name': f'game {index}'})
+
+  def seqs(self):
+    return list(ClubEvent.objects.filter(club=self.club).order_by('seq')
+                .values_list('seq', flat=True))
+
+  def test_pages_through_events_oldest_first(self):
+    self.record(2)
+    page = self.changes(1, limit=1)
+    self.assertEqual(([event['seq'] for event in page['events']], page['version'],
+                      page['has_more'], page['reset']), ([2], 2, True, False))
+    page = self.changes(page['version'], limit=1)
+    self.assertEqual([event['payload'] for event in page['events']], [{'name': 'game 1'}])
+    self.assertEqual(page['version'], 3)
+    self.assertEqual(self.changes(3), {'reset': False, 'events': [], 'version': 3,
+                                       'has_more': False})
+
+  def test_new_clubs_start_from_version_one(self):
+    # Version 1 has no event, so a client starts from the version it is given.
+    self.assertEqual(self.changes(0), {'reset': True, 'events': [], 'version': 1,
+                                       'has_more': False})
+    self.assertFalse(self.changes(1)['reset'])
+
+  def test_versions_from_the_future_reset(self):
+    self.record(1)
+    page = self.changes(5)
+    self.assertEqual((page['reset'], page['version']), (True, 2))
+
+  def test_trimmed_history_resets(self):
+    self.record(6)
+    # Version 7; the write reaching version 6 trimmed everything below 3.
+    self.assertEqual(self.seqs(), [3, 4, 5, 6, 7])
+    self.assertTrue(self.changes(1)['reset'])
+    self.assertEqual([event['seq'] for event in self.changes(2)['events']], [3, 4, 5, 6, 7])
+
+  def test_compact_club_events(self):
+    self.record(4)
+    ClubEvent.objects.filter(club=self.club, seq=2).update(
+      created_at=timezone.now() - timedelta(hours=2))
+    stderr = io.StringIO()
+    call_command('compact_club_events', stderr=stderr)
+    # seq 2 expired; KEEP=4 then leaves the events after version 5 - 4.
+    self.assertEqual(self.seqs(), [3, 4, 5])
+    self.assertEqual(stderr.getvalue().strip(), 'deleted 1 club events')
+    call_command('compact_club_events', max_age=0, stderr=stderr)
+    self.assertEqual(self.seqs(), [])
+
+class BulkMembershipTests(TestCase):
+  def setUp(self):
+    self.owner = make_user('ada')
+    self.session_id = login_session(self.owner)
+    self.club = Club.objects.create(owner=self.owner, name='Chess')
+    self.club.members.add(self.owner)
+    self.club.admin.add(self.owner)
+    self.users = {name: make_user(name) for name in ('bob', 'cat', 'dan', 'eve')}
+    self.club.members.add(self.users['bob'], self.users['cat'], self.users['eve'])
+    self.club.admin.add(self.users['cat'])
+    rebuild_stats(self.club.id)
+
+  def bulk(self, session_id=None, **actions):
+    return post(self.client, '/groups/bulk-membership', session_id or self.session_id,
+                id=self.club.id, **actions)
+
+  def usernames(self, relation):
+    return set(getattr(self.club, relation).values_list('username', flat=True))
+
+  def test_applies_each_action_and_reports_per_email(self):
+    response = self.bulk(add=['dan@example.com', 'bob@example.com', 'zed@example.com'],
+                         promote=['eve@example.com', 'cat@example.com'],
+                         remove=['cat@example.com', 'ada@example.com'])
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual([(result['email'], result['action'], result['ok'], result['detail'])
+                      for result in response.json()['results']], [
+      ('dan@example.com', 'add', True, 'done'),
+      ('bob@example.com', 'add', False, 'already in the group'),
+      ('zed@example.com', 'add', False, 'the user does not exist'),
+      ('eve@example.com', 'promote', True, 'done'),
+      ('cat@example.com', 'promote', False, 'conflicting actions for this user'),
+      ('ada@example.com', 'remove', False, 'owner cannot be removed'),
+    ])
+    self.assertEqual(self.usernames('members'), {'ada', 'bob', 'cat', 'dan', 'eve'})
+    self.assertEqual(self.usernames('admin'), {'ada', 'cat', 'eve'})
+    stats = ClubStats.objects.get(club=self.club)
+    self.assertEqual((stats.member_count, stats.admin_count), (5, 3))
+    event = ClubEvent.objects.filter(club=self.club).latest('seq')
+    self.assertEqual(event.kind, 'members.bulk')
+
+  def test_removes_members_and_admins(self):
+    response = self.bulk(remove=['cat@example.com', 'bob@example.com', 'dan@example.com'],
+                         promote=['dan@example.com'])
+    results = {result['email']: result['detail'] for result in response.json()['results']}
+    self.assertEqual(results, {'cat@example.com': 'done', 'bob@example.com': 'done',
+                               'dan@example.com': 'conflicting actions for this user'})
+    self.assertEqual(self.usernames('members'), {'ada', 'eve'})
+    self.assertEqual(self.usernames('admin'), {'ada'})
+    response = self.bulk(remove=['bob@example.com'], promote=['dan@example.com'])
+    self.assertEqual([result['detail'] for result in response.json()['results']],
+                     ['the user does not exist in this group'] * 2)
+
+  def test_only_the_owner_may_use_it(self):
+    response = self.bulk(login_session(self.users['cat']), remove=['bob@example.com'])
+    self.assertEqual(response.status_code, 404)
+    self.assertIn('bob', self.usernames('members'))
+
+class ImportActivitiesTests(TestCase):
+  def setUp(self):
+    self.owner = make_user('ada')
+    self.session_id = login_session(self.owner)
+    self.club = Club.objects.create(owner=self.owner, name='Chess')
+    self.club.members.add(self.owner)
+    self.club.admin.add(self.owner)
+
+  def upload(self, name, content, **fields):
+    return self.client.post('/groups/import-activities', {
+      'sessionid': self.session_id, 'id': self.club.id,
+      'file': SimpleUploadedFile(name, content.encode() if isinstance(content, str) else content),
+      **fields})
+
+  def test_csv_rows_report_their_line_numbers(self):
+    response = self.upload('games.csv', 'name,cost,time,description\n'
+                                        'Blitz,1.50,00:10:00,\n'
+                                        'Rapid,,00:25:00,"two\nlines"\n'
+                                        'Broken,free,00:10:00,\n'
+                                        ',,01:00:00,\n')
+    self.assertEqual(response.status_code, 201)
+    report = response.json()
+    self.assertEqual((report['created'], report['failed'], report['errors_truncated']),
+                     (2, 2, False))
+    # The quoted newline makes Rapid span lines 3 and 4.
+    self.assertEqual([(error['line'], sorted(error['errors'])) for error in report['errors']],
+                     [(5, ['cost']), (6, ['name'])])
+    self.assertEqual(sorted(Activity.objects.filter(club=self.club).values_list('name', flat=True)),
+                     ['Blitz', 'Rapid'])
+    self.assertEqual(ClubEvent.objects.filter(club=self.club).latest('seq').payload,
+                     {'created': 2})
+
+  def test_ndjson_skips_blank_lines_and_reports_non_objects(self):
+    response = self.upload('games.ndjson', '{"name": "Blitz", "time": "00:10:00"}\n'
+                                           '\n'
+                                           '[1, 2]\n'
+                                           'not json\n'
+                                           '{"name": "Go", "time": "01:00:00"}\n')
+    report = response.json()
+    self.assertEqual(report['created'], 2)
+    self.assertEqual([error['line'] for error in report['errors']], [3, 4])
+    self.assertEqual(report['errors'][0]['errors'],
+                     {'non_field_errors': ['Row is not a JSON object']})
+
+  def test_inserts_a_batch_at_a_time(self):
+    rows = ''.join(f'{{"name": "game {index}", "time": "00:10:00", "cost": "{index}"}}\n'
+                   for index in range(5))
+    with mock.patch('club.activity_views.IMPORT_BATCH_SIZE', 2), \
+         mock.patch.object(Activity.objects, 'bulk_create',
+                           wraps=Activity.objects.bulk_create) as bulk_create:
+      response = self.upload('games.jsonl', rows)
+    self.assertEqual(response.json()['created'], 5)
+    self.assertEqual([len(call.args[0]) for call in bulk_create.call_args_list], [2, 2, 1])
+    stats = ClubStats.objects.get(club=self.club)
+    self.assertEqual(QuantileSketch.from_dict(stats.activity_costs).count, 5)
+
+  def test_caps_the_errors_listed(self):
+    with mock.patch('club.activity_views.MAX_REPORTED_ERRORS', 2):
+      response = self.upload('games.ndjson', '{}\n' * 4)
+    self.assertEqual(response.status_code, 200)
+    report = response.json()
+    self.assertEqual((report['created'], report['failed'], len(report['errors']),
+                      report['errors_truncated']), (0, 4, 2, True))
+    self.assertFalse(ClubEvent.objects.filter(club=self.club, kind='activities.imported').exists())
+
+  def test_rejects_unreadable_files(self):
+    self.assertEqual(self.upload('games.txt', 'name\n').status_code, 400)
+    self.assertEqual(self.upload('games.txt', 'name,time\nGo,01:00:00\n', format='csv')
+                     .status_code, 201)
+    response = self.upload('games.csv', b'name,time\n\xff\xfe,01:00:00\n')
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(Activity.objects.filter(club=self.club).count(), 1)
+
+def export_club(owner, start):
+  """A club with a member, a profile, two activities and a plan on one of them."""
+  club = Club.objects.create(owner=owner, name='Chess', description='Weekly games')
+  member = make_user('bob')
+  club.members.add(owner, member)
+  club.admin.add(owner)
+  ClubProfile.objects.create(club=club, user=member, budget_limit=20,
+                             maximum_time=timedelta(hours=2))
+  blitz = add_activity(club, 'Blitz')
+  add_activity(club, 'Go', 51.5, -0.12)
+  FinalPlan.objects.create(club=club, activity=blitz, start_time=start,
+                           end_time=start + timedelta(hours=1))
+  return club
+
+class ExportClubTests(TestCase):
+  def setUp(self):
+    self.owner = make_user('ada')
+    self.session_id = login_session(self.owner)
+    self.start = timezone.now().replace(microsecond=0)
+    self.club = export_club(self.owner, self.start)
+
+  def export(self, fmt, session_id=None, headers=None):
+    return self.client.post('/groups/export', json.dumps({
+      'sessionid': session_id or self.session_id, 'id': self.club.id, 'format': fmt}),
+                            content_type='application/json', headers=headers)
+
+  def test_ndjson_has_one_object_per_row_in_section_order(self):
+    response = self.export('ndjson')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+    self.assertEqual(response['Content-Disposition'],
+                     f'attachment; filename="club-{self.club.id}.ndjson"')
+    rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+    self.assertEqual([(row['section'], row.get('role') or row.get('name'))
+                      for row in rows if row['section'] != 'profiles'], [
+      ('club', 'Chess'), ('members', 'owner'), ('members', 'admin'), ('members', 'member'),
+      ('members', 'member'), ('activities', 'Blitz'), ('activities', 'Go'),
+      ('plans', None)])
+    for row in rows:
+      self.assertEqual(list(row)[1:], list(export.COLUMNS[row['section']]))
+    profile = next(row for row in rows if row['section'] == 'profiles')
+    # Durations are encoded as seconds, as in API responses.
+    self.assertEqual((profile['email'], profile['maximum_time']), ('bob@example.com', '7200.0'))
+    self.assertEqual(rows[-1]['activity_name'], 'Blitz')
+    self.assertEqual(rows[0]['owner_email'], 'ada@example.com')
+
+  def test_csv_has_a_block_per_section(self):
+    response = self.export('csv')
+    self.assertEqual(response['Content-Type'], 'text/csv')
+    text = b''.join(response.streaming_content).decode()
+    blocks = [list(csv.reader(io.StringIO(block))) for block in text.split('\r\n\r\n')]
+    self.assertEqual([block[0] for block in blocks],
+                     [['club'], ['members'], ['profiles'], ['activities'], ['plans']])
+    for block in blocks:
+      self.assertEqual(tuple(block[1]), export.COLUMNS[block[0][0]])
+    self.assertEqual([len(block) - 2 for block in blocks], [1, 4, 1, 2, 1])
+    activities = blocks[3]
+    self.assertEqual(activities[2][1:4], ['Blitz', '0.00', '01:00:00'])
+    self.assertEqual(activities[3][-2:], ['51.5', '-0.12'])
+    self.assertEqual(blocks[4][2][3], self.start.isoformat())
+
+  def test_gzips_when_accepted(self):
+    plain = b''.join(self.export('ndjson').streaming_content)
+    response = self.export('ndjson', headers={'Accept-Encoding': 'gzip, deflate'})
+    self.assertEqual(response['Content-Encoding'], 'gzip')
+    self.assertIn('Accept-Encoding', response['Vary'])
+    body = gzip.decompress(b''.join(response.streaming_content))
+    # Only the export time differs.
+    self.assertEqual(body.splitlines()[1:], plain.splitlines()[1:])
+
+  def test_only_the_owner_may_export(self):
+    member = User.objects.get(username='bob')
+    self.assertEqual(self.export('csv', login_session(member)).status_code, 404)
+
+class ExportSnapshotTests(TransactionTestCase):
+  def test_rows_written_during_an_export_are_left_out(self):
+    club = export_club(make_user('ada'), timezone.now())
+    def change():
+      try:
+        add_activity(club, 'Rapid')
+        Activity.objects.filter(name='Go').delete()
+      finally:
+        connections.close_all()
+    with mock.patch.object(export, 'FLUSH_BYTES', 1):
+      chunks = export.export_chunks(club.id, 'ndjson', 'default')
+      lines = [next(chunks)]
+      # The snapshot began with the first read; the writer is not held up by it.
+      writer = threading.Thread(target=change)
+      writer.start()
+      writer.join(5)
+      self.assertFalse(writer.is_alive())
+      lines += list(chunks)
+    names = [json.loads(line)['name'] for line in lines if b'"activities"' in line]
+    self.assertEqual(names, ['Blitz', 'Go'])
+    self.assertEqual(sorted(Activity.objects.values_list('name', flat=True)), ['Blitz', 'Rapid'])
+
+class SearchActivitiesTests(TestCase):
+  def setUp(self):
+    if not fts_available():
+      self.skipTest('SQLite was built without FTS5')
+    self.owner = make_user('ada')
+    self.session_id = login_session(self.owner)
+    self.club = Club.objects.create(owner=self.owner, name='Chess')
+    self.club.members.add(self.owner)
+    self.other = Club.objects.create(owner=self.owner, name='Go')
+    self.other.members.add(self.owner)
+    self.elsewhere = Club.objects.create(owner=make_user('bob'), name='Darts')
+
+  def add(self, club, name, description='', location=None):
+    return Activity.objects.create(club=club, name=name, description=description,
+                                   location=location, cost=0, time=timedelta(hours=1))
+
+  def search(self, query, **body):
+    response = post(self.client, '/groups/search-activities', self.session_id, query=query,
+                    **body)
+    self.assertEqual(response.status_code, 200)
+    return [activity['name'] for activity in response.json()['activities']]
+
+  def indexed(self, term):
+    return search_activities(Club.objects.values('id'), term, 10)
+
+  def test_index_follows_inserts_updates_and_deletes(self):
+    activity = self.add(self.club, 'Blitz night')
+    self.assertEqual(self.indexed('blitz'), [activity])
+    Activity.objects.filter(id=activity.id).update(name='Rapid night')
+    self.assertEqual(self.indexed('blitz'), [])
+    self.assertEqual(self.indexed('rapid'), [activity])
+    # Bulk inserts and deletes go through the triggers too.
+    Activity.objects.bulk_create([Activity(club=self.club, name='Blitz arena', cost=0,
+                                           time=timedelta(hours=1))])
+    self.assertEqual([found.name for found in self.indexed('blitz')], ['Blitz arena'])
+    self.club.delete()
+    self.assertEqual(self.indexed('night'), [])
+    self.assertEqual(self.indexed('blitz'), [])
+
+  def test_ranks_name_matches_first(self):
+    self.add(self.club, 'Openings', description='Study the blitz repertoire')
+    self.add(self.club, 'Cafe games', location='Blitz cafe')
+    self.add(self.club, 'Blitz')
+    self.add(self.club, 'Endgames')
+    self.assertEqual(self.search('blitz', id=self.club.id), ['Blitz', 'Cafe games', 'Openings'])
+
+  def test_matches_every_term_as_a_prefix(self):
+    self.add(self.club, 'Blitz tournament')
+    self.add(self.club, 'Blitz practice')
+    self.assertEqual(self.search('bli tourn'), ['Blitz tournament'])
+    self.assertEqual(self.search('"bli" OR NEAR('), [])
+    self.assertEqual(self.search('blitz', limit=1), ['Blitz tournament'])
+
+  def test_searches_only_the_callers_clubs(self):
+    self.add(self.club, 'Blitz')
+    self.add(self.other, 'Blitz go')
+    self.add(self.elsewhere, 'Blitz darts')
+    self.assertEqual(self.search('blitz'), ['Blitz', 'Blitz go'])
+    self.assertEqual(self.search('blitz', id=self.other.id), ['Blitz go'])
+    response = post(self.client, '/groups/search-activities', self.session_id, query='blitz',
+                    id=self.elsewhere.id)
+    self.assertEqual(response.status_code, 404)
+
+  def test_falls_back_to_lookups_without_the_index(self):
+    self.add(self.club, 'Openings', description='Study the blitz repertoire')
+    self.add(self.club, 'Blitz')
+    with mock.patch('club.search.fts_available', return_value=False):
+      self.assertEqual(self.search('blitz'), ['Blitz', 'Openings'])
+
+class AsyncViewParityTests(TestCase):
+  """The async read views answer exactly like their sync counterparts."""
+  def setUp(self):
+    get_session_cache().clear()
+    self.owner = make_user('ada')
+    self.session_id = login_session(self.owner)
+    self.club = Club.objects.create(owner=self.owner, name='Chess', description='Weekly')
+    self.club.members.add(self.owner)
+    self.club.admin.add(self.owner)
+    for index in range(3):
+      self.club.members.add(make_user(f'member{index}'))
+      add_activity(self.club, f'game {index}', 10.0 * index, 20.0)
+    start = timezone.now()
+    for activity in Activity.objects.all():
+      FinalPlan.objects.create(club=self.club, activity=activity, start_time=start,
+                               end_time=start + timedelta(hours=1))
+    self.stranger = Club.objects.create(owner=make_user('bob'), name='Darts')
+
+  def tearDown(self):
+    get_session_cache().clear()
+
+  def responses(self, sync_view, async_view, body, headers=None):
+    content = json.dumps(body)
+    request = RequestFactory().post('/', content, content_type='application/json',
+                                    headers=headers)
+    response = sync_view.as_view()(request)
+    response.render()
+    request = AsyncRequestFactory().post('/', content, content_type='application/json',
+                                         headers=headers)
+    return response, async_to_sync(async_view.as_view())(request)
+
+  def assertSameResponses(self, sync_view, async_view, body, headers=None):
+    expected, actual = self.responses(sync_view, async_view, body, headers)
+    self.assertEqual(actual.status_code, expected.status_code)
+    self.assertEqual(actual.get('ETag'), expected.get('ETag'))
+    self.assertEqual(actual.get('Content-Type'), expected.get('Content-Type'))
+    if expected.content:
+      self.assertEqual(json.loads(actual.content), json.loads(expected.content))
+    else:
+      self.assertEqual(actual.content, b'')
+    return expected.status_code
+
+  def test_club_reads(self):
+    club_bodies = [{'id': self.club.id}, {'id': self.club.id, 'detailed': True},
+                   {'id': self.club.id, 'detailed': True, 'members_limit': 2},
+                   {'id': self.stranger.id}, {'id': 'seven'}, {}]
+    views = [(GetClub, AsyncGetClub, club_bodies),
+             (GetClubsIn, AsyncGetClubsIn, [{}, {'detailed': True}, {'detailed': 'maybe'}]),
+             (ViewActivities, AsyncViewActivities, club_bodies + [
+               {'id': self.club.id, 'limit': 2},
+               {'id': self.club.id, 'latitude': 5.0, 'longitude': 20.0, 'radius_km': 1200},
+               {'id': self.club.id, 'latitude': 5.0},
+               {'id': self.club.id, 'cursor': 'garbage'}]),
+             (GetPlans, AsyncGetPlans, club_bodies + [{'id': self.club.id, 'limit': 1}])]
+    for sync_view, async_view, bodies in views:
+      statuses = set()
+      for body in bodies:
+        with self.subTest(view=sync_view.__name__, body=body):
+          statuses.add(self.assertSameResponses(sync_view, async_view,
+                                                {'sessionid': self.session_id, **body}))
+      self.assertIn(200, statuses)
+      self.assertIn(400, statuses)
+
+  def test_not_modified(self):
+    body = {'sessionid': self.session_id, 'id': self.club.id}
+    for sync_view, async_view in ((GetClub, AsyncGetClub), (ViewActivities, AsyncViewActivities),
+                                  (GetPlans, AsyncGetPlans)):
+      with self.subTest(view=sync_view.__name__):
+        etag = self.responses(sync_view, async_view, body)[0]['ETag']
+        status = self.assertSameResponses(sync_view, async_view, body,
+                                          {'If-None-Match': f'W/{etag}'})
+        self.assertEqual(status, 304)
+
+  def test_user_reads(self):
+    for session_id in (self.session_id, 'not-a-session', None):
+      body = {'sessionid': session_id} if session_id else {}
+      for sync_view, async_view in ((MyInfo, AsyncMyInfo), (SignedIn, AsyncSignedIn)):
+        with self.subTest(view=sync_view.__name__, session_id=session_id):
+          self.assertSameResponses(sync_view, async_view, body)
+
+class GeoQueryTests(TestCase):
+  @classmethod
+  def setUpTestData(cls):
+    owner = make_user('ada')
+    cls.club = Club.objects.create(owner=owner, name='Hikers')
+    rng = random.Random(20)
+    points = [(rng.uniform(-60, 60), rng.uniform(-180, 180)) for _ in range(300)]
+    # Crowd both sides of the antimeridian and the edges of the test boxes.
+    points += [(rng.uniform(-20, 20), rng.choice((-1, 1)) * rng.uniform(170, 180))
+               for _ in range(150)]
+    points += [(10.0, 179.5), (10.0, -179.5), (0.0, 180.0), (0.0, -180.0), (-5.0, 5.0)]
+    cls.activities = [add_activity(cls.club, f'place {index}', latitude, longitude)
+                      for index, (latitude, longitude) in enumerate(points)]
+    cls.activities.append(add_activity(cls.club, 'nowhere'))
+
+  def matching(self, area):
+    return set(Activity.objects.filter(club=self.club).filter(area).values_list('id', flat=True))
+
+  def test_bbox_matches_brute_force(self):
+    boxes = [(-10, -10, 10, 10), (-5, 5, 0, 5), (0, 170, 20, 180), (-30, -100, 45, 60),
+             # west > east crosses the antimeridian.
+             (-15, 175, 15, -175), (5, 179, 12, -179.6), (-90, 100, 90, -100)]
+    for box in boxes:
+      with self.subTest(box=box):
+        expected = {activity.id for activity in self.activities if in_box(activity, *box)}
+        self.assertEqual(self.matching(bbox_filter(*box)), expected)
+
+  def test_radius_matches_brute_force(self):
+    for latitude, longitude, radius_km in [(0, 0, 1500), (10, 179.8, 300), (-3, -179.9, 900),
+                                           (15, 178, 50), (55, 120, 2500)]:
+      with self.subTest(latitude=latitude, longitude=longitude, radius_km=radius_km):
+        expected = {activity.id for activity in self.activities
+                    if activity.latitude is not None
+                    and distance_km(latitude, longitude, activity.latitude,
+                                    activity.longitude) <= radius_km}
+        area = bbox_filter(*radius_bbox(latitude, longitude, radius_km))
+        rows = Activity.objects.filter(club=self.club).filter(area) \
+          .values_list('id', 'latitude', 'longitude')
+        ranked, more = rank_by_distance(rows, latitude, longitude, radius_km)
+        self.assertFalse(more)
+        self.assertEqual({activity_id for _, activity_id in ranked}, expected)
+
+  def test_distance_pages_cover_every_activity_in_order(self):
+    session_id = login_session(self.club.owner)
+    self.club.members.add(self.club.owner)
+    latitude, longitude = 8.0, 179.0
+    expected = sorted(self.activities, key=lambda activity: (
+      activity.latitude is None,
+      0.0 if activity.latitude is None else distance_km(latitude, longitude, activity.latitude,
+                                                        activity.longitude),
+      activity.id))
+    seen, cursor = [], None
+    while True:
+      body = {'sessionid': session_id, 'id': self.club.id, 'latitude': latitude,
+              'longitude': longitude, 'limit': 40}
+      if cursor is not None:
+        body['cursor'] = cursor
+      response = self.client.post('/groups/view-activities', json.dumps(body),
+                                  content_type='application/json')
+      self.assertEqual(response.status_code, 200)
+      page = response.json()
+      distances = [item['distance_km'] for item in page['activities']
+                   if item['distance_km'] is not None]
+      self.assertEqual(distances, sorted(distances))
+      seen += [item['id'] for item in page['activities']]
+      cursor = page['next_cursor']
+      if cursor is None:
+        break
+    self.assertEqual(seen, [activity.id for activity in expected])
+
+class QuantileSketchTests(TestCase):
+  def test_quantiles_stay_within_the_values_added(self):
+    sketch = QuantileSketch()
+    for value in (10, 10, 10):
+      sketch.add(value)
+    self.assertEqual([sketch.quantile(q) for q in (0, 0.5, 1)], [10.0, 10.0, 10.0])
+    sketch.add(9.95)
+    self.assertEqual(sketch.quantile(0), 9.95)
+    self.assertEqual(sketch.quantile(1), 10.0)
+
+  def test_bounds_survive_a_round_trip_and_reset_when_empty(self):
+    sketch = QuantileSketch()
+    sketch.add(3)
+    sketch.add(7)
+    restored = QuantileSketch.from_dict(sketch.to_dict())
+    self.assertEqual((restored.low, restored.high), (3.0, 7.0))
+    restored.remove(3)
+    restored.remove(7)
+    self.assertEqual(restored.to_dict()['min'], None)
+    self.assertIsNone(restored.quantile(0.5))
+
+  def test_removals_narrow_the_bounds_to_the_remaining_bins(self):
+    sketch = QuantileSketch()
+    for value in (5, 12, 50):
+      sketch.add(value)
+    sketch.remove(50)
+    sketch.remove(5)
+    self.assertLess(sketch.low, 12)
+    self.assertGreater(sketch.high, 12)
+    for bound in (sketch.low, sketch.high, sketch.quantile(0.5)):
+      self.assertAlmostEqual(bound / 12, 1, delta=2 * RELATIVE_ACCURACY)
+
+class ClubStatsTests(TestCase):
+  def setUp(self):
+    self.owner = make_user('ada')
+    self.session_id = login_session(self.owner)
+    self.club = Club.objects.create(owner=self.owner, name='Chess')
+    self.club.members.add(self.owner)
+    rebuild_stats(self.club.id)
+
+  def budgets(self):
+    response = post(self.client, '/groups/stats', self.session_id, id=self.club.id)
+    self.assertEqual(response.status_code, 200)
+    return response.json()['budgets']
+
+  def test_edited_budgets_stay_near_the_data_until_rebuilt(self):
+    for budget in ('50.00', '12.00'):
+      response = post(self.client, '/groups/edit-profile', self.session_id, id=self.club.id,
+                      budget_limit=budget)
+      self.assertEqual(response.status_code, 200)
+    budgets = self.budgets()
+    self.assertEqual(budgets['count'], 1)
+    self.assertAlmostEqual(budgets['p50'] / 12, 1, delta=RELATIVE_ACCURACY)
+    self.assertLess(budgets['p90'], 12 * (1 + RELATIVE_ACCURACY))
+    rebuild_stats(self.club.id)
+    self.assertEqual([self.budgets()[f'p{q}'] for q in (10, 50, 90)], [12.0, 12.0, 12.0])
+
+@override_settings(GEOCODING={'PLACES': {'Central Park ': (40.7829, -73.9654)}})
+class OfflineGeocoderTests(TestCase):
+  def test_reads_coordinates(self):
+    geocoder = OfflineGeocoder()
+    self.assertEqual(geocoder.geocode(' 51.5, -0.12 '), (51.5, -0.12))
+    self.assertEqual(geocoder.geocode('-33,151'), (-33.0, 151.0))
+
+  def test_rejects_coordinates_out_of_range(self):
+    geocoder = OfflineGeocoder()
+    self.assertIsNone(geocoder.geocode('91, 0'))
+    self.assertIsNone(geocoder.geocode('0, -180.5'))
+
+  def test_looks_up_places_ignoring_case_and_spaces(self):
+    geocoder = OfflineGeocoder()
+    self.assertEqual(geocoder.geocode('central park'), (40.7829, -73.9654))
+    self.assertEqual(geocoder.geocode('  CENTRAL PARK'), (40.7829, -73.9654))
+    self.assertIsNone(geocoder.geocode('Hyde Park'))
+
+class ReplicaRoutingTests(TestCase):
+  """Reads of read-only views against a replica file that lags the primary.
+
+  The replica is outside the test transaction, so each test removes the rows
+  it replicated.
+  """
+  @classmethod
+  def setUpClass(cls):
+    cls.replica_dir = tempfile.TemporaryDirectory()
+    replica_path = os.path.join(cls.replica_dir.name, 'replica.sqlite3')
+    # A copy of the freshly migrated primary, taken before the class
+    # transaction begins, since VACUUM cannot run inside one.
+    with connections['default'].cursor() as cursor:
+      cursor.execute('VACUUM INTO %s', [replica_path])
+    super().setUpClass()
+    connections.settings['replica'] = connections.configure_settings({
+      'default': connections.settings['default'],
+      'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': replica_path},
+    })['replica']
+    cls.replicas = override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'STICKY_SECONDS': 60})
+    cls.replicas.enable()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.replicas.disable()
+    connections['replica'].close()
+    del connections['replica']
+    del connections.settings['replica']
+    cls.replica_dir.cleanup()
+    super().tearDownClass()
+
+  def setUp(self):
+    db_router._sticky_store = None
+    self.user = make_user('ada')
+    self.club = Club.objects.create(owner=self.user, name='Chess')
+    self.club.members.add(self.user)
+    self.session_id = login_session(self.user)
+    # Replicated before the first activity was added.
+    self.user.save(using='replica', force_insert=True)
+    self.club.save(using='replica', force_insert=True)
+    Club.members.through.objects.using('replica').create(club_id=self.club.id,
+                                                          user_id=self.user.id)
+    add_activity(self.club, 'Blitz')
+
+  def tearDown(self):
+    db_router._sticky_store = None
+    User.objects.using('replica').all().delete()
+
+  def post(self, path, body):
+    response = self.client.post(path, json.dumps({'sessionid': self.session_id,
+                                                  'id': self.club.id, **body}),
+                                content_type='application/json')
+    self.assertLess(response.status_code, 300, response.content)
+    return response.json()
+
+  def activity_names(self):
+    page = self.post('/groups/view-activities', {})
+    return [activity['name'] for activity in page['activities']]
+
+  def test_read_only_views_read_the_replica(self):
+    self.assertEqual(self.activity_names(), [])
+
+  def test_own_writes_make_reads_sticky_to_the_primary(self):
+    self.post('/groups/add-activity', {'name': 'Rapid', 'cost': '0.00', 'time': '01:00:00'})
+    self.assertEqual(self.activity_names(), ['Blitz', 'Rapid'])
+
+  def test_stats_view_reads_the_replica_without_saving_a_row(self):
+    stats = self.post('/groups/stats', {})
+    self.assertEqual(stats['activities']['cost']['count'], 0)
+    self.assertFalse(ClubStats.objects.filter(club=self.club).exists())
+
+  def test_stats_rebuild_reads_the_primary_under_a_read_only_route(self):
+    request = RequestFactory().post('/groups/stats')
+    request.user = self.user
+    token = db_router.current_route.set(db_router.Route(request, read_only=True))
+    try:
+      stats = rebuild_stats(self.club.id)
+    finally:
+      db_router.current_route.reset(token)
+    self.assertEqual(QuantileSketch.from_dict(stats.activity_costs).count, 1)
+
+  def test_other_users_writes_do_not_make_the_caller_sticky(self):
+    other = make_user('bob')
+    self.club.members.add(other)
+    session_id, self.session_id = self.session_id, login_session(other)
+    self.post('/groups/add-activity', {'name': 'Rapid', 'cost': '0.00', 'time': '01:00:00'})
+    self.session_id = session_id
+    self.assertEqual(self.activity_names(), [])
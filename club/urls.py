@@ -1,15 +1,16 @@
 from django.urls import path
-from .member_views import GetClubsIn, GetClub, JoinClub, LeaveClub, MyClubStatus, ViewClubProfile, EditClubProfile, GetPlans
-from .owner_views import CreateClub, GetOwnedClubs, AdminInfo, PromoteMember, RemoveMember, DeleteClub, TransferClub, ChangeJoinStatus, CreateFinalPlan, DeleteFinalPlan, EditFinalPlan
-from .activity_views import AddActivity, ViewActivities, DeleteActivity
+from .member_views import GetClubsIn, GetClub, JoinClub, LeaveClub, MyClubStatus, ViewClubProfile, EditClubProfile, GetPlans, ChangesSince, ClubStream, AsyncGetClubsIn, AsyncGetClub, AsyncGetPlans
+from .owner_views import CreateClub, GetOwnedClubs, AdminInfo, PromoteMember, RemoveMember, DeleteClub, TransferClub, BulkMembership, ChangeJoinStatus, CreateFinalPlan, DeleteFinalPlan, EditFinalPlan, ExportClub, ClubStatsView
+from .activity_views import AddActivity, ViewActivities, DeleteActivity, ActivityFeasibility, AsyncViewActivities, SearchActivities, ImportActivities
+from global_tools.async_views import read_view
 
 urlpatterns = [
   path('create', CreateClub.as_view(), name='create_club'),
   
   path('get-owned-groups', GetOwnedClubs.as_view(), name="view_clubs_owned"),
   path('admin-group-info', AdminInfo.as_view(), name='view_club_as_admin'),
-  path('get-groups-in', GetClubsIn.as_view(), name='view_clubs_in'),
-  path('group-info' , GetClub.as_view(), name='view_club_info'),
+  path('get-groups-in', read_view(GetClubsIn, AsyncGetClubsIn), name='view_clubs_in'),
+  path('group-info' , read_view(GetClub, AsyncGetClub), name='view_club_info'),
   path('my-status', MyClubStatus.as_view(), name='view_my_club_status'),
   
   path('join-group', JoinClub.as_view(), name='join_club'),
@@ -17,19 +18,28 @@ urlpatterns = [
 
   path('promote-member', PromoteMember.as_view(), name='promote_member'),
   path('remove-member', RemoveMember.as_view(), name='remove_member'),
+  path('bulk-membership', BulkMembership.as_view(), name='bulk_membership'),
   path('delete-group', DeleteClub.as_view(), name='delete_club'),
   path('transfer-group', TransferClub.as_view(), name='transfer_club'),
+  path('export', ExportClub.as_view(), name='export_club'),
+  path('stats', ClubStatsView.as_view(), name='club_stats'),
   path('change-join-status', ChangeJoinStatus.as_view(), name='change_join_status'),
 
   path('add-activity', AddActivity.as_view(), name='add_activity'),
-  path('view-activities', ViewActivities.as_view(), name='view_activities'),
+  path('import-activities', ImportActivities.as_view(), name='import_activities'),
+  path('view-activities', read_view(ViewActivities, AsyncViewActivities), name='view_activities'),
   path('delete-activity', DeleteActivity.as_view(), name='delete_activity'),
+  path('activity-feasibility', ActivityFeasibility.as_view(), name='activity_feasibility'),
+  path('search-activities', SearchActivities.as_view(), name='search_activities'),
 
   path('view-profile', ViewClubProfile.as_view(), name='view_club_profile'),
   path('edit-profile', EditClubProfile.as_view(), name='edit_club_profile'),
 
   path('add-plan', CreateFinalPlan.as_view(), name='create_final_plan'),
-  path('view-plans', GetPlans.as_view(), name='view_plans'),
+  path('view-plans', read_view(GetPlans, AsyncGetPlans), name='view_plans'),
   path('edit-plan', EditFinalPlan.as_view(), name='edit_plan'),
-  path('delete-plan', DeleteFinalPlan.as_view(), name='delete_plan')
+  path('delete-plan', DeleteFinalPlan.as_view(), name='delete_plan'),
+
+  path('changes-since', ChangesSince.as_view(), name='changes_since'),
+  path('stream', ClubStream.as_view(), name='club_stream')
 ]
\ No newline at end of file
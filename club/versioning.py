@@ -0,0 +1,124 @@
+import hashlib
+import json
+from functools import partial
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from global_tools.push import publish
+from .models import Club, ClubEvent
+
+DEFAULTS = {
+  'KEEP': 500,
+  'TRIM_EVERY': 50,
+  'MAX_AGE': 60 * 60 * 24 * 30,
+}
+
+def get_setting(name):
+  return getattr(settings, 'CLUB_EVENTS', {}).get(name, DEFAULTS[name])
+
+def record_change(club_id, kind, payload=None):
+  """Mark a club's data as changed and log the change as event number ``version``.
+
+  Every mutation of a club or its rows calls this, so the club's events are
+  numbered without gaps and ``changes-since`` can tell when some were trimmed.
+  Returns the new version, or None if the club is gone.
+  """
+  with transaction.atomic():
+    # The update locks the row until commit, so the version read back is ours.
+    Club.objects.filter(id=club_id).update(version=F('version') + 1)
+    version = Club.objects.filter(id=club_id).values_list('version', flat=True).first()
+    if version is None:
+      return None
+    event = ClubEvent.objects.create(club_id=club_id, seq=version, kind=kind, payload=payload or {})
+    transaction.on_commit(partial(publish_event, event))
+  if version % get_setting('TRIM_EVERY') == 0:
+    trim_events(club_id, version)
+  return version
+
+def record_changes(clubs, kind, payload=None):
+  """``record_change`` with the same event for every club in a queryset."""
+  with transaction.atomic():
+    updated = Club.objects.filter(id__in=clubs.values('id'))
+    updated.update(version=F('version') + 1)
+    events = ClubEvent.objects.bulk_create([ClubEvent(club_id=club_id, seq=version, kind=kind,
+                                                      payload=payload or {})
+                                            for club_id, version in updated.values_list('id', 'version')])
+    for event in events:
+      transaction.on_commit(partial(publish_event, event))
+
+def club_channel(club_id):
+  return f'club:{club_id}'
+
+def removed_emails(kind, payload):
+  """Emails of the users an event takes out of the club; their streams end with it."""
+  if kind in ('member.removed', 'member.left'):
+    return [payload['email']]
+  if kind == 'members.bulk':
+    return [result['email'] for result in payload['results']
+            if result['action'] == 'remove' and result['ok']]
+  return []
+
+def publish_event(event):
+  """Push a committed event to the club's subscribers, see ``ClubStream``."""
+  publish(club_channel(event.club_id), {
+    'seq': event.seq,
+    'kind': event.kind,
+    'data': json.dumps(event.to_dict(), cls=JSONEncoder),
+    'removed': removed_emails(event.kind, event.payload),
+  })
+
+def publish_club_deleted(club_id):
+  publish(club_channel(club_id), {'seq': None, 'kind': 'club.deleted'})
+
+def trim_events(club_id, version):
+  """Drop the club's events that fell out of the ``KEEP`` most recent ones."""
+  return ClubEvent.objects.filter(club_id=club_id,
+                                  seq__lte=version - get_setting('KEEP')).delete()[0]
+
+def changes_since(club, since, limit):
+  """The club's events after version ``since``, oldest first.
+
+  Returns ``(events, reset)``; ``reset`` is True when events the client has
+  not seen were already trimmed, so it has to reload the club instead.
+  """
+  if since == club.version:
+    return [], False
+  if since > club.version:
+    return [], True
+  events = list(ClubEvent.objects.filter(club_id=club.id, seq__gt=since).order_by('seq')[:limit])
+  if not events or events[0].seq != since + 1:
+    return [], True
+  return events, False
+
+def club_etag(club, endpoint, params):
+  """ETag for one representation of a club's data at its current version.
+
+  ``params`` are the request parameters that shape the payload, so pages and
+  detail levels get distinct tags.
+  """
+  digest = hashlib.blake2b(json.dumps([endpoint, params], sort_keys=True, default=str).encode(),
+                           digest_size=8).hexdigest()
+  return f'"{club.id}-{club.version}-{digest}"'
+
+def etag_matches(request, etag):
+  """Whether the request's ``If-None-Match`` lists ``etag`` (weak comparison)."""
+  header = request.headers.get('If-None-Match')
+  if not header:
+    return False
+  if header.strip() == '*':
+    return True
+  tags = [tag.strip() for tag in header.split(',')]
+  return any(tag.removeprefix('W/') == etag for tag in tags)
+
+def not_modified(request, etag):
+  """A 304 response when the client already holds ``etag``, else None."""
+  if etag_matches(request, etag):
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+  return None
+
+def with_etag(response, etag):
+  response['ETag'] = etag
+  return response
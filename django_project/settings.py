@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'global_tools.metrics.MetricsMiddleware',
+    'global_tools.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -54,6 +56,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'global_tools.write_queue.WriteQueueMiddleware',
 ]
 
 # Only use clickjacking protection in deployments because the Development Web View uses 
@@ -85,13 +88,55 @@ WSGI_APPLICATION = 'django_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# SQLite tuned for concurrent requests, see global_tools/sqlite/base.py: WAL
+# journaling so reads never wait on the writer, a busy timeout instead of
+# "database is locked" errors, and transactions that take the write lock up
+# front. Connections are kept open between requests.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'global_tools.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 5,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': 5000,
+            },
+        },
+        # A file rather than SQLite's in-memory default, so tests see WAL and
+        # locking as served and can open it alongside a replica file.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# A read replica of the default database (kept up to date by external
+# replication, e.g. Litestream or LiteFS), used when its path is given.
+if os.environ.get('HUDDL_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['HUDDL_REPLICA_DB'],
+    }
+
+DATABASE_ROUTERS = ['global_tools.db_router.ReplicaRouter']
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# A cache every worker process shares, used by SESSION_USER_CACHE when its
+# URL is given. Needs the redis extra.
+if os.environ.get('HUDDL_SHARED_CACHE_URL'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['HUDDL_SHARED_CACHE_URL'],
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -146,4 +191,97 @@ CSRF_COOKIE_SECURE = True
 CSRF_COOKIE_SAMESITE = 'None'
 SESSION_COOKIE_SECURE = True
 SESSION_COOKIE_SAMESITE = 'None'
-CORS_ALLOW_CREDENTIALS = True
\ No newline at end of file
+CORS_ALLOW_CREDENTIALS = True
+# Cache mapping session ids to user rows, see global_tools/session_cache.py.
+# ALIAS names a CACHES alias shared by all workers (the 'shared' Redis cache
+# when HUDDL_SHARED_CACHE_URL is set): hits then need no query, and logouts
+# and profile updates invalidate entries everywhere. Without it each worker
+# keeps its own entries and still checks the session row on every hit (one
+# query instead of two), and other workers serve a user's row as it was for
+# up to TTL seconds after they update it.
+SESSION_USER_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TTL': 60,
+    'ALIAS': 'shared' if 'shared' in CACHES else None,
+}
+# Per-endpoint request metrics served at /metrics, see global_tools/metrics.py.
+# Every worker process adds its samples to the SQLite file at PATH so the
+# exposition covers the whole deployment; with PATH None it is per process.
+# Only staff signed in to the admin, or scrapers sending "Authorization: Bearer
+# <TOKEN>", may read it.
+METRICS = {
+    'PATH': BASE_DIR / 'metrics.sqlite3',
+    'FLUSH_INTERVAL': 1.0,
+    'TOKEN': os.environ.get('HUDDL_METRICS_TOKEN'),
+}
+# Serve the read endpoints (group-info, get-groups-in, view-activities,
+# view-plans, my-info, signed-in) with async views. Enable when running
+# under asgi.py, see global_tools/async_views.py.
+ASYNC_READ_VIEWS = False
+# Stateless bearer tokens, see global_tools/tokens.py. When ENABLED, login and
+# register return a signed "token" (valid for MAX_AGE seconds) instead of
+# creating a session; clients send it as "Authorization: Bearer <token>".
+AUTH_TOKENS = {
+    'ENABLED': False,
+    'MAX_AGE': 60 * 60 * 24 * 14,
+}
+# Password hashing runs in a pool of WORKERS processes (0 hashes inline), at
+# most MAX_CONCURRENT at a time per server process. Up to MAX_QUEUE more
+# requests wait QUEUE_TIMEOUT seconds for a slot; the rest get a 503 with
+# Retry-After: RETRY_AFTER. See global_tools/hashing.py.
+PASSWORD_HASHING = {
+    'WORKERS': 2,
+    'MAX_CONCURRENT': 4,
+    'MAX_QUEUE': 16,
+    'QUEUE_TIMEOUT': 1.0,
+    'RETRY_AFTER': 2,
+}
+# Per-club change log served by changes-since, see club/versioning.py. Each
+# club keeps its KEEP most recent events (trimmed on every TRIM_EVERY-th
+# write); compact_club_events also drops events older than MAX_AGE seconds.
+CLUB_EVENTS = {
+    'KEEP': 500,
+    'TRIM_EVERY': 50,
+    'MAX_AGE': 60 * 60 * 24 * 30,
+}
+# Server-sent club updates at groups/stream, see global_tools/push.py. Enable
+# only when serving through asgi.py. BACKEND 'local' fans out within one
+# process; 'redis' relays through the Redis-compatible server at REDIS_URL
+# (install the "redis" extra) so every worker process sees every change.
+# Streams more than QUEUE_SIZE events behind are closed; idle streams get a
+# keepalive comment every HEARTBEAT seconds.
+PUSH = {
+    'ENABLED': False,
+    'BACKEND': 'local',
+    'REDIS_URL': 'redis://localhost:6379/0',
+    'QUEUE_SIZE': 100,
+    'HEARTBEAT': 15.0,
+}
+# Geocoder filling in coordinates for activities added with only a location,
+# see club/geocoding.py. The default backend works offline: it reads
+# "latitude, longitude" strings and the names in PLACES, e.g.
+# {'Waterloo Park': (43.4643, -80.5297)}.
+GEOCODING = {
+    'BACKEND': 'club.geocoding.OfflineGeocoder',
+    'PLACES': {},
+}
+# Databases the views marked read_only (group-info, view-activities,
+# view-plans, get-groups-in, my-info and the like) read from, see
+# global_tools/db_router.py. A user who just wrote reads from the primary for
+# STICKY_SECONDS; set CACHE_ALIAS to a CACHES alias to share that between worker processes.
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': 10,
+    'CACHE_ALIAS': None,
+}
+# Single-writer queue for the default database, see global_tools/write_queue.py.
+# When enabled, views that may write (all but those with queue_writes = False)
+# run on one writer thread, and those arriving within BATCH_WINDOW seconds of
+# each other (up to MAX_BATCH) are committed together. Reads keep running
+# concurrently. Requests not started within TIMEOUT seconds get a 503.
+WRITE_QUEUE = {
+    'ENABLED': False,
+    'MAX_BATCH': 32,
+    'BATCH_WINDOW': 0.002,
+    'TIMEOUT': 30.0,
+}
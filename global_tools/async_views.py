@@ -0,0 +1,91 @@
+import io
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import exception_handler
+
+def request_data(request):
+  """The request body parsed the way DRF's ``request.data`` would for JSON and forms."""
+  if request.content_type == 'application/json':
+    return JSONParser().parse(io.BytesIO(request.body)) if request.body else {}
+  return request.POST
+
+def render_response(response):
+  """Render a DRF ``Response`` to JSON in place of ``APIView.finalize_response``.
+
+  Rendering here keeps Django from handing the deferred render to a worker
+  thread.
+  """
+  if not isinstance(response, Response):
+    return response
+  rendered = HttpResponse(JSONRenderer().render(response.data), status=response.status_code,
+                          content_type='application/json')
+  if response.data is None:
+    # As in DRF, an empty body (a 304, say) goes without a Content-Type.
+    del rendered['Content-Type']
+  for header, value in response.headers.items():
+    if header.lower() != 'content-type':
+      rendered.headers[header] = value
+  return rendered
+
+class AsyncAPIView(View):
+  """Async counterpart of ``APIView`` for the JSON POST endpoints.
+
+  Handlers read the parsed body from ``request.data`` and return the same
+  ``Response`` objects as the sync views; ``APIException`` is handled by
+  DRF's exception handler.
+  """
+  http_method_names = ['post', 'options']
+
+  @classmethod
+  def as_view(cls, **initkwargs):
+    return csrf_exempt(super().as_view(**initkwargs))
+
+  async def dispatch(self, request, *args, **kwargs):
+    try:
+      if request.method == 'POST':
+        request.data = request_data(request)
+      response = await super().dispatch(request, *args, **kwargs)
+    except APIException as exc:
+      response = exception_handler(exc, {'view': self, 'request': request})
+    return render_response(response)
+
+def read_view(sync_view, async_view, **initkwargs):
+  """The async implementation of a read endpoint when ``ASYNC_READ_VIEWS`` is on.
+
+  Only worth enabling when serving through ``asgi.py``; under WSGI every async
+  view runs in its own event loop.
+  """
+  if getattr(settings, 'ASYNC_READ_VIEWS', False):
+    return async_view.as_view(**initkwargs)
+  return sync_view.as_view(**initkwargs)
+
+def is_asgi_request(request):
+  """Whether ``request`` (Django's or DRF's) is being served through ``asgi.py``.
+
+  Only the WSGI handler puts ``wsgi.input`` in ``META``.
+  """
+  return request.META.get('wsgi.input') is None
+
+async def aiter_sync(iterator):
+  """Iterate a sync iterator from async code one item at a time.
+
+  ``StreamingHttpResponse`` served under ASGI would otherwise read a sync
+  iterator into a list first. Every step runs on the request's thread, so a
+  transaction the iterator opens spans all of them.
+  """
+  step = sync_to_async(next, thread_sensitive=True)
+  done = object()
+  try:
+    while (item := await step(iterator, done)) is not done:
+      yield item
+  finally:
+    close = getattr(iterator, 'close', None)
+    if close is not None:
+      await sync_to_async(close, thread_sensitive=True)()
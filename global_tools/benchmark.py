@@ -0,0 +1,420 @@
+import asyncio
+import importlib
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, get_resolver, reverse
+from django.utils import timezone
+from club.models import Activity, Club, ClubProfile, FinalPlan
+from club.versioning import record_change
+from huddl.models import User
+
+PASSWORD = 'benchmark-password-1'
+METRICS_TOKEN = 'benchmark-metrics-token'
+BASE_SIZES = {
+  'users': 200,
+  'clubs': 20,
+  'members_per_club': 40,
+  'activities_per_club': 50,
+  'plans_per_club': 20,
+  'profiles_per_club': 20,
+}
+
+def scaled_sizes(scale):
+  sizes = {name: max(1, int(size * scale)) for name, size in BASE_SIZES.items()}
+  sizes['members_per_club'] = min(sizes['members_per_club'], sizes['users'] - 1)
+  sizes['profiles_per_club'] = min(sizes['profiles_per_club'], sizes['members_per_club'])
+  return sizes
+
+def login_session(user):
+  session = SessionStore()
+  session['_auth_user_id'] = str(user.id)
+  session['_auth_user_backend'] = 'huddl.authentication.UserBackend'
+  session['_auth_user_hash'] = user.get_session_auth_hash()
+  session.create()
+  return session.session_key
+
+class Dataset:
+  """A deterministic data set; everything is derived from ``seed`` and ``scale``."""
+  def __init__(self, scale=1.0, seed=0):
+    self.scale = scale
+    self.seed = seed
+    self.sizes = scaled_sizes(scale)
+    self.random = random.Random(seed)
+    self.counter = 0
+
+  def unique(self, prefix):
+    self.counter += 1
+    return f'{prefix}{self.counter}'
+
+  def seed_database(self):
+    sizes = self.sizes
+    rng = self.random
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([
+      User(username=f'bench{i}', email=f'bench{i}@example.com', full_name=f'Bench User {i}',
+           is_staff=False, password=password,
+           default_budget_limit=Decimal(rng.randint(5, 200)),
+           default_max_time=timedelta(minutes=rng.choice((30, 60, 120, 240))))
+      for i in range(sizes['users'])
+    ], batch_size=500)
+    users = list(User.objects.filter(username__startswith='bench').order_by('id'))
+    self.actor = users[0]
+    others = users[1:]
+
+    Club.objects.bulk_create([
+      Club(owner=self.actor if i % 2 == 0 else rng.choice(others), name=f'Bench Club {i}',
+           description='benchmark club', join_enabled=True, join_id=f'BENCH{i:06d}')
+      for i in range(sizes['clubs'])
+    ], batch_size=500)
+    self.clubs = list(Club.objects.filter(name__startswith='Bench Club').order_by('id'))
+    self.club = self.clubs[0]
+
+    Members = Club.members.through
+    Admins = Club.admin.through
+    members = []
+    admins = []
+    profiles = []
+    for club in self.clubs:
+      chosen = {club.owner_id, self.actor.id}
+      chosen.update(user.id for user in rng.sample(others, sizes['members_per_club']))
+      members.extend(Members(club_id=club.id, user_id=user_id) for user_id in chosen)
+      admins.append(Admins(club_id=club.id, user_id=club.owner_id))
+      for user_id in rng.sample(sorted(chosen), sizes['profiles_per_club']):
+        profiles.append(ClubProfile(club_id=club.id, user_id=user_id,
+                                    budget_limit=Decimal(rng.randint(5, 200)),
+                                    maximum_time=timedelta(minutes=rng.choice((30, 60, 120)))))
+    Members.objects.bulk_create(members, batch_size=1000, ignore_conflicts=True)
+    Admins.objects.bulk_create(admins, batch_size=1000, ignore_conflicts=True)
+    ClubProfile.objects.bulk_create(profiles, batch_size=1000)
+
+    Activity.objects.bulk_create([
+      Activity(club_id=club.id, cost=Decimal(rng.randint(0, 15000)) / 100,
+               time=timedelta(minutes=rng.randint(15, 300)), name=f'Activity {club.id}-{i}',
+               description='benchmark activity', location=f'Location {i}')
+      for club in self.clubs for i in range(sizes['activities_per_club'])
+    ], batch_size=1000)
+    activity_ids = {}
+    for activity_id, club_id in Activity.objects.values_list('id', 'club_id'):
+      activity_ids.setdefault(club_id, []).append(activity_id)
+    start = timezone.now().replace(microsecond=0)
+    FinalPlan.objects.bulk_create([
+      FinalPlan(club_id=club.id, activity_id=rng.choice(activity_ids[club.id]),
+                start_time=start + timedelta(hours=rng.randint(0, 24 * 60)),
+                end_time=start + timedelta(hours=rng.randint(24 * 60, 24 * 61)))
+      for club in self.clubs for _ in range(sizes['plans_per_club'])
+    ], batch_size=1000)
+
+    self.session = login_session(self.actor)
+    self.member = User.objects.filter(clubs_in=self.club).exclude(id=self.club.owner_id) \
+      .exclude(id=self.actor.id).first()
+    self.member_session = login_session(self.member)
+
+  def new_user(self):
+    name = self.unique('benchextra')
+    return User.objects.create(username=name, email=f'{name}@example.com', full_name=name,
+                               is_staff=False, password=make_password(None))
+
+  def new_club(self, members=()):
+    club = Club.objects.create(owner=self.actor, name=self.unique('Bench Scratch '),
+                               join_enabled=False)
+    club.admin.add(self.actor)
+    club.members.add(self.actor, *members)
+    return club
+
+  def new_activity(self, club=None):
+    return Activity.objects.create(club=club or self.club, cost=Decimal('10.00'),
+                                   time=timedelta(hours=1), name=self.unique('Scratch Activity '))
+
+  def new_plan(self):
+    start = timezone.now() + timedelta(days=3)
+    return FinalPlan.objects.create(club=self.club, activity=self.new_activity(),
+                                    start_time=start, end_time=start + timedelta(hours=2))
+
+def scenarios(data):
+  """Request payload factories keyed by URL name.
+
+  Factories run untimed before each request, so endpoints that consume state
+  (deleting, leaving, transferring) get fresh rows every iteration.
+  """
+  club = data.club
+  session = data.session
+  plan_window = {'start_time': (timezone.now() + timedelta(days=5)).isoformat(),
+                 'end_time': (timezone.now() + timedelta(days=5, hours=2)).isoformat()}
+
+  def join_club():
+    user = data.new_user()
+    return {'sessionid': login_session(user), 'join_id': club.join_id}
+
+  def leave_club():
+    user = data.new_user()
+    scratch = data.new_club(members=[user])
+    return {'sessionid': login_session(user), 'id': scratch.id}
+
+  def promote_member():
+    user = data.new_user()
+    scratch = data.new_club(members=[user])
+    return {'sessionid': session, 'id': scratch.id, 'promote_email': user.email}
+
+  def remove_member():
+    user = data.new_user()
+    scratch = data.new_club(members=[user])
+    return {'sessionid': session, 'id': scratch.id, 'remove_email': user.email}
+
+  def bulk_membership():
+    users = [data.new_user() for _ in range(10)]
+    scratch = data.new_club()
+    return {'sessionid': session, 'id': scratch.id, 'add': [user.email for user in users]}
+
+  def transfer_club():
+    user = data.new_user()
+    scratch = data.new_club(members=[user])
+    return {'sessionid': session, 'id': scratch.id, 'new_owner_email': user.email}
+
+  def changes_since():
+    # Seeded rows have no events, so log enough changes for a full window.
+    version = Club.objects.values_list('version', flat=True).get(id=club.id)
+    while club.events.filter(seq__gt=version - 20).count() < 20:
+      version = record_change(club.id, 'activity.added', data.new_activity().to_dict())
+    return {'sessionid': data.member_session, 'id': club.id, 'since': version - 20}
+
+  def import_activities():
+    rows = ''.join(f'{data.unique("Bench Imported ")},7.50,01:00:00\n' for _ in range(50))
+    return {'sessionid': session, 'id': club.id,
+            'file': ContentFile(('name,cost,time\n' + rows).encode(), name='activities.csv')}
+
+  def register():
+    name = data.unique('benchreg')
+    return {'username': name, 'email': f'{name}@example.com', 'full_name': 'Bench Register',
+            'password': PASSWORD}
+
+  return {
+    'login': lambda: {'email': data.actor.email, 'password': PASSWORD},
+    'register': register,
+    'logout': lambda: {'sessionid': login_session(data.member)},
+    'my_info': lambda: {'sessionid': session},
+    'update_info': lambda: {'sessionid': session, 'full_name': data.unique('Bench Actor ')},
+    'signed_in': lambda: {'sessionid': session},
+
+    'create_club': lambda: {'sessionid': session, 'name': data.unique('Bench Created '),
+                            'join_enabled': True},
+    'view_clubs_owned': lambda: {'sessionid': session, 'detailed': True},
+    'view_club_as_admin': lambda: {'sessionid': session, 'id': club.id, 'detailed': True},
+    'view_clubs_in': lambda: {'sessionid': session, 'detailed': True},
+    'view_club_info': lambda: {'sessionid': data.member_session, 'id': club.id, 'detailed': True},
+    'view_my_club_status': lambda: {'sessionid': data.member_session, 'id': club.id},
+    'join_club': join_club,
+    'leave_club': leave_club,
+    'promote_member': promote_member,
+    'remove_member': remove_member,
+    'bulk_membership': bulk_membership,
+    'delete_club': lambda: {'sessionid': session, 'id': data.new_club().id},
+    'transfer_club': transfer_club,
+    'club_stats': lambda: {'sessionid': session, 'id': club.id},
+    'export_club': lambda: {'sessionid': session, 'id': club.id, 'format': 'csv'},
+    'change_join_status': lambda: {'sessionid': session, 'id': data.new_club().id,
+                                   'join_enabled': True},
+    'add_activity': lambda: {'sessionid': data.member_session, 'id': club.id, 'cost': '12.50',
+                             'time': '01:30:00', 'name': data.unique('Bench Added ')},
+    'import_activities': import_activities,
+    'view_activities': lambda: {'sessionid': data.member_session, 'id': club.id},
+    'delete_activity': lambda: {'sessionid': session, 'id': club.id,
+                                'activity_id': data.new_activity().id},
+    'activity_feasibility': lambda: {'sessionid': data.member_session, 'id': club.id},
+    'search_activities': lambda: {'sessionid': session, 'query': 'activity 1'},
+    'view_club_profile': lambda: {'sessionid': data.member_session, 'id': club.id},
+    'edit_club_profile': lambda: {'sessionid': data.member_session, 'id': club.id,
+                                  'budget_limit': '75.00'},
+    'create_final_plan': lambda: {'sessionid': session, 'id': club.id,
+                                  'activity_id': data.new_activity().id, **plan_window},
+    'view_plans': lambda: {'sessionid': data.member_session, 'id': club.id},
+    'edit_plan': lambda: {'sessionid': session, 'id': club.id, 'plan_id': data.new_plan().id,
+                          **plan_window},
+    'delete_plan': lambda: {'sessionid': session, 'id': club.id, 'plan_id': data.new_plan().id},
+    'changes_since': changes_since,
+    # club_stream has no scenario: the stream only ends when the client
+    # disconnects, so there is no response time to measure.
+
+    'metrics': lambda: {},
+  }
+
+# Request headers for the scenarios that need more than a session id.
+HEADERS = {
+  'metrics': {'Authorization': f'Bearer {METRICS_TOKEN}'},
+}
+
+def route_names():
+  """URL names of every API route, i.e. everything except the admin site."""
+  names = []
+  for pattern in get_resolver().url_patterns:
+    if getattr(pattern, 'app_name', None) == 'admin' or str(pattern.pattern) == 'admin/':
+      continue
+    for sub in getattr(pattern, 'url_patterns', [pattern]):
+      if sub.name:
+        names.append(sub.name)
+  return names
+
+def percentile(values, fraction):
+  ordered = sorted(values)
+  index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+  return ordered[index]
+
+def measure(client, name, payload_factory, iterations, warmup, headers=None):
+  path = reverse(name)
+  latencies = []
+  queries = []
+  statuses = {}
+  for i in range(warmup + iterations):
+    payload = payload_factory()
+    if any(hasattr(value, 'read') for value in payload.values()):
+      # Uploads go as multipart form data.
+      request = {'data': payload}
+    else:
+      request = {'data': json.dumps(payload), 'content_type': 'application/json'}
+    with CaptureQueriesContext(connection) as captured:
+      start = time.perf_counter()
+      response = client.post(path, headers=headers, **request)
+      if response.streaming:
+        b''.join(response.streaming_content)
+      elapsed = time.perf_counter() - start
+    if i < warmup:
+      continue
+    latencies.append(elapsed * 1000)
+    queries.append(len(captured.captured_queries))
+    statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+  return {
+    'path': path,
+    'iterations': iterations,
+    'latency_ms': {
+      'p50': percentile(latencies, 0.5),
+      'p90': percentile(latencies, 0.9),
+      'p99': percentile(latencies, 0.99),
+      'mean': statistics.fmean(latencies),
+    },
+    'queries': {'median': statistics.median(queries), 'max': max(queries)},
+    'statuses': statuses,
+  }
+
+def run(data, iterations=20, warmup=2, only=None):
+  client = Client(raise_request_exception=False)
+  factories = scenarios(data)
+  results = {}
+  skipped = []
+  with override_settings(METRICS={**settings.METRICS, 'TOKEN': METRICS_TOKEN}):
+    for name in route_names():
+      if only and name not in only:
+        continue
+      if name not in factories:
+        skipped.append(name)
+        continue
+      results[name] = measure(client, name, factories[name], iterations, warmup,
+                              HEADERS.get(name))
+  return results, skipped
+
+# Endpoints with an async implementation, see ``ASYNC_READ_VIEWS``.
+READ_ENDPOINTS = ('view_club_info', 'view_clubs_in', 'view_activities', 'view_plans',
+                  'my_info', 'signed_in')
+
+def reload_urls():
+  for module in ('club.urls', 'huddl.urls', settings.ROOT_URLCONF):
+    importlib.reload(importlib.import_module(module))
+  clear_url_caches()
+
+@contextmanager
+def read_views(async_reads):
+  """Route the read endpoints to their sync or async views for the duration."""
+  with override_settings(ASYNC_READ_VIEWS=async_reads):
+    reload_urls()
+    yield
+  reload_urls()
+
+def split(payloads, concurrency):
+  return [payloads[i::concurrency] for i in range(concurrency) if payloads[i::concurrency]]
+
+def wsgi_throughput(path, payloads, concurrency):
+  """Serve ``payloads`` through the WSGI handler from ``concurrency`` threads."""
+  statuses = {}
+  def worker(chunk):
+    client = Client(raise_request_exception=False)
+    try:
+      return [client.post(path, data=payload, content_type='application/json').status_code
+              for payload in chunk]
+    finally:
+      connection.close()
+  start = time.perf_counter()
+  with ThreadPoolExecutor(concurrency) as pool:
+    codes = [code for chunk in pool.map(worker, split(payloads, concurrency)) for code in chunk]
+  elapsed = time.perf_counter() - start
+  for code in codes:
+    statuses[str(code)] = statuses.get(str(code), 0) + 1
+  return {'requests_per_second': len(payloads) / elapsed, 'statuses': statuses}
+
+def asgi_throughput(path, payloads, concurrency):
+  """Serve ``payloads`` through the ASGI handler as ``concurrency`` concurrent clients."""
+  client = AsyncClient(raise_request_exception=False)
+  async def worker(chunk):
+    return [(await client.post(path, data=payload, content_type='application/json')).status_code
+            for payload in chunk]
+  async def main():
+    return await asyncio.gather(*(worker(chunk) for chunk in split(payloads, concurrency)))
+  statuses = {}
+  start = time.perf_counter()
+  codes = [code for chunk in asyncio.run(main()) for code in chunk]
+  elapsed = time.perf_counter() - start
+  for code in codes:
+    statuses[str(code)] = statuses.get(str(code), 0) + 1
+  return {'requests_per_second': len(payloads) / elapsed, 'statuses': statuses}
+
+def throughput(data, concurrency=50, requests=500, only=None):
+  """Compare sync views under WSGI with async views under ASGI on the read endpoints."""
+  factories = scenarios(data)
+  results = {}
+  for name in READ_ENDPOINTS:
+    if only and name not in only:
+      continue
+    path = reverse(name)
+    payloads = [json.dumps(factories[name]()) for _ in range(requests)]
+    results[name] = {}
+    with read_views(False):
+      wsgi_throughput(path, payloads[:concurrency], concurrency)
+      results[name]['sync_wsgi'] = wsgi_throughput(path, payloads, concurrency)
+    with read_views(True):
+      asgi_throughput(path, payloads[:concurrency], concurrency)
+      results[name]['async_asgi'] = asgi_throughput(path, payloads, concurrency)
+  return results
+
+def compare(results, baseline, threshold):
+  """Regressions of ``results`` against a previous run's ``endpoints``.
+
+  Latency regresses when the p50 grows by more than ``threshold`` times;
+  query counts are deterministic, so any increase of the maximum counts. Any
+  non-2xx response counts too, baseline or not: its timings are of an error
+  path, not of the endpoint.
+  """
+  regressions = []
+  for name, result in results.items():
+    failed = {code: count for code, count in result['statuses'].items() if not code.startswith('2')}
+    if failed:
+      regressions.append(f"{name}: non-2xx statuses {failed}")
+    before = baseline.get(name)
+    if before is None:
+      continue
+    if result['latency_ms']['p50'] > before['latency_ms']['p50'] * threshold:
+      regressions.append(f"{name}: p50 {result['latency_ms']['p50']:.2f} ms, "
+                         f"baseline {before['latency_ms']['p50']:.2f} ms")
+    if result['queries']['max'] > before['queries']['max']:
+      regressions.append(f"{name}: {result['queries']['max']} queries, "
+                         f"baseline {before['queries']['max']}")
+  return regressions
@@ -0,0 +1,168 @@
+import random
+import threading
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.urls import Resolver404, resolve
+from huddl.models import User
+
+DEFAULTS = {
+  'ALIASES': [],
+  'STICKY_SECONDS': 10,
+  'CACHE_ALIAS': None,
+}
+
+def get_setting(name):
+  return getattr(settings, 'READ_REPLICAS', {}).get(name, DEFAULTS[name])
+
+class LocalStickyStore:
+  """In-process record of the users that wrote recently."""
+  def __init__(self):
+    self.deadlines = {}
+    self.lock = threading.Lock()
+
+  def mark(self, user_id, seconds):
+    with self.lock:
+      self.deadlines[user_id] = time.monotonic() + seconds
+      if len(self.deadlines) > 10000:
+        now = time.monotonic()
+        self.deadlines = {key: deadline for key, deadline in self.deadlines.items()
+                          if deadline > now}
+
+  def is_sticky(self, user_id):
+    with self.lock:
+      deadline = self.deadlines.get(user_id)
+    return deadline is not None and deadline > time.monotonic()
+
+class CacheStickyStore:
+  """Sticky users kept in a Django cache, so every worker process sees them."""
+  def __init__(self, alias):
+    self.cache = caches[alias]
+
+  def mark(self, user_id, seconds):
+    self.cache.set(f'huddl-db-sticky:{user_id}', True, seconds)
+
+  def is_sticky(self, user_id):
+    return self.cache.get(f'huddl-db-sticky:{user_id}', False)
+
+_sticky_store = None
+_sticky_lock = threading.Lock()
+
+def get_sticky_store():
+  global _sticky_store
+  with _sticky_lock:
+    if _sticky_store is None:
+      alias = get_setting('CACHE_ALIAS')
+      _sticky_store = CacheStickyStore(alias) if alias else LocalStickyStore()
+    return _sticky_store
+
+class Route:
+  """Routing state of one request, shared with the threads its queries run in."""
+  def __init__(self, request, read_only):
+    self.request = request
+    self.read_only = read_only
+    self.wrote = False
+    self.replica = None
+
+  def user_id(self):
+    # Only a user set by update_request_user counts: evaluating the lazy
+    # user from AuthenticationMiddleware would itself run queries.
+    user = self.request.__dict__.get('user')
+    return user.id if type(user) is User else None
+
+  def read_alias(self):
+    """A replica for this request's reads, or None to read from the primary.
+
+    Replicas are only used by read-only views once the caller is known, so
+    authentication always sees the primary, and never right after the
+    caller's own writes.
+    """
+    if self.replica is None:
+      aliases = get_setting('ALIASES')
+      if not self.read_only or self.wrote or not aliases:
+        return None
+      user_id = self.user_id()
+      if user_id is None:
+        return None
+      if get_sticky_store().is_sticky(user_id):
+        self.read_only = False
+        return None
+      self.replica = random.choice(aliases)
+    return self.replica
+
+current_route = ContextVar('current_route', default=None)
+
+class ReplicaRouter:
+  """Send the reads of read-only views to ``READ_REPLICAS['ALIASES']``.
+
+  Views opt in with ``read_only = True``. Everything else, including all
+  writes and migrations, uses the default database.
+  """
+  def db_for_read(self, model, **hints):
+    route = current_route.get()
+    if route is None:
+      return None
+    return route.read_alias()
+
+  def db_for_write(self, model, **hints):
+    route = current_route.get()
+    if route is not None:
+      route.wrote = True
+    return 'default'
+
+  def allow_relation(self, obj1, obj2, **hints):
+    return True
+
+  def allow_migrate(self, db, app_label, model_name=None, **hints):
+    return db not in get_setting('ALIASES')
+
+def is_read_only(request):
+  try:
+    match = resolve(request.path_info)
+  except Resolver404:
+    return False
+  return getattr(getattr(match.func, 'view_class', None), 'read_only', False)
+
+class ReplicaRoutingMiddleware:
+  """Classify each request for ``ReplicaRouter`` and make writers sticky.
+
+  After a request that wrote, the caller reads from the primary for
+  ``READ_REPLICAS['STICKY_SECONDS']`` so it sees its own changes despite
+  replication lag.
+  """
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    self.is_async = iscoroutinefunction(get_response)
+    if self.is_async:
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if self.is_async:
+      return self.__acall__(request)
+    route = Route(request, is_read_only(request))
+    token = current_route.set(route)
+    try:
+      return self.get_response(request)
+    finally:
+      current_route.reset(token)
+      self.finish(route)
+
+  async def __acall__(self, request):
+    route = Route(request, is_read_only(request))
+    token = current_route.set(route)
+    try:
+      return await self.get_response(request)
+    finally:
+      current_route.reset(token)
+      self.finish(route)
+
+  def finish(self, route):
+    if route.wrote and get_setting('ALIASES'):
+      user_id = route.user_id()
+      if user_id is not None:
+        get_sticky_store().mark(user_id, get_setting('STICKY_SECONDS'))
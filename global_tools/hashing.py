@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .metrics import get_metrics
+
+DEFAULTS = {
+  'WORKERS': 2,
+  'MAX_CONCURRENT': 4,
+  'MAX_QUEUE': 16,
+  'QUEUE_TIMEOUT': 1.0,
+  'RETRY_AFTER': 2,
+}
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def get_setting(name):
+  return getattr(settings, 'PASSWORD_HASHING', {}).get(name, DEFAULTS[name])
+
+class HashingUnavailable(APIException):
+  status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+  default_detail = 'Too many sign-ins right now, try again shortly.'
+  default_code = 'hashing_unavailable'
+
+  def __init__(self, wait):
+    super().__init__()
+    self.wait = wait
+
+def setup_worker(settings_module):
+  if settings_module:
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+  import django
+  django.setup()
+
+def verify(password, encoded):
+  """``(valid, upgraded)``: upgraded is a fresh hash when the stored one is outdated."""
+  if not check_password(password, encoded):
+    return False, None
+  try:
+    outdated = identify_hasher(encoded).must_update(encoded)
+  except ValueError:
+    outdated = False
+  return True, make_password(password) if outdated else None
+
+class HashPool:
+  """Runs password hashing in worker processes, at most ``max_concurrent`` at a time.
+
+  Callers beyond that wait up to ``queue_timeout`` seconds for a slot, and at
+  most ``max_queue`` of them wait at once; everyone else gets a 503.
+  """
+  def __init__(self, workers, max_concurrent, max_queue, queue_timeout, retry_after):
+    self.workers = workers
+    self.queue_timeout = queue_timeout
+    self.max_queue = max_queue
+    self.retry_after = retry_after
+    self.max_concurrent = max_concurrent
+    self.slots = threading.BoundedSemaphore(max_concurrent)
+    self.lock = threading.Lock()
+    self.depth = 0
+    self.executor = None
+    self.pid = None
+
+  def get_executor(self):
+    with self.lock:
+      if self.executor is None or self.pid != os.getpid():
+        self.executor = ProcessPoolExecutor(
+          max_workers=self.workers, initializer=setup_worker,
+          initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),))
+        self.pid = os.getpid()
+      return self.executor
+
+  def reset(self):
+    with self.lock:
+      executor, self.executor = self.executor, None
+    if executor is not None:
+      executor.shutdown(wait=False, cancel_futures=True)
+
+  def enter(self):
+    metrics = get_metrics()
+    with self.lock:
+      if self.depth >= self.max_concurrent + self.max_queue:
+        metrics.inc('huddl_password_hash_rejected_total', ())
+        raise HashingUnavailable(self.retry_after)
+      self.depth += 1
+      metrics.set_gauge('huddl_password_hash_queue_depth', (), self.depth)
+    start = time.perf_counter()
+    acquired = self.slots.acquire(timeout=self.queue_timeout)
+    metrics.observe('huddl_password_hash_wait_seconds', (), time.perf_counter() - start,
+                    WAIT_BUCKETS)
+    if not acquired:
+      self.leave(release=False)
+      metrics.inc('huddl_password_hash_rejected_total', ())
+      raise HashingUnavailable(self.retry_after)
+
+  def leave(self, release=True):
+    if release:
+      self.slots.release()
+    with self.lock:
+      self.depth -= 1
+      get_metrics().set_gauge('huddl_password_hash_queue_depth', (), self.depth)
+
+  def run(self, fn, *args):
+    self.enter()
+    try:
+      if not self.workers:
+        return fn(*args)
+      try:
+        return self.get_executor().submit(fn, *args).result()
+      except BrokenProcessPool as exc:
+        self.reset()
+        raise HashingUnavailable(self.retry_after) from exc
+    finally:
+      self.leave()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_hash_pool():
+  global _pool
+  if _pool is None:
+    with _pool_lock:
+      if _pool is None:
+        _pool = HashPool(get_setting('WORKERS'), get_setting('MAX_CONCURRENT'),
+                         get_setting('MAX_QUEUE'), get_setting('QUEUE_TIMEOUT'),
+                         get_setting('RETRY_AFTER'))
+  return _pool
+
+def hash_password(password):
+  """``make_password`` in the hashing pool; raises ``HashingUnavailable`` when saturated."""
+  return get_hash_pool().run(make_password, password)
+
+def verify_password(user, password):
+  """``user.check_password`` in the hashing pool, saving an upgraded hash if needed."""
+  if password is None or not user.has_usable_password():
+    return False
+  valid, upgraded = get_hash_pool().run(verify, password, user.password)
+  if upgraded:
+    user.password = upgraded
+    user.save(update_fields=['password'])
+  return valid
@@ -0,0 +1,82 @@
+import json
+import platform
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from global_tools.benchmark import Dataset, compare, run, throughput
+
+class Command(BaseCommand):
+  help = ("Seed a throwaway test database with a deterministic data set and record latency "
+          "percentiles and SQL query counts for every API endpoint.")
+
+  def add_arguments(self, parser):
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiplier for the size of the seeded data set.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--endpoint', action='append', dest='endpoints',
+                        help='Only run this URL name; may be repeated.')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against.')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='Allowed p50 latency growth over the baseline, as a ratio.')
+    parser.add_argument('--throughput', action='store_true',
+                        help='Also compare sync WSGI and async ASGI throughput on the read endpoints.')
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help='Concurrent clients for the throughput comparison.')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='Requests per endpoint and mode for the throughput comparison.')
+
+  def handle(self, *args, **options):
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+      data = Dataset(scale=options['scale'], seed=options['seed'])
+      data.seed_database()
+      results, skipped = run(data, iterations=options['iterations'], warmup=options['warmup'],
+                             only=options['endpoints'])
+      rates = {}
+      if options['throughput']:
+        rates = throughput(data, concurrency=options['concurrency'], requests=options['requests'],
+                           only=options['endpoints'])
+    finally:
+      connection.creation.destroy_test_db(old_name, verbosity=0)
+      teardown_test_environment()
+
+    report = {
+      'meta': {
+        'scale': options['scale'],
+        'seed': options['seed'],
+        'iterations': options['iterations'],
+        'sizes': data.sizes,
+        'django': django.get_version(),
+        'python': platform.python_version(),
+      },
+      'endpoints': results,
+    }
+    if rates:
+      report['meta']['concurrency'] = options['concurrency']
+      report['throughput'] = rates
+    for name, result in results.items():
+      latency = result['latency_ms']
+      self.stdout.write(f"{name:24} p50 {latency['p50']:8.2f} ms  p99 {latency['p99']:8.2f} ms  "
+                        f"queries {result['queries']['max']:4}  statuses {result['statuses']}")
+    for name, modes in rates.items():
+      self.stdout.write(f"{name:24} " + "  ".join(
+        f"{mode} {rate['requests_per_second']:8.1f} req/s {rate['statuses']}"
+        for mode, rate in modes.items()))
+    for name in skipped:
+      self.stdout.write(self.style.WARNING(f'{name}: no benchmark scenario, skipped'))
+    if options['output']:
+      with open(options['output'], 'w') as output:
+        json.dump(report, output, indent=2)
+
+    if options['baseline']:
+      with open(options['baseline']) as baseline_file:
+        baseline = json.load(baseline_file)
+      regressions = compare(results, baseline['endpoints'], options['threshold'])
+      if regressions:
+        raise CommandError('performance regressions:\n' + '\n'.join(regressions))
+      self.stdout.write(self.style.SUCCESS('no regressions against the baseline'))
@@ -0,0 +1,26 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+from club.models import ClubEvent
+from club.versioning import get_setting, trim_events
+
+class Command(BaseCommand):
+  help = ("Delete club events older than CLUB_EVENTS['MAX_AGE'] seconds and all but the "
+          "CLUB_EVENTS['KEEP'] most recent events of each club. Run it periodically, e.g. from cron.")
+
+  def add_arguments(self, parser):
+    parser.add_argument('--max-age', type=int, help="Override CLUB_EVENTS['MAX_AGE'].")
+
+  def handle(self, *args, **options):
+    max_age = options['max_age'] if options['max_age'] is not None else get_setting('MAX_AGE')
+    expired = ClubEvent.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=max_age))
+    deleted = expired.delete()[0]
+
+    # Writes trim their club every TRIM_EVERY events; this catches the rest.
+    keep = get_setting('KEEP')
+    latest = (ClubEvent.objects.values('club_id').annotate(latest=Max('seq'))
+              .filter(latest__gt=keep))
+    for row in latest.iterator():
+      deleted += trim_events(row['club_id'], row['latest'])
+    self.stderr.write(f'deleted {deleted} club events')
@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+from global_tools.hashing import setup_worker
+from global_tools.row_import import FORMATS, batches, format_for, read_rows
+from huddl.models import User
+from huddl.registration import build_user, duplicate_errors, insert_user
+from huddl.views import BasicRegistrationSerializer
+
+class ImportUserSerializer(BasicRegistrationSerializer):
+  """Registration rules, but rows may carry an already hashed ``password_hash``."""
+  password = serializers.CharField(required=False)
+  password_hash = serializers.CharField(required=False)
+
+  def validate_password_hash(self, value):
+    try:
+      identify_hasher(value)
+    except ValueError as exc:
+      raise serializers.ValidationError("Unknown password hash format") from exc
+    return value
+
+  def validate(self, data):
+    if ('password' in data) == ('password_hash' in data):
+      raise serializers.ValidationError("Give exactly one of password and password_hash")
+    return super().validate(data)
+
+class Command(BaseCommand):
+  help = ("Create users from a CSV or NDJSON file with username, email, full_name and "
+          "password (or password_hash) columns, writing one report line per input row.")
+
+  def add_arguments(self, parser):
+    parser.add_argument('path', help="Input file, or '-' for stdin.")
+    parser.add_argument('--format', choices=FORMATS,
+                        help='Input format; defaults to the file extension.')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Processes hashing passwords in parallel.')
+    parser.add_argument('--report', help='Write the per-row report here instead of stdout.')
+
+  def handle(self, *args, **options):
+    fmt = options['format']
+    if fmt is None:
+      fmt = format_for(options['path'])
+      if fmt is None:
+        raise CommandError('cannot tell the input format, pass --format')
+    if options['batch_size'] < 1:
+      raise CommandError('--batch-size must be positive')
+
+    counts = {'created': 0, 'failed': 0}
+    with ExitStack() as stack:
+      stream = (sys.stdin if options['path'] == '-'
+                else stack.enter_context(open(options['path'], newline='')))
+      report = (stack.enter_context(open(options['report'], 'w')) if options['report']
+                else self.stdout)
+      pool = stack.enter_context(ProcessPoolExecutor(
+        max_workers=max(1, options['workers']), initializer=setup_worker,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),)))
+      for batch in batches(read_rows(stream, fmt), options['batch_size']):
+        for line_number, row, errors in self.import_batch(batch, pool):
+          result = {'line': line_number, 'username': (row or {}).get('username')}
+          if errors:
+            result.update(status='error', errors=errors)
+            counts['failed'] += 1
+          else:
+            result['status'] = 'created'
+            counts['created'] += 1
+          report.write(json.dumps(result) + '\n')
+    self.stderr.write(f"created {counts['created']} users, {counts['failed']} rows failed")
+
+  def import_batch(self, batch, pool):
+    """Validate, hash and insert one batch; yields ``(line_number, row, errors)``."""
+    results = {}
+    pending = []
+    seen = set()
+    for line_number, row in batch:
+      if row is None:
+        results[line_number] = (row, {'non_field_errors': ['Row is not a JSON object']})
+        continue
+      serializer = ImportUserSerializer(data=row)
+      if not serializer.is_valid():
+        results[line_number] = (row, serializer.errors)
+        continue
+      data = serializer.validated_data
+      user = build_user(data['username'], data['email'], data['full_name'], None,
+                        data.get('default_budget_limit'), data.get('default_max_time'))
+      clashes = {}
+      if ('username', user.username) in seen:
+        clashes['username'] = ['Username appears earlier in the file']
+      if ('email', user.email) in seen:
+        clashes['email'] = ['Email appears earlier in the file']
+      if clashes:
+        results[line_number] = (row, clashes)
+        continue
+      seen.update((('username', user.username), ('email', user.email)))
+      pending.append((line_number, row, data, user))
+
+    taken = duplicate_errors([user for _, _, _, user in pending])
+    for index, (line_number, row, _, _) in enumerate(pending):
+      if index in taken:
+        results[line_number] = (row, taken[index])
+    pending = [entry for index, entry in enumerate(pending) if index not in taken]
+
+    to_hash = [data['password'] for _, _, data, _ in pending if 'password' in data]
+    hashes = iter(pool.map(make_password, to_hash, chunksize=max(1, len(to_hash) // 32)))
+    for _, _, data, user in pending:
+      user.password = data['password_hash'] if 'password_hash' in data else next(hashes)
+
+    users = [user for _, _, _, user in pending]
+    try:
+      with transaction.atomic():
+        User.objects.bulk_create(users)
+    except IntegrityError:
+      # Someone registered one of these names since the check above; fall back
+      # to row-by-row inserts to find out which.
+      for line_number, row, _, user in pending:
+        results[line_number] = (row, insert_user(user))
+    else:
+      for line_number, row, _, _ in pending:
+        results[line_number] = (row, None)
+
+    for line_number, _ in batch:
+      row, errors = results[line_number]
+      yield line_number, row, errors
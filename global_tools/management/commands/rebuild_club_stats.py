@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from club.models import Club
+from club.stats import rebuild_stats
+
+class Command(BaseCommand):
+  help = ("Recompute the ClubStats summaries from the clubs' rows, e.g. after changes "
+          "made outside the API or to fill them in for existing clubs.")
+
+  def add_arguments(self, parser):
+    parser.add_argument('club_ids', nargs='*', type=int,
+                        help='Clubs to rebuild; all of them when none are given.')
+
+  def handle(self, *args, **options):
+    club_ids = options['club_ids'] or list(Club.objects.order_by('id').values_list('id', flat=True))
+    rebuilt = 0
+    for club_id in club_ids:
+      if rebuild_stats(club_id) is not None:
+        rebuilt += 1
+    self.stderr.write(f'rebuilt stats for {rebuilt} clubs')
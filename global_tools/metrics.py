@@ -0,0 +1,287 @@
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+DEFAULTS = {
+  'PATH': None,
+  'FLUSH_INTERVAL': 1.0,
+  'TOKEN': None,
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# name -> (type, help)
+FAMILIES = {
+  'huddl_http_requests_total': ('counter', 'Requests served, by URL name, method and status.'),
+  'huddl_http_request_duration_seconds': ('histogram', 'Request latency by URL name.'),
+  'huddl_db_queries_per_request': ('histogram', 'SQL queries issued per request by URL name.'),
+  'huddl_db_queries_total': ('counter', 'SQL queries issued by URL name.'),
+  'huddl_db_query_seconds_total': ('counter', 'Time spent in SQL queries by URL name.'),
+  'huddl_password_hash_queue_depth': ('gauge', 'Password hash operations waiting or running, by process.'),
+  'huddl_password_hash_wait_seconds': ('histogram', 'Time password hash operations waited for a pool slot.'),
+  'huddl_password_hash_rejected_total': ('counter', 'Password hash operations turned away with a 503.'),
+  'huddl_push_subscribers': ('gauge', 'Open club update streams, by process.'),
+  'huddl_push_overflows_total': ('counter', 'Club update streams closed for falling behind.'),
+  'huddl_write_batch_size': ('histogram', 'Write jobs committed together by the write queue.'),
+  'huddl_write_queue_wait_seconds': ('histogram', 'Time write jobs waited for the writer thread.'),
+}
+
+def get_setting(name):
+  return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+def escape_label(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+  return ','.join(f'{key}="{escape_label(value)}"' for key, value in labels)
+
+def format_bound(bound):
+  return '+Inf' if bound == float('inf') else repr(float(bound))
+
+class MemoryStore:
+  def __init__(self):
+    self.samples = defaultdict(float)
+    self.lock = threading.Lock()
+
+  def add(self, deltas):
+    with self.lock:
+      for key, value in deltas.items():
+        self.samples[key] += value
+
+  def put(self, values):
+    with self.lock:
+      self.samples.update(values)
+
+  def read(self):
+    with self.lock:
+      return dict(self.samples)
+
+class SQLiteStore:
+  """Samples summed across every worker process that shares ``path``."""
+  def __init__(self, path):
+    self.path = str(path)
+    self.local = threading.local()
+
+  def connection(self):
+    conn = getattr(self.local, 'conn', None)
+    if conn is None or self.local.pid != os.getpid():
+      conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+      conn.execute('PRAGMA journal_mode=WAL')
+      conn.execute('CREATE TABLE IF NOT EXISTS samples (name TEXT NOT NULL, labels TEXT NOT NULL, '
+                   'value REAL NOT NULL, PRIMARY KEY (name, labels))')
+      self.local.conn = conn
+      self.local.pid = os.getpid()
+    return conn
+
+  def add(self, deltas):
+    conn = self.connection()
+    with conn:
+      conn.executemany('INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) '
+                       'ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value',
+                       [(name, labels, value) for (name, labels), value in deltas.items()])
+
+  def put(self, values):
+    conn = self.connection()
+    with conn:
+      conn.executemany('INSERT OR REPLACE INTO samples (name, labels, value) VALUES (?, ?, ?)',
+                       [(name, labels, value) for (name, labels), value in values.items()])
+
+  def read(self):
+    rows = self.connection().execute('SELECT name, labels, value FROM samples')
+    return {(name, labels): value for name, labels, value in rows}
+
+class Metrics:
+  """Per-process metric buffer flushed into a shared store every ``flush_interval`` seconds."""
+  def __init__(self, store, flush_interval):
+    self.store = store
+    self.flush_interval = flush_interval
+    self.pending = defaultdict(float)
+    self.gauges = {}
+    self.lock = threading.Lock()
+    self.last_flush = time.monotonic()
+
+  def inc(self, name, labels, amount=1):
+    with self.lock:
+      self.pending[(name, format_labels(labels))] += amount
+
+  def set_gauge(self, name, labels, value):
+    """Set a per-process gauge; the exposition lists one series per ``pid``."""
+    with self.lock:
+      self.gauges[(name, format_labels((*labels, ('pid', os.getpid()))))] = value
+
+  def observe(self, family, labels, value, buckets):
+    with self.lock:
+      for bound in (*buckets, float('inf')):
+        key = (f'{family}_bucket', format_labels((*labels, ('le', format_bound(bound)))))
+        self.pending[key] += value <= bound
+      self.pending[(f'{family}_sum', format_labels(labels))] += value
+      self.pending[(f'{family}_count', format_labels(labels))] += 1
+
+  def maybe_flush(self):
+    if time.monotonic() - self.last_flush >= self.flush_interval:
+      self.flush()
+
+  def flush(self):
+    with self.lock:
+      deltas = self.pending
+      gauges = self.gauges
+      self.pending = defaultdict(float)
+      self.gauges = {}
+      self.last_flush = time.monotonic()
+    if deltas:
+      self.store.add(deltas)
+    if gauges:
+      self.store.put(gauges)
+
+  def exposition(self):
+    """Render every stored sample in the Prometheus text format."""
+    self.flush()
+    by_family = defaultdict(list)
+    for (name, labels), value in self.store.read().items():
+      family = name
+      for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+          family = name[:-len(suffix)]
+      by_family[family].append((name, labels, value))
+    lines = []
+    for family in sorted(by_family):
+      kind, description = FAMILIES.get(family, ('untyped', ''))
+      lines.append(f'# HELP {family} {description}')
+      lines.append(f'# TYPE {family} {kind}')
+      for name, labels, value in sorted(by_family[family], key=sample_order):
+        value = int(value) if value == int(value) else value
+        lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+def sample_order(sample):
+  """Group a histogram's samples by series: buckets by bound, then sum and count."""
+  name, labels, _ = sample
+  bound = 0.0
+  if 'le="' in labels:
+    labels, le = labels.rsplit('le="', 1)
+    labels = labels.rstrip(',')
+    bound = float(le.rstrip('"'))
+  return (labels, name.endswith('_sum') + 2 * name.endswith('_count'), bound)
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+  global _metrics
+  if _metrics is None:
+    with _metrics_lock:
+      if _metrics is None:
+        path = get_setting('PATH')
+        store = SQLiteStore(path) if path else MemoryStore()
+        _metrics = Metrics(store, get_setting('FLUSH_INTERVAL'))
+  return _metrics
+
+class QueryRecorder:
+  def __init__(self):
+    self.count = 0
+    self.seconds = 0.0
+
+  def __call__(self, execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+      return execute(sql, params, many, context)
+    finally:
+      self.seconds += time.perf_counter() - start
+      self.count += 1
+
+# The recorder of the request being served. Context variables follow the
+# request into the threads sync_to_async runs ORM calls in, which a
+# per-connection ``execute_wrapper`` block would not.
+current_recorder = ContextVar('current_recorder', default=None)
+
+def record_query(execute, sql, params, many, context):
+  recorder = current_recorder.get()
+  if recorder is None:
+    return execute(sql, params, many, context)
+  return recorder(execute, sql, params, many, context)
+
+def install_wrapper(connection):
+  if record_query not in connection.execute_wrappers:
+    connection.execute_wrappers.append(record_query)
+
+def on_connection_created(connection, **_kwargs):
+  install_wrapper(connection)
+
+connection_created.connect(on_connection_created, dispatch_uid='global_tools.metrics')
+
+class MetricsMiddleware:
+  """Record latency, SQL query count and SQL time for every request by URL name."""
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    self.is_async = iscoroutinefunction(get_response)
+    if self.is_async:
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if self.is_async:
+      return self.__acall__(request)
+    for connection in connections.all(initialized_only=True):
+      install_wrapper(connection)
+    recorder = QueryRecorder()
+    token = current_recorder.set(recorder)
+    start = time.perf_counter()
+    try:
+      response = self.get_response(request)
+    finally:
+      current_recorder.reset(token)
+    self.record(request, response, time.perf_counter() - start, recorder)
+    return response
+
+  async def __acall__(self, request):
+    recorder = QueryRecorder()
+    token = current_recorder.set(recorder)
+    start = time.perf_counter()
+    try:
+      response = await self.get_response(request)
+    finally:
+      current_recorder.reset(token)
+    self.record(request, response, time.perf_counter() - start, recorder)
+    return response
+
+  def record(self, request, response, elapsed, recorder):
+    match = getattr(request, 'resolver_match', None)
+    endpoint = (('endpoint', match.url_name if match and match.url_name else 'unmatched'),)
+    metrics = get_metrics()
+    metrics.inc('huddl_http_requests_total',
+                (*endpoint, ('method', request.method), ('status', response.status_code)))
+    metrics.observe('huddl_http_request_duration_seconds', endpoint, elapsed, LATENCY_BUCKETS)
+    metrics.observe('huddl_db_queries_per_request', endpoint, recorder.count, QUERY_COUNT_BUCKETS)
+    metrics.inc('huddl_db_queries_total', endpoint, recorder.count)
+    metrics.inc('huddl_db_query_seconds_total', endpoint, recorder.seconds)
+    metrics.maybe_flush()
+
+def may_scrape(request):
+  """Staff users signed in to the admin, or a scraper sending ``METRICS['TOKEN']``
+  as ``Authorization: Bearer <token>``."""
+  user = getattr(request, 'user', None)
+  if user is not None and user.is_authenticated and user.is_staff:
+    return True
+  token = get_setting('TOKEN')
+  if not token:
+    return False
+  scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+  return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode())
+
+def metrics_view(request):
+  if not may_scrape(request):
+    return HttpResponse('forbidden\n', status=403, content_type='text/plain; charset=utf-8')
+  return HttpResponse(get_metrics().exposition(),
+                      content_type='text/plain; version=0.0.4; charset=utf-8')
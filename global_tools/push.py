@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import threading
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .metrics import get_metrics
+
+DEFAULTS = {
+  'ENABLED': False,
+  'BACKEND': 'local',
+  'REDIS_URL': 'redis://localhost:6379/0',
+  'QUEUE_SIZE': 100,
+  'HEARTBEAT': 15.0,
+}
+REDIS_PREFIX = 'huddl:push:'
+
+logger = logging.getLogger(__name__)
+
+def get_setting(name):
+  return getattr(settings, 'PUSH', {}).get(name, DEFAULTS[name])
+
+def push_enabled():
+  return get_setting('ENABLED')
+
+class Subscription:
+  """Messages published to one channel, queued for one consumer on its event loop.
+
+  A consumer that falls ``size`` messages behind is cut off: it gets no more
+  messages and ``get`` returns None once it has drained the queue.
+  """
+  def __init__(self, broker, channel, size):
+    self.broker = broker
+    self.channel = channel
+    self.size = size
+    self.loop = asyncio.get_running_loop()
+    self.queue = asyncio.Queue()
+    self.closed = False
+    self.overflowed = False
+
+  def offer(self, message):
+    """Queue ``message``; runs on the subscription's loop."""
+    if self.closed:
+      return
+    if self.queue.qsize() >= self.size:
+      self.overflowed = True
+      get_metrics().inc('huddl_push_overflows_total', ())
+      self.close()
+      return
+    self.queue.put_nowait(message)
+
+  def close(self):
+    if not self.closed:
+      self.closed = True
+      self.broker.unsubscribe(self)
+      self.queue.put_nowait(None)
+
+  async def get(self, timeout):
+    """The next message, None when closed, or raises ``asyncio.TimeoutError`` after ``timeout``."""
+    return await asyncio.wait_for(self.queue.get(), timeout)
+
+class LocalBroker:
+  """Fans messages out to the subscriptions of this process.
+
+  ``publish`` may be called from any thread; delivery happens on each
+  subscriber's event loop.
+  """
+  def __init__(self):
+    self.channels = {}
+    self.lock = threading.Lock()
+
+  def subscribe(self, channel):
+    subscription = Subscription(self, channel, get_setting('QUEUE_SIZE'))
+    with self.lock:
+      self.channels.setdefault(channel, set()).add(subscription)
+      count = sum(len(subscriptions) for subscriptions in self.channels.values())
+    get_metrics().set_gauge('huddl_push_subscribers', (), count)
+    return subscription
+
+  def unsubscribe(self, subscription):
+    with self.lock:
+      subscriptions = self.channels.get(subscription.channel, set())
+      subscriptions.discard(subscription)
+      if not subscriptions:
+        self.channels.pop(subscription.channel, None)
+      count = sum(len(subscriptions) for subscriptions in self.channels.values())
+    get_metrics().set_gauge('huddl_push_subscribers', (), count)
+
+  def publish(self, channel, message):
+    self.deliver(channel, message)
+
+  def deliver(self, channel, message):
+    with self.lock:
+      subscriptions = list(self.channels.get(channel, ()))
+    for subscription in subscriptions:
+      try:
+        subscription.loop.call_soon_threadsafe(subscription.offer, message)
+      except RuntimeError:
+        # The subscriber's loop has shut down.
+        self.unsubscribe(subscription)
+
+  def close_all(self):
+    with self.lock:
+      subscriptions = [sub for subs in self.channels.values() for sub in subs]
+    for subscription in subscriptions:
+      subscription.loop.call_soon_threadsafe(subscription.close)
+
+class RedisBroker(LocalBroker):
+  """Publishes through a Redis-compatible server so every process sees every message.
+
+  Each process keeps one pattern subscription open, started by its first
+  subscriber, and hands what arrives to its local subscriptions. Needs the
+  optional redis package (``poetry install -E redis``).
+  """
+  def __init__(self, url):
+    super().__init__()
+    self.url = url
+    self.client = self.connect()
+    self.listener = None
+
+  def connect(self):
+    try:
+      import redis
+    except ImportError as exc:
+      raise ImproperlyConfigured("PUSH['BACKEND'] = 'redis' requires the redis package") from exc
+    return redis.Redis.from_url(self.url)
+
+  def aconnect(self):
+    from redis import asyncio as aioredis
+    return aioredis.Redis.from_url(self.url)
+
+  def subscribe(self, channel):
+    subscription = super().subscribe(channel)
+    if self.listener is None or self.listener.done():
+      self.listener = asyncio.get_running_loop().create_task(self.listen())
+    return subscription
+
+  def publish(self, channel, message):
+    try:
+      self.client.publish(REDIS_PREFIX + channel, json.dumps(message))
+    except Exception:
+      # Subscribers catch up from the event log when they reconnect.
+      logger.exception('could not publish to %s', channel)
+
+  async def listen(self):
+    client = self.aconnect()
+    try:
+      async with client.pubsub() as pubsub:
+        await pubsub.psubscribe(REDIS_PREFIX + '*')
+        async for item in pubsub.listen():
+          if item['type'] == 'pmessage':
+            channel = item['channel'].decode().removeprefix(REDIS_PREFIX)
+            self.deliver(channel, json.loads(item['data']))
+    except Exception:
+      logger.exception('lost the push subscription')
+    finally:
+      await client.aclose()
+      # Streams would silently miss messages from here on, so end them; the
+      # clients reconnect and replay what they missed.
+      self.close_all()
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+  global _broker
+  with _broker_lock:
+    if _broker is None:
+      if get_setting('BACKEND') == 'redis':
+        _broker = RedisBroker(get_setting('REDIS_URL'))
+      else:
+        _broker = LocalBroker()
+    return _broker
+
+def publish(channel, message):
+  """Send a JSON-serializable ``message`` to everyone subscribed to ``channel``."""
+  if push_enabled():
+    get_broker().publish(channel, message)
+
+def sse_message(data, event=None, id=None):
+  """One server-sent event; ``data`` must already be serialized to a string."""
+  lines = []
+  if id is not None:
+    lines.append(f'id: {id}')
+  if event is not None:
+    lines.append(f'event: {event}')
+  lines.extend(f'data: {line}' for line in data.split('\n'))
+  return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,38 @@
+import csv
+import json
+
+FORMATS = ('csv', 'ndjson')
+
+def format_for(name):
+  """``'csv'`` or ``'ndjson'`` from a file name's extension, else None."""
+  if name.endswith('.csv'):
+    return 'csv'
+  if name.endswith(('.ndjson', '.jsonl')):
+    return 'ndjson'
+  return None
+
+def read_rows(stream, fmt):
+  """Yield ``(line_number, row)``; rows that are not valid JSON objects come back as None."""
+  if fmt == 'csv':
+    reader = csv.DictReader(stream)
+    for row in reader:
+      yield reader.line_num, {key: value for key, value in row.items() if value not in (None, '')}
+    return
+  for line_number, line in enumerate(stream, start=1):
+    if not line.strip():
+      continue
+    try:
+      row = json.loads(line)
+    except ValueError:
+      row = None
+    yield line_number, row if isinstance(row, dict) else None
+
+def batches(iterable, size):
+  batch = []
+  for item in iterable:
+    batch.append(item)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
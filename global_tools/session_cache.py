@@ -0,0 +1,172 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULTS = {
+  'MAX_ENTRIES': 10000,
+  'TTL': 60,
+  'ALIAS': None,
+}
+
+def get_setting(name):
+  return getattr(settings, 'SESSION_USER_CACHE', {}).get(name, DEFAULTS[name])
+
+class LocalSessionCache:
+  """In-process LRU mapping session ids to user rows.
+
+  Entries expire after the configured TTL or when the session itself expires,
+  whichever happens first. Other worker processes cannot invalidate them, so
+  callers still confirm the session row exists on a hit (``shared = False``).
+  """
+  shared = False
+
+  def __init__(self, max_entries, ttl):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.entries = OrderedDict()
+    self.user_sessions = {}
+    self.lock = threading.Lock()
+
+  def get(self, session_id):
+    with self.lock:
+      entry = self.entries.get(session_id)
+      if entry is None:
+        return None
+      user, deadline = entry
+      if deadline <= time.time():
+        self._remove(session_id)
+        return None
+      self.entries.move_to_end(session_id)
+    return copy.copy(user)
+
+  def set(self, session_id, user, expire_date):
+    deadline = min(time.time() + self.ttl, expire_date.timestamp())
+    with self.lock:
+      self._remove(session_id)
+      self.entries[session_id] = (copy.copy(user), deadline)
+      self.user_sessions.setdefault(user.id, set()).add(session_id)
+      while len(self.entries) > self.max_entries:
+        self._remove(next(iter(self.entries)))
+
+  async def aget(self, session_id):
+    return self.get(session_id)
+
+  async def aset(self, session_id, user, expire_date):
+    self.set(session_id, user, expire_date)
+
+  def delete(self, session_id):
+    with self.lock:
+      self._remove(session_id)
+
+  def delete_user(self, user_id):
+    with self.lock:
+      for session_id in list(self.user_sessions.get(user_id, ())):
+        self._remove(session_id)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.user_sessions.clear()
+
+  def _remove(self, session_id):
+    entry = self.entries.pop(session_id, None)
+    if entry is None:
+      return
+    user_id = entry[0].id
+    sessions = self.user_sessions.get(user_id)
+    if sessions is not None:
+      sessions.discard(session_id)
+      if not sessions:
+        del self.user_sessions[user_id]
+
+class SharedSessionCache:
+  """Session cache stored in a Django cache alias so every worker shares it.
+
+  Each entry records the user's generation number at the time it was stored;
+  invalidating a user bumps the generation instead of hunting down every one
+  of their sessions.
+  """
+  shared = True
+
+  def __init__(self, alias, ttl):
+    self.alias = alias
+    self.ttl = ttl
+
+  @property
+  def cache(self):
+    return caches[self.alias]
+
+  def session_key(self, session_id):
+    return f'session-user:{session_id}'
+
+  def generation_key(self, user_id):
+    return f'session-user-gen:{user_id}'
+
+  def get(self, session_id):
+    entry = self.cache.get(self.session_key(session_id))
+    if entry is None:
+      return None
+    user, generation, deadline = entry
+    if deadline <= time.time() or self.cache.get(self.generation_key(user.id), 0) != generation:
+      self.delete(session_id)
+      return None
+    return user
+
+  def set(self, session_id, user, expire_date):
+    deadline = min(time.time() + self.ttl, expire_date.timestamp())
+    generation = self.cache.get(self.generation_key(user.id), 0)
+    timeout = max(1, int(deadline - time.time()))
+    self.cache.set(self.session_key(session_id), (user, generation, deadline), timeout)
+
+  async def aget(self, session_id):
+    entry = await self.cache.aget(self.session_key(session_id))
+    if entry is None:
+      return None
+    user, generation, deadline = entry
+    if deadline <= time.time() or await self.cache.aget(self.generation_key(user.id), 0) != generation:
+      await self.cache.adelete(self.session_key(session_id))
+      return None
+    return user
+
+  async def aset(self, session_id, user, expire_date):
+    deadline = min(time.time() + self.ttl, expire_date.timestamp())
+    generation = await self.cache.aget(self.generation_key(user.id), 0)
+    timeout = max(1, int(deadline - time.time()))
+    await self.cache.aset(self.session_key(session_id), (user, generation, deadline), timeout)
+
+  def delete(self, session_id):
+    self.cache.delete(self.session_key(session_id))
+
+  def delete_user(self, user_id):
+    key = self.generation_key(user_id)
+    self.cache.add(key, 0, None)
+    try:
+      self.cache.incr(key)
+    except ValueError:
+      self.cache.set(key, 1, None)
+
+  def clear(self):
+    self.cache.clear()
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_session_cache():
+  global _backend
+  if _backend is None:
+    with _backend_lock:
+      if _backend is None:
+        if get_setting('ALIAS'):
+          _backend = SharedSessionCache(get_setting('ALIAS'), get_setting('TTL'))
+        else:
+          _backend = LocalSessionCache(get_setting('MAX_ENTRIES'), get_setting('TTL'))
+  return _backend
+
+def invalidate_session(session_id):
+  get_session_cache().delete(session_id)
+
+def invalidate_user(user):
+  get_session_cache().delete_user(user.id)
@@ -0,0 +1,93 @@
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core import signing
+from django.db.models import F
+from huddl.models import User
+from .session_cache import get_session_cache, invalidate_user
+
+DEFAULTS = {
+  'ENABLED': False,
+  'MAX_AGE': 60 * 60 * 24 * 14,
+}
+TOKEN_SALT = 'global_tools.tokens'
+
+def get_setting(name):
+  return getattr(settings, 'AUTH_TOKENS', {}).get(name, DEFAULTS[name])
+
+def tokens_enabled():
+  return get_setting('ENABLED')
+
+def issue_token(user):
+  """A signed token for ``user`` that expires after ``MAX_AGE`` seconds.
+
+  It stays valid until it expires or the user's ``token_version`` is bumped.
+  """
+  payload = {'u': user.id, 'v': user.token_version, 'e': int(time.time()) + get_setting('MAX_AGE')}
+  return signing.Signer(salt=TOKEN_SALT).sign_object(payload, compress=True)
+
+def read_token(token):
+  """``(user_id, version, expires)`` of a well-signed, unexpired token, else None."""
+  try:
+    payload = signing.Signer(salt=TOKEN_SALT).unsign_object(token)
+  except (signing.BadSignature, ValueError):
+    return None
+  if not isinstance(payload, dict) or payload.get('e', 0) <= time.time():
+    return None
+  return payload.get('u'), payload.get('v'), datetime.fromtimestamp(payload['e'], dt_timezone.utc)
+
+def request_token(request):
+  """The bearer token in the ``Authorization`` header, or the body's ``token`` field."""
+  scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+  if scheme.lower() == 'bearer' and token:
+    return token.strip()
+  return request.data.get('token')
+
+def cache_key(user_id, version):
+  return f'token:{user_id}:{version}'
+
+def current_holder(user_id, version):
+  return User.objects.filter(id=user_id, token_version=version)
+
+def find_token_user(token):
+  """Resolve a token's user, skipping the database while the user is cached."""
+  claims = read_token(token)
+  if claims is None:
+    return None
+  user_id, version, expires = claims
+  cache = get_session_cache()
+  user = cache.get(cache_key(user_id, version))
+  if user is not None:
+    # Other workers' revoke_tokens cannot reach a per-process cache, so check
+    # the version is still current (an indexed lookup on the primary key).
+    if cache.shared or current_holder(user_id, version).exists():
+      return user
+    cache.delete(cache_key(user_id, version))
+    return None
+  user = current_holder(user_id, version).first()
+  if user is not None:
+    cache.set(cache_key(user_id, version), user, expires)
+  return user
+
+async def afind_token_user(token):
+  claims = read_token(token)
+  if claims is None:
+    return None
+  user_id, version, expires = claims
+  cache = get_session_cache()
+  user = await cache.aget(cache_key(user_id, version))
+  if user is not None:
+    if cache.shared or await current_holder(user_id, version).aexists():
+      return user
+    cache.delete(cache_key(user_id, version))
+    return None
+  user = await current_holder(user_id, version).afirst()
+  if user is not None:
+    await cache.aset(cache_key(user_id, version), user, expires)
+  return user
+
+def revoke_tokens(user):
+  """Invalidate every token issued to ``user`` so far."""
+  User.objects.filter(id=user.id).update(token_version=F('token_version') + 1)
+  user.token_version += 1
+  invalidate_user(user)
@@ -1,14 +1,66 @@
 from huddl.models import User
 from django.contrib.sessions.models import Session
 from django.contrib.auth.models import AnonymousUser
+from django.utils import timezone
+from .session_cache import get_session_cache
+from .tokens import request_token, find_token_user, afind_token_user
+
+def live_sessions(session_id):
+  return Session.objects.filter(pk=session_id, expire_date__gt=timezone.now())
+
+def find_session_user(session_id):
+  cache = get_session_cache()
+  user = cache.get(session_id)
+  if user is not None:
+    # A per-process cache misses logouts handled by other workers; checking
+    # the session row by primary key still skips decoding it and the user query.
+    if cache.shared or live_sessions(session_id).exists():
+      return user
+    cache.delete(session_id)
+    return None
+  cur_session = live_sessions(session_id).first()
+  if not cur_session:
+    return None
+  user_id = cur_session.get_decoded().get('_auth_user_id')
+  user = User.objects.filter(id=user_id).first() if user_id else None
+  if user is not None:
+    cache.set(session_id, user, cur_session.expire_date)
+  return user
 
 def update_request_user(request):
-  session_id = request.data['sessionid'] if 'sessionid' in request.data else None
-  if session_id:
-    cur_session = Session.objects.filter(pk=session_id).first()
-    if cur_session:
-      request.user = User.objects.get(id=cur_session.get_decoded()['_auth_user_id'])
-    else:
-      request.user = AnonymousUser()
+  """Authenticate with a bearer token when one is sent, otherwise with ``sessionid``."""
+  token = request_token(request)
+  if token:
+    user = find_token_user(token)
+  else:
+    session_id = request.data.get('sessionid')
+    user = find_session_user(session_id) if session_id else None
+  request.user = user if user is not None else AnonymousUser()
+
+
+async def afind_session_user(session_id):
+  """``find_session_user`` for async views."""
+  cache = get_session_cache()
+  user = await cache.aget(session_id)
+  if user is not None:
+    if cache.shared or await live_sessions(session_id).aexists():
+      return user
+    cache.delete(session_id)
+    return None
+  cur_session = await live_sessions(session_id).afirst()
+  if not cur_session:
+    return None
+  user_id = cur_session.get_decoded().get('_auth_user_id')
+  user = await User.objects.filter(id=user_id).afirst() if user_id else None
+  if user is not None:
+    await cache.aset(session_id, user, cur_session.expire_date)
+  return user
+
+async def aupdate_request_user(request):
+  token = request_token(request)
+  if token:
+    user = await afind_token_user(token)
   else:
-    request.user = AnonymousUser()
\ No newline at end of file
+    session_id = request.data.get('sessionid')
+    user = await afind_session_user(session_id) if session_id else None
+  request.user = user if user is not None else AnonymousUser()
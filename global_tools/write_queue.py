@@ -0,0 +1,174 @@
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+from .metrics import get_metrics
+
+DEFAULTS = {
+  'ENABLED': False,
+  'MAX_BATCH': 32,
+  'BATCH_WINDOW': 0.002,
+  'TIMEOUT': 30.0,
+}
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+def get_setting(name):
+  return getattr(settings, 'WRITE_QUEUE', {}).get(name, DEFAULTS[name])
+
+class WriteQueueTimeout(Exception):
+  """A job waited ``WRITE_QUEUE['TIMEOUT']`` seconds without the writer starting it."""
+
+class WriteJob:
+  def __init__(self, fn, args, kwargs):
+    self.fn = fn
+    self.args = args
+    self.kwargs = kwargs
+    # Metrics and replica routing state follow the job to the writer thread.
+    self.context = contextvars.copy_context()
+    self.future = Future()
+    self.queued_at = time.perf_counter()
+
+  def run(self):
+    return self.context.run(self.fn, *self.args, **self.kwargs)
+
+class WriteQueue:
+  """Runs write transactions one after another on a single writer thread.
+
+  SQLite allows one writer at a time; rather than letting request threads
+  race for the lock, they hand their work to the writer and wait. Jobs that
+  arrive within ``batch_window`` seconds of each other, up to ``max_batch``
+  of them, share one transaction and so one commit (and one fsync). Each job
+  runs in its own savepoint, so a failing job rolls back only its own
+  changes. A view returning an error response keeps its writes, as it would
+  without the queue, unless it calls ``transaction.set_rollback(True)``.
+  """
+  def __init__(self, max_batch, batch_window, timeout):
+    self.max_batch = max_batch
+    self.batch_window = batch_window
+    self.timeout = timeout
+    self.jobs = queue.SimpleQueue()
+    self.lock = threading.Lock()
+    self.thread = None
+    self.pid = None
+
+  def ensure_writer(self):
+    with self.lock:
+      if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+        self.jobs = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.serve, name='huddl-db-writer', daemon=True)
+        self.pid = os.getpid()
+        self.thread.start()
+
+  def submit(self, fn, *args, **kwargs):
+    """Run ``fn`` on the writer thread and return its result (or raise its exception).
+
+    Raises ``WriteQueueTimeout`` if the writer has not started the job within
+    ``timeout`` seconds; the job is then dropped. A job already running is
+    waited for, since its transaction may be about to commit.
+    """
+    if threading.current_thread() is self.thread:
+      return fn(*args, **kwargs)
+    self.ensure_writer()
+    job = WriteJob(fn, args, kwargs)
+    self.jobs.put(job)
+    try:
+      return job.future.result(timeout=self.timeout)
+    except FutureTimeoutError:
+      if job.future.cancel():
+        raise WriteQueueTimeout() from None
+    return job.future.result()
+
+  def next_batch(self):
+    batch = [self.jobs.get()]
+    deadline = time.perf_counter() + self.batch_window
+    while len(batch) < self.max_batch:
+      remaining = deadline - time.perf_counter()
+      try:
+        batch.append(self.jobs.get(timeout=remaining) if remaining > 0 else self.jobs.get_nowait())
+      except queue.Empty:
+        break
+    return batch
+
+  def serve(self):
+    while True:
+      self.commit(self.next_batch())
+
+  def commit(self, batch):
+    # Jobs whose callers gave up waiting have been cancelled; skip them.
+    batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+    if not batch:
+      return
+    metrics = get_metrics()
+    started = time.perf_counter()
+    for job in batch:
+      metrics.observe('huddl_write_queue_wait_seconds', (), started - job.queued_at, WAIT_BUCKETS)
+    metrics.observe('huddl_write_batch_size', (), len(batch), BATCH_BUCKETS)
+    outcomes = []
+    try:
+      with transaction.atomic():
+        for job in batch:
+          try:
+            with transaction.atomic():
+              outcomes.append((job.run(), None))
+          except Exception as exc:
+            outcomes.append((None, exc))
+    except Exception as exc:
+      # The commit itself failed, so none of the batch's changes were kept.
+      outcomes = [(None, error or exc) for _, error in outcomes]
+      outcomes += [(None, exc)] * (len(batch) - len(outcomes))
+      connections[DEFAULT_DB_ALIAS].close()
+    finally:
+      connections[DEFAULT_DB_ALIAS].close_if_unusable_or_obsolete()
+    for job, (result, error) in zip(batch, outcomes, strict=True):
+      if error is not None:
+        job.future.set_exception(error)
+      else:
+        job.future.set_result(result)
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+def get_write_queue():
+  global _write_queue
+  if _write_queue is None:
+    with _write_queue_lock:
+      if _write_queue is None:
+        _write_queue = WriteQueue(get_setting('MAX_BATCH'), get_setting('BATCH_WINDOW'),
+                                  get_setting('TIMEOUT'))
+  return _write_queue
+
+def queues_writes(view_func):
+  view_class = getattr(view_func, 'view_class', None)
+  if view_class is None or iscoroutinefunction(view_func):
+    return False
+  return getattr(view_class, 'queue_writes', True)
+
+class WriteQueueMiddleware(MiddlewareMixin):
+  """Run mutating views on the ``WriteQueue`` when ``WRITE_QUEUE['ENABLED']``.
+
+  Safe methods and async views run in place against the WAL snapshot, as do
+  views with ``queue_writes = False``: those that never write (the
+  ``read_only`` ones) and those that hash passwords, which would hold up
+  every other writer. A request left waiting ``WRITE_QUEUE['TIMEOUT']``
+  seconds gets a 503.
+  """
+  def process_view(self, request, view_func, view_args, view_kwargs):
+    if not get_setting('ENABLED') or request.method in SAFE_METHODS:
+      return None
+    if not queues_writes(view_func):
+      return None
+    try:
+      return get_write_queue().submit(view_func, request, *view_args, **view_kwargs)
+    except WriteQueueTimeout:
+      response = JsonResponse({'detail': 'The server is busy, try again shortly.'}, status=503)
+      response['Retry-After'] = '1'
+      return response
@@ -1,5 +1,6 @@
 from django.contrib.auth.backends import ModelBackend
 from .models import User
+from global_tools.hashing import verify_password
 
 class UserBackend(ModelBackend):
     def authenticate(self, request, username=None, password=None, email=None, **kwargs):
@@ -13,6 +14,6 @@ class UserBackend(ModelBackend):
             user = User.objects.filter(username=username, email=email).first()
         if user is None:
             return None
-        if user.check_password(password):
+        if verify_password(user, password):
             return user
         return None
\ No newline at end of file
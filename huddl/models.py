@@ -2,6 +2,11 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from datetime import timedelta
 
+# Fields needed by to_dict(), so serializers can defer the rest of the row.
+USER_DICT_FIELDS = ('id', 'username', 'email', 'full_name', 'is_staff',
+                    'default_budget_limit', 'default_max_time')
+CLUB_SUMMARY_FIELDS = ('id', 'name', 'description', 'owner')
+
 # Create your models here.
 class User(AbstractUser):
     username = models.CharField(max_length=255, unique=True)
@@ -13,6 +18,8 @@ class User(AbstractUser):
     default_budget_limit = models.DecimalField(default=50, decimal_places=2,
                                                max_digits=10)
     default_max_time = models.DurationField(default=timedelta(hours=2))
+    # Bumped to revoke every bearer token issued to the user, see global_tools/tokens.py.
+    token_version = models.PositiveIntegerField(default=0)
 
     REQUIRED_FIELDS = ['email', 'full_name']
 
@@ -26,13 +33,29 @@ class User(AbstractUser):
             'default_max_time': self.default_max_time
         }
         if clubs_owned:
-            ret['groups_owned'] = [club.to_dict() for club in self.clubs_owned.all()]
+            ret['groups_owned'] = [club.to_dict() for club in self.clubs_owned.only(*CLUB_SUMMARY_FIELDS)]
         if clubs_managing:
-            ret['groups_managed'] = [club.to_dict() for club in self.clubs_managing.all()]
+            ret['groups_managed'] = [club.to_dict() for club in self.clubs_managing.only(*CLUB_SUMMARY_FIELDS)]
         if clubs_in:
-            ret['groups_in'] = [club.to_dict() for club in self.clubs_in.all()]
+            ret['groups_in'] = [club.to_dict() for club in self.clubs_in.only(*CLUB_SUMMARY_FIELDS)]
         return ret
 
+    async def ato_dict(self, clubs_owned=False, clubs_managing=False, clubs_in=False):
+        ret = self.to_dict()
+        if clubs_owned:
+            ret['groups_owned'] = [club.to_dict() async for club in self.clubs_owned.only(*CLUB_SUMMARY_FIELDS)]
+        if clubs_managing:
+            ret['groups_managed'] = [club.to_dict() async for club in self.clubs_managing.only(*CLUB_SUMMARY_FIELDS)]
+        if clubs_in:
+            ret['groups_in'] = [club.to_dict() async for club in self.clubs_in.only(*CLUB_SUMMARY_FIELDS)]
+        return ret
+
+    def to_dict_cached(self, user_dicts):
+        """Like ``to_dict()``, but reuses the dict already built for this user in ``user_dicts``."""
+        if self.id not in user_dicts:
+            user_dicts[self.id] = self.to_dict()
+        return user_dicts[self.id]
+
 class UserManager(BaseUserManager):
     def create_user(self, username, full_name, email, password=None, 
                     is_staff=False, **extra_fields):
@@ -0,0 +1,62 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from .models import User
+
+DUPLICATE_MESSAGES = {
+  'username': "Username already exists",
+  'email': "Email already exists",
+}
+
+def build_user(username, email, full_name, password, default_budget_limit=None,
+               default_max_time=None):
+  """An unsaved user, set up the way ``User.objects.create_user`` would.
+
+  ``password`` must already be hashed.
+  """
+  user = User(username=User.normalize_username(username),
+              email=User.objects.normalize_email(email), full_name=full_name,
+              password=password, is_staff=False, is_superuser=False)
+  if default_budget_limit:
+    user.default_budget_limit = default_budget_limit
+  if default_max_time:
+    user.default_max_time = default_max_time
+  return user
+
+def duplicate_errors(users):
+  """Field errors for ``users`` whose username or email is already taken.
+
+  Returns a dict mapping each conflicting user's index to its errors.
+  """
+  taken = User.objects.filter(Q(username__in=[user.username for user in users]) |
+                              Q(email__in=[user.email for user in users]))
+  usernames = set()
+  emails = set()
+  for username, email in taken.values_list('username', 'email'):
+    usernames.add(username)
+    emails.add(email)
+  errors = {}
+  for index, user in enumerate(users):
+    fields = {}
+    if user.username in usernames:
+      fields['username'] = [DUPLICATE_MESSAGES['username']]
+    if user.email in emails:
+      fields['email'] = [DUPLICATE_MESSAGES['email']]
+    if fields:
+      errors[index] = fields
+  return errors
+
+def insert_user(user):
+  """Insert ``user`` with a single write; returns field errors if a unique field is taken.
+
+  The unique constraints do the checking, so only a failed insert costs a
+  lookup to tell which field clashed.
+  """
+  try:
+    with transaction.atomic():
+      user.save(force_insert=True)
+  except IntegrityError:
+    errors = duplicate_errors([user]).get(0)
+    if errors is None:
+      raise
+    return errors
+  return None
@@ -1,3 +1,387 @@
-from django.test import TestCase
+import json
+import os
+import sqlite3
+import threading
+from datetime import timedelta
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.db import OperationalError, connection, connections, transaction
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from club.models import Activity, Club
+from global_tools import benchmark, hashing, metrics, write_queue
+from global_tools import session_cache
+from global_tools.session_cache import get_session_cache, invalidate_user
+from global_tools.tokens import afind_token_user, find_token_user, issue_token
+from global_tools.user_find import afind_session_user, find_session_user
+from .models import User
 
-# Create your tests here.
+def login_session(user):
+  session = SessionStore()
+  session['_auth_user_id'] = str(user.id)
+  session.create()
+  return session.session_key
+
+class SessionUserCacheTests(TestCase):
+  def setUp(self):
+    get_session_cache().clear()
+    self.user = User.objects.create(username='ada', email='ada@example.com', full_name='Ada',
+                                    is_staff=False)
+    self.session_id = login_session(self.user)
+
+  def tearDown(self):
+    get_session_cache().clear()
+
+  def test_cached_user_is_returned(self):
+    self.assertEqual(find_session_user(self.session_id), self.user)
+    # A per-process cache still confirms the session row, see SharedSessionCacheTests.
+    with self.assertNumQueries(1):
+      self.assertEqual(find_session_user(self.session_id), self.user)
+
+  def test_session_deleted_elsewhere_is_not_served_from_cache(self):
+    # Another worker's Logout deletes the row but cannot reach this process's cache.
+    find_session_user(self.session_id)
+    Session.objects.filter(pk=self.session_id).delete()
+    self.assertIsNone(find_session_user(self.session_id))
+    self.assertIsNone(get_session_cache().get(self.session_id))
+
+  def test_async_lookup_rechecks_the_session(self):
+    self.assertEqual(async_to_sync(afind_session_user)(self.session_id), self.user)
+    Session.objects.filter(pk=self.session_id).delete()
+    self.assertIsNone(async_to_sync(afind_session_user)(self.session_id))
+
+@override_settings(CACHES={
+  'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+  'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+}, SESSION_USER_CACHE={'MAX_ENTRIES': 100, 'TTL': 60, 'ALIAS': 'shared'})
+class SharedSessionCacheTests(TestCase):
+  def setUp(self):
+    session_cache._backend = None
+    get_session_cache().clear()
+    self.user = User.objects.create(username='ada', email='ada@example.com', full_name='Ada',
+                                    is_staff=False)
+    self.session_id = login_session(self.user)
+
+  def tearDown(self):
+    get_session_cache().clear()
+    session_cache._backend = None
+
+  def signed_in(self):
+    response = self.client.post('/signed-in', json.dumps({'sessionid': self.session_id}),
+                                content_type='application/json')
+    return response.json()['signed-in']
+
+  def test_hits_need_no_query(self):
+    self.assertTrue(get_session_cache().shared)
+    self.assertTrue(self.signed_in())
+    with self.assertNumQueries(0):
+      self.assertTrue(self.signed_in())
+    with self.assertNumQueries(0):
+      self.assertEqual(async_to_sync(afind_session_user)(self.session_id), self.user)
+
+  def test_invalidated_users_are_looked_up_again(self):
+    find_session_user(self.session_id)
+    invalidate_user(self.user)
+    with self.assertNumQueries(2):
+      self.assertEqual(find_session_user(self.session_id), self.user)
+
+  def test_logout_ends_the_session_everywhere(self):
+    self.assertTrue(self.signed_in())
+    response = self.client.post('/logout', json.dumps({'sessionid': self.session_id}),
+                                content_type='application/json')
+    self.assertEqual(response.status_code, 200)
+    self.assertFalse(self.signed_in())
+
+class TokenCacheTests(TestCase):
+  def setUp(self):
+    get_session_cache().clear()
+    self.user = User.objects.create(username='ada', email='ada@example.com', full_name='Ada',
+                                    is_staff=False)
+    self.token = issue_token(self.user)
+
+  def tearDown(self):
+    get_session_cache().clear()
+
+  def test_token_revoked_elsewhere_is_not_served_from_cache(self):
+    self.assertEqual(find_token_user(self.token), self.user)
+    # Another worker's revoke_tokens bumps the version but cannot reach this cache.
+    User.objects.filter(id=self.user.id).update(token_version=self.user.token_version + 1)
+    self.assertIsNone(find_token_user(self.token))
+
+  def test_async_lookup_rechecks_the_version(self):
+    self.assertEqual(async_to_sync(afind_token_user)(self.token), self.user)
+    User.objects.filter(id=self.user.id).update(token_version=self.user.token_version + 1)
+    self.assertIsNone(async_to_sync(afind_token_user)(self.token))
+
+class RecordingQueue(write_queue.WriteQueue):
+  def __init__(self, *args):
+    super().__init__(*args)
+    self.batches = []
+
+  def commit(self, batch):
+    self.batches.append(len(batch))
+    super().commit(batch)
+
+def make_user(name):
+  return User.objects.create(username=name, email=f'{name}@example.com', full_name=name.title(),
+                             is_staff=False)
+
+class RefusingWrite(APIView):
+  """Writes, then refuses the request; ``rollback`` undoes the write first."""
+  rollback = False
+
+  def post(self, request):
+    make_user(request.data['username'])
+    if self.rollback:
+      transaction.set_rollback(True)
+    raise ValidationError('refused after writing')
+
+@override_settings(WRITE_QUEUE={'ENABLED': True, 'MAX_BATCH': 8, 'BATCH_WINDOW': 0.05,
+                                'TIMEOUT': 5.0})
+class WriteQueueTests(TransactionTestCase):
+  """The queue against the on-disk test database, with its writer thread."""
+  def setUp(self):
+    self.queue = write_queue._write_queue = RecordingQueue(8, 0.05, 5.0)
+
+  def tearDown(self):
+    write_queue._write_queue = None
+
+  def run_batch(self, *fns):
+    jobs = [write_queue.WriteJob(fn, (), {}) for fn in fns]
+    self.queue.commit(jobs)
+    return [job.future for job in jobs]
+
+  def hold_writer(self):
+    """Occupy the writer until the returned event is set."""
+    self.holding, release = threading.Event(), threading.Event()
+    def hold():
+      self.holding.set()
+      release.wait(5)
+      self.holding.clear()
+    thread = threading.Thread(target=self.queue.submit, args=(hold,))
+    thread.start()
+    self.assertTrue(self.holding.wait(5))
+    self.addCleanup(thread.join)
+    self.addCleanup(release.set)
+    return release
+
+  def in_threads(self, fns):
+    results = [None] * len(fns)
+    def run(index, fn):
+      try:
+        results[index] = fn()
+      finally:
+        connections.close_all()
+    threads = [threading.Thread(target=run, args=(index, fn)) for index, fn in enumerate(fns)]
+    for thread in threads:
+      thread.start()
+    return threads, results
+
+  def test_a_failing_job_rolls_back_only_itself(self):
+    def fail():
+      make_user('bob')
+      raise RuntimeError('boom')
+    first, failed, last = self.run_batch(lambda: make_user('ada'), fail, lambda: make_user('cat'))
+    self.assertEqual(first.result().username, 'ada')
+    self.assertRaisesMessage(RuntimeError, 'boom', failed.result)
+    self.assertEqual(last.result().username, 'cat')
+    self.assertEqual(set(User.objects.values_list('username', flat=True)), {'ada', 'cat'})
+
+  def refuse(self, username, rollback):
+    request = RequestFactory().post('/refuse', json.dumps({'username': username}),
+                                    content_type='application/json')
+    return lambda: RefusingWrite.as_view(rollback=rollback)(request)
+
+  def test_set_rollback_undoes_only_its_own_job(self):
+    _, refused, _ = self.run_batch(lambda: make_user('ada'), self.refuse('bob', True),
+                                   lambda: make_user('cat'))
+    self.assertEqual(refused.result().status_code, 400)
+    self.assertEqual(set(User.objects.values_list('username', flat=True)), {'ada', 'cat'})
+
+  def test_error_responses_keep_their_writes_as_without_the_queue(self):
+    # DRF only rolls back for an APIException under ATOMIC_REQUESTS.
+    (refused,) = self.run_batch(self.refuse('bob', False))
+    self.assertEqual(refused.result().status_code, 400)
+    self.assertTrue(User.objects.filter(username='bob').exists())
+
+  def test_a_failed_commit_fails_the_whole_batch(self):
+    with mock.patch.object(connection, 'commit', side_effect=OperationalError('disk I/O error')):
+      futures = self.run_batch(lambda: make_user('ada'), lambda: make_user('bob'))
+    for future in futures:
+      self.assertRaisesMessage(OperationalError, 'disk I/O error', future.result)
+    self.assertFalse(User.objects.exists())
+
+  def test_concurrent_requests_share_a_commit(self):
+    owner = make_user('ada')
+    club = Club.objects.create(owner=owner, name='Chess')
+    club.members.add(owner)
+    session_id = login_session(owner)
+    outsider_session = login_session(make_user('bob'))
+    def add(name, session):
+      body = {'sessionid': session, 'id': club.id, 'name': name, 'time': '01:00:00'}
+      return Client().post('/groups/add-activity', json.dumps(body),
+                           content_type='application/json')
+    release = self.hold_writer()
+    requests = [lambda index=index: add(f'game {index}', session_id) for index in range(5)]
+    threads, responses = self.in_threads(requests + [lambda: add('intruder', outsider_session)])
+    while self.queue.jobs.qsize() < len(threads):
+      threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+      thread.join()
+    self.assertEqual([response.status_code for response in responses], [201] * 5 + [404])
+    self.assertEqual(self.queue.batches, [1, 6])
+    self.assertEqual(sorted(Activity.objects.values_list('name', flat=True)),
+                     [f'game {index}' for index in range(5)])
+    club.refresh_from_db()
+    self.assertEqual(club.version, 6)
+
+  def test_requests_not_started_in_time_get_a_503(self):
+    owner = make_user('ada')
+    session_id = login_session(owner)
+    self.queue.timeout = 0.1
+    release = self.hold_writer()
+    response = self.client.post('/groups/create', json.dumps({'sessionid': session_id,
+                                                               'name': 'Chess'}),
+                                content_type='application/json')
+    self.assertEqual(response.status_code, 503)
+    self.assertEqual(response['Retry-After'], '1')
+    self.queue.timeout = 5.0
+    release.set()
+    # The dropped request is never run once the writer frees up.
+    self.queue.submit(lambda: None)
+    self.assertFalse(Club.objects.exists())
+
+  def test_read_only_views_run_in_place(self):
+    session_id = login_session(make_user('ada'))
+    self.hold_writer()
+    response = self.client.post('/groups/get-groups-in', json.dumps({'sessionid': session_id}),
+                                content_type='application/json')
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(self.holding.is_set())
+
+class TransactionModeTests(TransactionTestCase):
+  """How the SQLite backend begins transactions, seen from a second connection."""
+  def other_writer_blocked(self):
+    other = sqlite3.connect(connection.settings_dict['NAME'], timeout=0)
+    try:
+      other.execute('BEGIN IMMEDIATE')
+    except sqlite3.OperationalError:
+      return True
+    else:
+      other.rollback()
+      return False
+    finally:
+      other.close()
+
+  def test_connections_use_wal(self):
+    with connection.cursor() as cursor:
+      cursor.execute('PRAGMA journal_mode')
+      self.assertEqual(cursor.fetchone()[0], 'wal')
+
+  def test_atomic_takes_the_write_lock_up_front(self):
+    with transaction.atomic():
+      User.objects.exists()
+      self.assertTrue(self.other_writer_blocked())
+    self.assertFalse(self.other_writer_blocked())
+
+  def test_deferred_override_reads_without_the_lock(self):
+    with connection.override_transaction_mode('DEFERRED'), transaction.atomic():
+      User.objects.exists()
+      self.assertFalse(self.other_writer_blocked())
+    with transaction.atomic():
+      self.assertTrue(self.other_writer_blocked())
+
+  def test_unknown_modes_fall_back_to_deferred(self):
+    with connection.override_transaction_mode('sometimes'), transaction.atomic():
+      self.assertFalse(self.other_writer_blocked())
+
+@override_settings(PASSWORD_HASHING={'WORKERS': 0, 'MAX_CONCURRENT': 1, 'MAX_QUEUE': 1,
+                                     'QUEUE_TIMEOUT': 5.0, 'RETRY_AFTER': 7})
+class HashPoolSaturationTests(TestCase):
+  def setUp(self):
+    hashing._pool = None
+    self.pool = hashing.get_hash_pool()
+    self.metrics = metrics.Metrics(metrics.MemoryStore(), 3600)
+    patcher = mock.patch.object(metrics, '_metrics', self.metrics)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def tearDown(self):
+    hashing._pool = None
+
+  def register(self, name):
+    return self.client.post('/register', json.dumps({
+      'username': name, 'email': f'{name}@example.com', 'full_name': name.title(),
+      'password': 'correct horse battery staple'}), content_type='application/json')
+
+  def depth(self):
+    return self.metrics.gauges[('huddl_password_hash_queue_depth', f'pid="{os.getpid()}"')]
+
+  def rejected(self):
+    return self.metrics.pending[('huddl_password_hash_rejected_total', '')]
+
+  def occupy(self, count):
+    """Start ``count`` hashes that block until the returned event is set."""
+    release = threading.Event()
+    threads = [threading.Thread(target=self.pool.run, args=(release.wait, 5))
+               for _ in range(count)]
+    for thread in threads:
+      thread.start()
+    while self.pool.depth < count:
+      threading.Event().wait(0.01)
+    def finish():
+      release.set()
+      for thread in threads:
+        thread.join()
+    self.addCleanup(finish)
+    return finish
+
+  def test_full_queue_is_refused_at_once(self):
+    finish = self.occupy(2)
+    self.assertEqual(self.depth(), 2)
+    response = self.register('ada')
+    self.assertEqual(response.status_code, 503)
+    self.assertEqual(response['Retry-After'], '7')
+    self.assertEqual(self.rejected(), 1)
+    self.assertFalse(User.objects.exists())
+    finish()
+    self.assertEqual(self.depth(), 0)
+    self.assertEqual(self.register('ada').status_code, 201)
+
+  def test_waiting_past_the_timeout_is_refused(self):
+    self.pool.queue_timeout = 0.05
+    finish = self.occupy(1)
+    response = self.register('ada')
+    self.assertEqual(response.status_code, 503)
+    self.assertEqual(response['Retry-After'], '7')
+    self.assertEqual(self.rejected(), 1)
+    # The caller that gave up no longer counts as waiting.
+    self.assertEqual(self.depth(), 1)
+    finish()
+    self.assertEqual(self.register('ada').status_code, 201)
+
+class BenchmarkTests(TestCase):
+  def setUp(self):
+    self.data = benchmark.Dataset(scale=0.05)
+    self.data.seed_database()
+
+  def test_metrics_are_scraped_with_the_token(self):
+    results, _ = benchmark.run(self.data, iterations=1, warmup=0, only=['metrics'])
+    self.assertEqual(results['metrics']['statuses'], {'200': 1})
+
+  def test_streams_are_left_out(self):
+    results, skipped = benchmark.run(self.data, iterations=1, warmup=0, only=['club_stream'])
+    self.assertEqual(results, {})
+    self.assertEqual(skipped, ['club_stream'])
+
+  def test_compare_flags_error_responses(self):
+    results, _ = benchmark.run(self.data, iterations=1, warmup=0, only=['my_info'])
+    self.assertEqual(benchmark.compare(results, results, 1.5), [])
+    results['my_info']['statuses'] = {'200': 1, '403': 2}
+    self.assertEqual(benchmark.compare(results, {}, 1.5),
+                     ["my_info: non-2xx statuses {'403': 2}"])
@@ -1,11 +1,12 @@
 from django.urls import path
-from .views import Login, Register, Logout, MyInfo, UpdateInfo, SignedIn
+from .views import Login, Register, Logout, MyInfo, UpdateInfo, SignedIn, AsyncMyInfo, AsyncSignedIn
+from global_tools.async_views import read_view
 
 urlpatterns = [
   path('login', Login.as_view(), name='login'),
   path('register', Register.as_view(), name='register'),
   path('logout', Logout.as_view(), name='logout'),
-  path('my-info', MyInfo.as_view(), name='my_info'),
+  path('my-info', read_view(MyInfo, AsyncMyInfo), name='my_info'),
   path('update-info', UpdateInfo.as_view(), name='update_info'),
-  path('signed-in', SignedIn.as_view(), name='signed_in')
+  path('signed-in', read_view(SignedIn, AsyncSignedIn), name='signed_in')
 ]
\ No newline at end of file
@@ -1,5 +1,7 @@
 from django.core.exceptions import ValidationError
 from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import Q
 from django.shortcuts import render
 from rest_framework import serializers, status
 from rest_framework.views import APIView
@@ -8,7 +10,14 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth import password_validation
 from .models import User
 from .mixins import LoginAndValidateMixin
-from global_tools.user_find import update_request_user
+from .registration import build_user, insert_user
+from club.models import Club
+from club.versioning import record_changes
+from global_tools.user_find import update_request_user, aupdate_request_user
+from global_tools.async_views import AsyncAPIView
+from global_tools.session_cache import invalidate_session, invalidate_user
+from global_tools.hashing import hash_password, verify_password
+from global_tools.tokens import tokens_enabled, issue_token, request_token, revoke_tokens
 
 
 class LoginSerializer(serializers.Serializer):
@@ -18,6 +27,7 @@ class LoginSerializer(serializers.Serializer):
 
 # Create your views here.
 class Login(APIView):
+  queue_writes = False
 
   def post(self, request, *args, **kwargs):
     serializer = LoginSerializer(data=request.data)
@@ -31,6 +41,9 @@ class Login(APIView):
         user = authenticate(email=email, password=password)
 
         if user is not None:
+          if tokens_enabled():
+            return Response({"detail": "Login Successful", "token": issue_token(user)},
+                            status=status.HTTP_200_OK)
           login(request, user)
           session_id = request.session.session_key
           response = Response(
@@ -58,15 +71,8 @@ class BasicRegistrationSerializer(serializers.Serializer):
                                              max_digits=10)
   default_max_time = serializers.DurationField(required=False)
 
-  def validate_username(self, value):
-    if User.objects.filter(username=value).exists():
-      raise ValidationError("Username already exists")
-    return value
-
-  def validate_email(self, value):
-    if User.objects.filter(email=value).exists():
-      raise ValidationError("Email already exists")
-    return value
+  # Taken usernames and emails are reported by insert_user from the unique
+  # constraints instead of being looked up here first.
 
   def validate_password(self, value):
     try:
@@ -76,24 +82,24 @@ class BasicRegistrationSerializer(serializers.Serializer):
     return value
 
 class Register(APIView):
+  queue_writes = False
   def post(self, request, *args, **kwargs):
     serializer = BasicRegistrationSerializer(data=request.data)
     if serializer.is_valid():
       validated_data = serializer.validated_data
       if validated_data:
-        username = validated_data.get('username')
-        email = validated_data.get('email')
-        full_name = validated_data.get('full_name')
-        password = validated_data.get('password')
-        user = User.objects.create_user(username=username,
-                                        email=email,
-                                        full_name=full_name,
-                                        password=password)
-        if validated_data.get('default_budget_limit'):
-          user.default_budget_limit = validated_data.get('default_budget_limit')
-        if validated_data.get('default_max_time'):
-          user.default_max_time = validated_data.get('default_max_time')
-        user.save()
+        user = build_user(validated_data.get('username'),
+                          validated_data.get('email'),
+                          validated_data.get('full_name'),
+                          hash_password(validated_data.get('password')),
+                          validated_data.get('default_budget_limit'),
+                          validated_data.get('default_max_time'))
+        errors = insert_user(user)
+        if errors:
+          return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        if tokens_enabled():
+          return Response({"detail": "User Created", "token": issue_token(user)},
+                          status=status.HTTP_201_CREATED)
         login(request, user)
         session_id = request.session.session_key
         response = Response(
@@ -112,13 +118,19 @@ class Logout(APIView):
   def post(self, request):
     update_request_user(request)
     if request.user.is_authenticated:
-      Session.objects.filter(pk=request.data['sessionid']).delete()
+      if request_token(request):
+        revoke_tokens(request.user)
+      else:
+        Session.objects.filter(pk=request.data['sessionid']).delete()
+        invalidate_session(request.data['sessionid'])
       return Response({"detail": "logged out"}, status=status.HTTP_200_OK)
     else:
       return Response({"detail": "not logged in"}, status=status.HTTP_202_ACCEPTED)
 
 
 class MyInfo(APIView):
+  read_only = True
+  queue_writes = False
 
   def post(self, request, *args, **kwargs):
     update_request_user(request)
@@ -132,6 +144,22 @@ class MyInfo(APIView):
                       status=status.HTTP_400_BAD_REQUEST)
 
 
+class AsyncMyInfo(AsyncAPIView):
+  read_only = True
+  queue_writes = False
+
+  async def post(self, request, *args, **kwargs):
+    await aupdate_request_user(request)
+    if request.user.is_authenticated:
+      return Response(await request.user.ato_dict(clubs_owned=True,
+                                                  clubs_managing=True,
+                                                  clubs_in=True),
+                      status=status.HTTP_200_OK)
+    else:
+      return Response({"detail": "not logged in"},
+                      status=status.HTTP_400_BAD_REQUEST)
+
+
 class UpdateInfoSerializer(serializers.Serializer):
   username = serializers.CharField(max_length=255, required=False)
   full_name = serializers.CharField(max_length=255, required=False)
@@ -147,7 +175,7 @@ class UpdateInfoSerializer(serializers.Serializer):
     return value
 
   def validate_old_password(self, value):
-    if not self.context.get('user').check_password(value):
+    if not verify_password(self.context.get('user'), value):
       raise ValidationError("Old Password is incorrect")
     return value
 
@@ -165,6 +193,7 @@ class UpdateInfoSerializer(serializers.Serializer):
 
 
 class UpdateInfo(LoginAndValidateMixin, APIView):
+  queue_writes = False
   def post(self, request, *args, **kwargs):
     update_request_user(request)
     serializer = UpdateInfoSerializer(data=request.data,
@@ -174,28 +203,49 @@ class UpdateInfo(LoginAndValidateMixin, APIView):
       return response
 
     data = serializer.validated_data
-    if data.get('new_password') and not request.user.check_password(
-        data.get('old_password')):
+    # validate_old_password has already checked old_password when it was sent.
+    if data.get('new_password') and not data.get('old_password'):
       return Response({"detail": "old password is incorrect"},
                       status=status.HTTP_400_BAD_REQUEST)
 
-    if data.get('username'):
-      request.user.username = data.get('username')
-    if data.get('full_name'):
-      request.user.full_name = data.get('full_name')
+    # Only write the submitted fields: request.user may be a cached copy, and
+    # saving its stale token_version would undo a revocation.
+    fields = [field for field in ('username', 'full_name', 'default_budget_limit',
+                                  'default_max_time') if data.get(field)]
+    for field in fields:
+      setattr(request.user, field, data.get(field))
+    if data.get('new_password'):
+      request.user.password = hash_password(data.get('new_password'))
+      fields.append('password')
+    if fields:
+      with transaction.atomic():
+        request.user.save(update_fields=fields)
+        # Member lists embed user dicts, so the clubs' cached reads are stale now.
+        record_changes(Club.objects.filter(Q(owner=request.user) | Q(admin=request.user) |
+                                           Q(members=request.user)),
+                       'member.updated', {'user': request.user.to_dict()})
     if data.get('new_password'):
-      request.user.set_password(data.get('new_password'))
-    if data.get('default_budget_limit'):
-      request.user.default_budget_limit = data.get('default_budget_limit')
-    if data.get('default_max_time'):
-      request.user.default_max_time = data.get('default_max_time')
-    request.user.save()
+      revoke_tokens(request.user)
+    else:
+      invalidate_user(request.user)
     return Response({"detail": "user updated"}, status=status.HTTP_200_OK)
 
 
 class SignedIn(APIView):
+  read_only = True
+  queue_writes = False
 
   def post(self, request, *args, **kwargs):
     update_request_user(request)
     return Response({"signed-in": request.user.is_authenticated},
                     status=status.HTTP_200_OK)
+
+
+class AsyncSignedIn(AsyncAPIView):
+  read_only = True
+  queue_writes = False
+
+  async def post(self, request, *args, **kwargs):
+    await aupdate_request_user(request)
+    return Response({"signed-in": request.user.is_authenticated},
+                    status=status.HTTP_200_OK)